@@ -0,0 +1,222 @@
+"""
+End-to-end benchmark of a run of the validator against a generated SQLite
+database with hundreds of YAML tests.
+
+    python benchmarks/bench_end_to_end.py --tests 500 --rows 100k \
+        --modes threads async batch --output end_to_end.json
+
+Every run is a separate `python main.py` process, configured through the
+environment like in production, with a cold test cache first and a warm
+one after. Durations come from the run's summary, peak memory is the
+maximum resident set size of the process.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import yaml
+from common import (STATUSES, VALIDATOR_DIR, compare_results, generate_rows,
+                    parse_sizes, save_results)
+
+MODES = {
+    'threads': {},
+    'async': {'ASYNC_MODE': 'true'},
+    'batch': {'BATCH_MODE': 'true'},
+    'pushdown': {'PUSHDOWN': 'true'},
+    'stream': {'STREAM_RESULTS': 'true'}
+}
+
+QUERIES = [
+    "SELECT id, email, status FROM users",
+    "SELECT id, email, status FROM users WHERE status = '{status}'",
+    "SELECT id, email, status FROM users WHERE id < {limit}",
+    "SELECT status, COUNT(*) AS total FROM users GROUP BY status"
+]
+
+
+def create_database(path, args):
+    """Create the `users` table with generated rows."""
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE users (id INTEGER, email TEXT, "
+                     "status TEXT)")
+        for batch in generate_rows(args.rows, args.null_ratio,
+                                   args.duplicate_ratio, args.seed):
+            conn.executemany("INSERT INTO users VALUES (?, ?, ?)", batch)
+    conn.close()
+
+
+def generate_test(index, rng, rows):
+    query = rng.choice(QUERIES).format(
+        status=rng.choice(STATUSES), limit=rng.randrange(1, rows + 1))
+    assertions = rng.choice([
+        {'no_nulls': ['id']},
+        {'no_nulls': ['email']},
+        {'has': [{'column': 'status', 'values': list(STATUSES[:2])}]},
+        {'missing': [{'column': 'status', 'values': ['deleted']}]},
+        {'count': rows}
+    ])
+    if query.startswith("SELECT status, COUNT(*)"):
+        assertions = {'count': len(STATUSES)}
+
+    return {'name': f'test {index}', 'query': query, 'assertions': assertions}
+
+
+def write_tests(path, args):
+    """Write the tests to YAML files of `--tests-per-file` documents each."""
+
+    rng = random.Random(args.seed)
+    tests = [generate_test(index, rng, args.rows)
+             for index in range(args.tests)]
+
+    for start in range(0, len(tests), args.tests_per_file):
+        with open(os.path.join(path, f'tests_{start:05}.yml'), 'w',
+                  encoding='utf-8') as file:
+            yaml.safe_dump_all(tests[start:start + args.tests_per_file],
+                               file, sort_keys=False)
+
+
+def run_validator(workdir, mode, args):
+    """
+    Run the validator once in a separate process.
+
+    Returns:
+        dict: The summary of the run, its wall-clock duration and the peak
+        memory of the process.
+    """
+
+    summary_path = os.path.join(workdir, 'summary.json')
+    env = {**os.environ,
+           'DB_URL': f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}",
+           'TEST_FILES': os.path.join(workdir, 'queries'),
+           'HISTORY_FILE': os.path.join(workdir, 'history.sqlite'),
+           'LOCK_FILE': os.path.join(workdir, 'validator.lock'),
+           'TEST_CACHE_FILE': os.path.join(workdir, 'tests.cache'),
+           'RESULT_FORMAT': 'summary',
+           'RESULT_FILE': summary_path,
+           'LOG_FILE_PATH': '',
+           'LOKI_HOST': '',
+           'MAX_WORKERS': str(args.workers),
+           **MODES[mode]}
+
+    # The run's log, which is only shown if the run fails
+    with open(os.path.join(workdir, 'validator.log'), 'w+') as log:
+        start_time = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'main.py'],
+                                   cwd=VALIDATOR_DIR, env=env, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start_time
+
+        if os.waitstatus_to_exitcode(status):
+            log.seek(0)
+            raise RuntimeError(f"Run in {mode} mode failed:\n{log.read()}")
+
+    with open(summary_path, encoding='utf-8') as file:
+        summary = json.load(file)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_memory = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'wall_time': wall_time, 'peak_memory': peak_memory,
+            'summary': summary}
+
+
+def clear_state(workdir):
+    """Remove the test cache and the durations of previous runs."""
+
+    for name in ('tests.cache', 'history.sqlite'):
+        path = os.path.join(workdir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run(args):
+    results = []
+
+    with tempfile.TemporaryDirectory(
+            prefix='query-validator-bench-') as workdir:
+        os.mkdir(os.path.join(workdir, 'queries'))
+        create_database(os.path.join(workdir, 'bench.sqlite'), args)
+        write_tests(os.path.join(workdir, 'queries'), args)
+
+        for mode in args.modes:
+            for cache in ('cold', 'warm'):
+                for repeat in range(args.repeat):
+                    if cache == 'cold':
+                        clear_state(workdir)
+                    measured = run_validator(workdir, mode, args)
+                    summary = measured['summary']
+                    result = {
+                        'mode': mode,
+                        'cache': cache,
+                        'repeat': repeat,
+                        'tests': summary['total'],
+                        'rows': args.rows,
+                        'wall_time': measured['wall_time'],
+                        'runtime': summary['runtime'],
+                        'tests_per_second': (summary['total'] /
+                                             measured['wall_time']),
+                        'peak_memory': measured['peak_memory'],
+                        'timings': summary['timings'],
+                        'statuses': {status: summary[status] for status in
+                                     ('passed', 'failed', 'errors',
+                                      'timeouts')}
+                    }
+                    results.append(result)
+                    print(f"{mode:>9} {cache} #{repeat}: "
+                          f"{result['wall_time']:.2f}s, "
+                          f"{result['tests_per_second']:,.1f} tests/s",
+                          file=sys.stderr)
+
+    return results
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark whole runs against a generated database.")
+    parser.add_argument('--tests', type=int, default=300,
+                        help="number of generated tests")
+    parser.add_argument('--tests-per-file', type=int, default=10,
+                        help="tests per YAML file")
+    parser.add_argument('--rows', type=lambda value: parse_sizes(value)[0],
+                        default=100_000, help="rows of the generated table")
+    parser.add_argument('--null-ratio', type=float, default=0.01,
+                        help="share of rows with a null email")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help="share of rows repeating an earlier row")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="MAX_WORKERS of the runs")
+    parser.add_argument('--modes', nargs='+', choices=MODES,
+                        default=['threads'], help="execution modes to run")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs per mode and cache state")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file the results are "
+                                         "written to, stdout by default")
+    parser.add_argument('--compare', metavar='JSON',
+                        help="results of a previous run to compare with")
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+    save_results('end_to_end', results, args.output)
+
+    if args.compare:
+        compare_results(
+            results, args.compare,
+            lambda result: (result['mode'], result['cache'],
+                            result['repeat']),
+            'tests_per_second')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Throughput and peak memory of every validator and of `run_assertions` on
+synthetic result sets.
+
+    python benchmarks/bench_validators.py --rows 10k,100k,1M,10M \
+        --null-ratio 0.01 --duplicate-ratio 0.1 --output validators.json
+
+Rows are generated in batches outside the measured time, and fed to the
+assertions batch by batch like a streamed result. Peak memory is measured
+with tracemalloc in a second pass, since tracing slows the code down, and
+includes the batch being evaluated.
+"""
+
+import sys
+import time
+import argparse
+import tracemalloc
+from common import (compare_results, generate_rows, parse_sizes,
+                    save_results)
+import runner
+
+KEYS = ['id', 'email', 'status']
+
+ASSERTIONS = {
+    'count': lambda rows: {'count': rows},
+    'has': lambda rows: {'has': [
+        {'column': 'status', 'values': ['active', 'inactive']}]},
+    'missing': lambda rows: {'missing': [
+        {'column': 'status', 'values': ['deleted', 'banned']}]},
+    'no_nulls': lambda rows: {'no_nulls': ['email']},
+    'only_nulls': lambda rows: {'only_nulls': ['email']},
+    'unique': lambda rows: {'unique': ['id']},
+    'distinct_count': lambda rows: {'distinct_count': [
+        {'column': 'email', 'max': rows}]}
+}
+
+
+def all_assertions(rows):
+    assertions = {}
+    for assertion in ASSERTIONS.values():
+        assertions.update(assertion(rows))
+    return assertions
+
+
+def measure(assertions, args, rows):
+    """
+    Evaluate the assertions on a generated result set with `run_assertions`,
+    as a stream of batches.
+
+    Returns:
+        tuple: Seconds spent evaluating, without generating the rows, and
+        the evaluation.
+    """
+
+    generating = 0.0
+    batches = generate_rows(rows, args.null_ratio, args.duplicate_ratio,
+                            args.seed, args.batch_size)
+
+    def timed_batches():
+        nonlocal generating
+        while True:
+            start_time = time.perf_counter()
+            batch = next(batches, None)
+            generating += time.perf_counter() - start_time
+            if batch is None:
+                return
+            yield batch
+
+    start_time = time.perf_counter()
+    evaluation = runner.run_assertions(
+        timed_batches(), assertions, KEYS,
+        {'samples': args.samples, 'reservoir': 0},
+        columnar_threshold=args.columnar_threshold)
+    return time.perf_counter() - start_time - generating, evaluation
+
+
+def peak_memory(assertions, args, rows):
+    tracemalloc.start()
+    try:
+        measure(assertions, args, rows)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(args):
+    cases = {name: assertion for name, assertion in ASSERTIONS.items()
+             if not args.only or name in args.only}
+    if not args.only or 'run_assertions' in args.only:
+        cases['run_assertions'] = all_assertions
+
+    results = []
+    for rows in args.rows:
+        for name, assertions in cases.items():
+            assertions = assertions(rows)
+            elapsed, evaluation = measure(assertions, args, rows)
+            result = {
+                'case': name,
+                'rows': rows,
+                'null_ratio': args.null_ratio,
+                'duplicate_ratio': args.duplicate_ratio,
+                'columnar_threshold': args.columnar_threshold,
+                'seconds': elapsed,
+                'rows_per_second': rows / elapsed if elapsed else 0.0,
+                'failed': [key for key, _ in evaluation.failures()],
+                'peak_memory': (None if args.no_memory
+                                else peak_memory(assertions, args, rows))
+            }
+            results.append(result)
+            print(f"{name:>15} {rows:>11,} rows: "
+                  f"{result['rows_per_second']:>13,.0f} rows/s",
+                  file=sys.stderr)
+
+    return results
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the validators on synthetic result sets.")
+    parser.add_argument('--rows', type=parse_sizes,
+                        default=parse_sizes('10k,100k,1M'),
+                        help="comma separated row counts, e.g. 10k,1M,10M")
+    parser.add_argument('--null-ratio', type=float, default=0.01,
+                        help="share of rows with a null email")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help="share of rows repeating an earlier row")
+    parser.add_argument('--batch-size', type=int, default=10_000,
+                        help="rows per batch fed to the assertions")
+    parser.add_argument('--columnar-threshold',
+                        type=lambda value: parse_sizes(value)[0], default=0,
+                        help="evaluate batches of at least this many rows "
+                             "with NumPy, 0 to never do so")
+    parser.add_argument('--samples', type=int, default=10,
+                        help="offending rows kept per assertion")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', metavar='CASE',
+                        choices=[*ASSERTIONS, 'run_assertions'],
+                        help="run only these cases")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the peak memory pass")
+    parser.add_argument('--output', help="JSON file the results are "
+                                         "written to, stdout by default")
+    parser.add_argument('--compare', metavar='JSON',
+                        help="results of a previous run to compare with")
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+    save_results('validators', results, args.output)
+
+    if args.compare:
+        compare_results(results, args.compare,
+                        lambda result: (result['case'], result['rows'],
+                                        result['columnar_threshold']),
+                        'rows_per_second')
+
+
+if __name__ == '__main__':
+    main()
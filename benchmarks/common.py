@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+VALIDATOR_DIR = os.path.join(ROOT, 'validator')
+
+# The validator modules import each other by their flat module names, as
+# when running `python main.py` from within the validator directory
+sys.path.insert(0, VALIDATOR_DIR)
+
+STATUSES = ('active', 'inactive', 'pending')
+
+
+def parse_sizes(value):
+    """Parse a comma separated list of row counts, e.g. `10k,1M`."""
+
+    sizes = []
+    for size in value.split(','):
+        size = size.strip().lower()
+        factor = {'k': 1_000, 'm': 1_000_000}.get(size[-1:], 1)
+        sizes.append(int(float(size.rstrip('km')) * factor))
+    return sizes
+
+
+def generate_rows(count, null_ratio=0.0, duplicate_ratio=0.0, seed=0,
+                  batch_size=10_000):
+    """
+    Generate a synthetic result set of `(id, email, status)` rows in
+    batches, so that results far larger than memory can be generated.
+
+    Args:
+        count (int): Number of rows.
+        null_ratio (float): Share of rows with a null `email`.
+        duplicate_ratio (float): Share of rows repeating the `id` and
+            `email` of an earlier row.
+        seed (int): Seed of the generator, so that runs see the same rows.
+        batch_size (int): Rows per batch.
+
+    Yields:
+        list: The next batch of rows, as tuples.
+    """
+
+    rng = random.Random(seed)
+    produced = 0
+
+    while produced < count:
+        batch = []
+        for index in range(produced, min(produced + batch_size, count)):
+            if index and rng.random() < duplicate_ratio:
+                index = rng.randrange(index)
+            email = (None if rng.random() < null_ratio
+                     else f'user{index}@example.com')
+            batch.append((index, email, STATUSES[index % len(STATUSES)]))
+        produced += len(batch)
+        yield batch
+
+
+def environment():
+    """
+    Returns:
+        dict: The interpreter, machine and commit the benchmark ran on.
+    """
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'cpus': os.cpu_count(),
+            'commit': commit}
+
+
+def save_results(benchmark, results, path):
+    """
+    Write the results of a benchmark as JSON, with the environment it ran
+    in, or print them if no path is given.
+    """
+
+    report = json.dumps({'benchmark': benchmark,
+                         'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                         'environment': environment(),
+                         'results': results}, indent=2)
+
+    if path:
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+def compare_results(results, baseline_path, key, metric):
+    """
+    Print the change of a metric for every case also found in a previous
+    report, e.g. to compare a branch with the main branch.
+
+    Args:
+        results (list): The results of this run.
+        baseline_path (str): The JSON report of the previous run.
+        key (callable): Identifies a case within the results.
+        metric (str): The compared value, higher is better.
+    """
+
+    with open(baseline_path, encoding='utf-8') as file:
+        baseline = {key(result): result
+                    for result in json.load(file)['results']}
+
+    for result in results:
+        previous = baseline.get(key(result))
+        if previous is None or not previous[metric]:
+            continue
+        change = result[metric] / previous[metric] - 1
+        print(f"{' '.join(map(str, key(result)))}: {previous[metric]:,.1f} "
+              f"-> {result[metric]:,.1f} {metric} ({change:+.1%})",
+              file=sys.stderr)
@@ -6,6 +6,10 @@ handle_sigint() {
   exit 0
 }
 
+if [ "${RUN_MODE}" = "daemon" ]; then
+  cd /app/validator && exec /usr/local/bin/python daemon.py
+fi
+
 printf  "${CRON_SCHEDULE} cd /app/validator && /usr/local/bin/python main.py > /proc/1/fd/1 2>/proc/1/fd/2\n" > /etc/cron.d/cronjob
 
 chmod 0644 /etc/cron.d/cronjob
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The validator modules import each other by their flat module names, as
+# when running `python main.py` from within the validator directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'validator'))
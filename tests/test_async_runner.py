@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+import sqlalchemy
+from validator import async_runner, database
+from test_planner import CFG
+
+SLOW_QUERY = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+              "SELECT count(*) AS c FROM n")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    url = f"sqlite:///{tmp_path / 'db.sqlite'}"
+    sync_engine = database.create_db_engine(url)
+    with sync_engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER, email TEXT)")
+        conn.exec_driver_sql(
+            "INSERT INTO users VALUES (1, 'a@example.com'), (2, NULL), "
+            "(3, 'c@example.com')")
+    sync_engine.dispose()
+    return database.create_async_pool(
+        {'DB_URL': url, 'DB_POOL_PRE_PING': True}, 4)
+
+
+def run_tests(tests, engine, **cfg):
+    """Run the tests on the event loop, returning the results by name."""
+
+    results = []
+    asyncio.run(async_runner.run_once(
+        tests, engine, {**CFG, 'ASYNC_CONCURRENCY': 4, **cfg},
+        results.append))
+    return {result['name']: result for result in results}
+
+
+class MockStream:
+    """Mock class to simulate a streamed result and its connection."""
+
+    def __init__(self, dialect_name):
+        self.dialect = type('Dialect', (), {'name': dialect_name})
+        self.closed = False
+        self.invalidated = False
+
+    async def close(self):
+        self.closed = True
+
+    async def invalidate(self):
+        self.invalidated = True
+
+
+class TestRunTests:
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_pass_and_fail(self, engine, stream):
+        """
+        Test that every test gets its verdict, including tests sharing a
+        query.
+        """
+        tests = [
+            {'name': 'count', 'query': 'SELECT id, email FROM users',
+             'assertions': {'count': 3}},
+            {'name': 'nulls', 'query': 'SELECT id, email FROM users',
+             'assertions': {'no_nulls': ['email']}},
+            {'name': 'limited', 'query': 'SELECT id FROM users',
+             'assertions': {'count': 1}}
+        ]
+
+        results = run_tests(tests, engine, STREAM_RESULTS=stream)
+        assert {name: result['status']
+                for name, result in results.items()} == {
+            'count': 'PASS', 'nulls': 'FAIL', 'limited': 'FAIL'}
+        assert results['nulls']['violations'] == {'no_nulls': 1}
+
+    def test_timeout(self, engine):
+        """
+        Test that a test running into its timeout is reported as such, and
+        the statement is interrupted.
+        """
+        results = run_tests([{'name': 'slow', 'query': SLOW_QUERY,
+                              'assertions': {'count': 1}, 'timeout': 0.2}],
+                            engine)
+        assert results['slow']['status'] == 'TIMEOUT'
+
+    def test_error(self, engine):
+        """
+        Test that a failing query is reported as an error without affecting
+        the other tests.
+        """
+        results = run_tests([
+            {'name': 'broken', 'query': 'SELECT missing FROM users',
+             'assertions': {'count': 3}},
+            {'name': 'count', 'query': 'SELECT id FROM users',
+             'assertions': {'count': 3}}
+        ], engine)
+        assert results['broken']['status'] == 'ERROR'
+        assert results['count']['status'] == 'PASS'
+
+    def test_stream_short_circuit(self, engine):
+        """
+        Test that a streamed test stops fetching once its verdict is known.
+        """
+        results = run_tests([{'name': 'nulls',
+                              'query': 'SELECT id, email FROM users',
+                              'assertions': {'no_nulls': ['email']}}],
+                            engine, STREAM_RESULTS=True, STREAM_BATCH_SIZE=1)
+        assert results['nulls']['status'] == 'FAIL'
+        assert results['nulls']['short_circuited']
+
+    def test_timeout_reset_after_error(self, engine, monkeypatch):
+        """
+        Test that a session timeout is reset before the connection of a
+        failed test goes back to the pool.
+        """
+        monkeypatch.setattr(
+            async_runner.database, 'timeout_statements',
+            lambda dialect_name, seconds: ("SELECT 'set'", "SELECT 'reset'"))
+        statements = []
+        sqlalchemy.event.listen(
+            engine.sync_engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement))
+
+        results = run_tests([{'name': 'broken',
+                              'query': 'SELECT missing FROM users',
+                              'assertions': {'count': 3}, 'timeout': 5}],
+                            engine)
+        assert results['broken']['status'] == 'ERROR'
+        assert statements[-1] == "SELECT 'reset'"
+
+
+class TestCloseStream:
+    @pytest.mark.parametrize('dialect_name, closed, invalidated', [
+        ('mysql', False, True), ('mariadb', False, True),
+        ('postgresql', True, False), ('sqlite', True, False)])
+    def test_mysql_is_invalidated(self, dialect_name, closed, invalidated):
+        """
+        Test that a MySQL connection is discarded instead of draining the
+        rest of a stopped stream, while other streams are closed.
+        """
+        stream = MockStream(dialect_name)
+        asyncio.run(async_runner.close_stream(stream, stream))
+        assert (stream.closed, stream.invalidated) == (closed, invalidated)
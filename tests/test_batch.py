@@ -0,0 +1,100 @@
+import pytest
+import sqlalchemy
+from concurrent.futures import ThreadPoolExecutor
+from validator import batch, database
+from test_planner import CFG
+
+SLOW_QUERY = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+              "SELECT count(*) AS c FROM n")
+
+
+def count_test(expected, query="SELECT id FROM users", **options):
+    return {'name': f'count {expected}', 'query': query,
+            'assertions': {'count': expected}, **options}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as conn:
+        # WAL lets the test write while a snapshot transaction reads
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER)")
+        conn.exec_driver_sql("INSERT INTO users VALUES (1), (2), (3)")
+    yield engine
+    engine.dispose()
+
+
+def insert_user(engine):
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("INSERT INTO users VALUES (4)"))
+
+
+class TestSnapshotSession:
+    def test_consistent_snapshot(self, engine):
+        """
+        Test that tests of a session don't see changes committed after the
+        session started.
+        """
+        session = batch.SnapshotSession(engine)
+        try:
+            [result] = session.execute_tests([count_test(3)], CFG)
+            assert result['status'] == 'PASS'
+
+            insert_user(engine)
+            [result] = session.execute_tests(
+                [count_test(3, "SELECT id FROM users ORDER BY id")], CFG)
+            assert result['status'] == 'PASS'
+        finally:
+            session.close()
+
+    def test_error_keeps_session(self, engine):
+        """
+        Test that a failing query does not end the session's transaction.
+        """
+        session = batch.SnapshotSession(engine)
+        try:
+            session.execute_tests([count_test(3)], CFG)
+            [result] = session.execute_tests(
+                [count_test(1, "SELECT * FROM missing")], CFG)
+            assert result['status'] == 'ERROR'
+
+            insert_user(engine)
+            [result] = session.execute_tests([count_test(3)], CFG)
+            assert result['status'] == 'PASS'
+        finally:
+            session.close()
+
+    def test_timeout(self, engine):
+        """
+        Test that a test running into its timeout is reported as such and
+        the session keeps running tests.
+        """
+        session = batch.SnapshotSession(engine)
+        try:
+            [result] = session.execute_tests(
+                [count_test(1, SLOW_QUERY, timeout=0.2)], CFG)
+            assert result['status'] == 'TIMEOUT'
+
+            [result] = session.execute_tests([count_test(3)], CFG)
+            assert result['status'] == 'PASS'
+        finally:
+            session.close()
+
+
+class TestRunBatched:
+    def test_run(self, engine):
+        """
+        Test that every test of a batched run gets its result.
+        """
+        tests = [count_test(3), count_test(2, "SELECT id FROM users LIMIT 2"),
+                 count_test(5)]
+        results = []
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            batch.run_batched(tests, results.append, engine,
+                              {**CFG, 'MAX_WORKERS': 2}, executor)
+
+        assert sorted((result['name'], result['status'])
+                      for result in results) == [
+            ('count 2', 'PASS'), ('count 3', 'PASS'), ('count 5', 'FAIL')]
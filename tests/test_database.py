@@ -0,0 +1,47 @@
+from validator import database
+
+CFG = {
+    'DB_URL': '',
+    'DB_POOL_SIZE': 0,
+    'DB_MAX_OVERFLOW': 2,
+    'DB_POOL_PRE_PING': False,
+    'DB_POOL_RECYCLE': 600,
+    'DB_POOL_TIMEOUT': 5
+}
+
+
+class TestCreatePool:
+    def test_sqlite(self, tmp_path):
+        """
+        Test that a SQLite engine gets the pre-ping setting and keeps the
+        pool SQLAlchemy picks for it.
+        """
+        engine = database.create_pool(
+            {**CFG, 'DB_URL': f"sqlite:///{tmp_path / 'db.sqlite'}"}, 4)
+        try:
+            assert engine.pool._pre_ping is False
+            with engine.connect() as conn:
+                assert conn.exec_driver_sql("SELECT 1").scalar() == 1
+        finally:
+            engine.dispose()
+
+    def test_sized_to_workers(self):
+        """
+        Test that the pool is sized to the workers and gets the overflow,
+        recycle and checkout timeout settings, without connecting.
+        """
+        engine = database.create_pool(
+            {**CFG, 'DB_URL': 'postgresql://validator@localhost/app'}, 4)
+        assert (engine.pool.size(), engine.pool._max_overflow,
+                engine.pool._recycle, engine.pool._timeout,
+                engine.pool._pre_ping) == (4, 2, 600, 5, False)
+
+    def test_pool_size(self):
+        """
+        Test that a target's pool size comes before DB_POOL_SIZE, which
+        comes before the number of workers.
+        """
+        cfg = {**CFG, 'DB_URL': 'postgresql://validator@localhost/app',
+               'DB_POOL_SIZE': 6}
+        assert database.create_pool(cfg, 4).pool.size() == 6
+        assert database.create_pool(cfg, 4, pool_size=2).pool.size() == 2
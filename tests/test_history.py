@@ -0,0 +1,37 @@
+import pytest
+from validator import history
+
+
+@pytest.fixture
+def store(tmp_path):
+    run_history = history.History(str(tmp_path / 'history.sqlite'))
+    yield run_history
+    run_history.close()
+
+
+class TestHistory:
+    def test_record_and_smooth(self, store):
+        """
+        Test that durations are stored and smoothed over runs.
+        """
+        store.record({'slow': 10.0, 'fast': 1.0})
+        store.record({'slow': 20.0})
+        assert store.durations() == {'slow': 15.0, 'fast': 1.0}
+
+
+class TestOrderTests:
+    TESTS = [{'name': 'fast'}, {'name': 'slow'}, {'name': 'new'},
+             {'name': 'urgent', 'priority': 1}]
+
+    def test_longest_first(self):
+        """
+        Test that tests are ordered by priority, then by previous duration.
+        """
+        ordered = history.order_tests(
+            self.TESTS, {'fast': 1.0, 'slow': 10.0, 'urgent': 0.1})
+        assert [test['name'] for test in ordered] == [
+            'urgent', 'new', 'slow', 'fast']
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,114 @@
+import os
+import pytest
+from validator import loader
+
+TEST = """
+name: "{name}"
+query: "SELECT 1"
+assertions:
+  count: 1
+"""
+
+
+@pytest.fixture
+def queries(tmp_path):
+    path = tmp_path / 'queries'
+    path.mkdir()
+    for name in ['a', 'b']:
+        (path / f'{name}.yml').write_text(TEST.format(name=name))
+    return path
+
+
+class TestLoadTests:
+    def test_cache_hits_and_misses(self, queries, tmp_path):
+        """
+        Test that only new or changed files are parsed on the next load.
+        """
+        cache = str(tmp_path / 'cache.pickle')
+
+        report = loader.load_tests(str(queries), cache)
+        assert (report.cache_hits, report.cache_misses) == (0, 2)
+
+        (queries / 'b.yml').write_text(TEST.format(name='changed'))
+        report = loader.load_tests(str(queries), cache)
+        assert (report.cache_hits, report.cache_misses) == (1, 1)
+        assert sorted(test['name'] for test in report.tests) == [
+            'a', 'changed']
+
+    def test_touched_file_is_a_hit(self, queries, tmp_path):
+        """
+        Test that a file with a new modification time but the same content
+        is not parsed again.
+        """
+        cache = str(tmp_path / 'cache.pickle')
+        loader.load_tests(str(queries), cache)
+
+        os.utime(queries / 'a.yml', ns=(1, 1))
+        report = loader.load_tests(str(queries), cache)
+        assert (report.cache_hits, report.cache_misses) == (2, 0)
+
+    def test_invalid_files_stay_invalid(self, queries, tmp_path):
+        """
+        Test that invalid files are skipped on cache hits as well.
+        """
+        cache = str(tmp_path / 'cache.pickle')
+        (queries / 'invalid.yml').write_text('name: "no query"')
+
+        for _ in range(2):
+            report = loader.load_tests(str(queries), cache)
+            assert len(report.tests) == 2
+
+    def test_corrupt_cache(self, queries, tmp_path):
+        """
+        Test that an unreadable cache is treated as empty.
+        """
+        cache = tmp_path / 'cache.pickle'
+        cache.write_bytes(b'not a pickle')
+
+        report = loader.load_tests(str(queries), str(cache))
+        assert (report.cache_hits, report.cache_misses) == (0, 2)
+
+
+class TestDiscovery:
+    def test_recursive_and_multi_document(self, queries, tmp_path):
+        """
+        Test that .yaml files in subdirectories are found and that a file
+        can hold several tests.
+        """
+        (queries / 'team').mkdir()
+        (queries / 'team' / 'many.yaml').write_text(
+            TEST.format(name='c') + '---' + TEST.format(name='d'))
+        (queries / '.hidden').mkdir()
+        (queries / '.hidden' / 'e.yml').write_text(TEST.format(name='e'))
+
+        report = loader.load_tests(str(queries))
+        assert [test['name'] for test in report.tests] == ['a', 'b', 'c', 'd']
+
+    def test_errors_are_reported(self, queries):
+        """
+        Test that invalid documents and YAML syntax errors end up in the
+        report instead of failing the whole load.
+        """
+        (queries / 'mixed.yml').write_text(
+            TEST.format(name='c') + '---\nname: "no query"\n'
+            '---\n- a\n---\nfoo\n')
+        (queries / 'broken.yml').write_text('name: [')
+
+        report = loader.load_tests(str(queries))
+        assert len(report.tests) == 3
+        errors = {(error.file, error.document, error.name)
+                  for error in report.errors}
+        assert errors == {('mixed.yml', 1, 'no query'),
+                          ('mixed.yml', 2, None), ('mixed.yml', 3, None),
+                          ('broken.yml', None, None)}
+
+    def test_parallel_parsing(self):
+        """
+        Test that parsing across worker processes keeps the file order.
+        """
+        contents = [(f'{i}.yml', TEST.format(name=i))
+                    for i in range(loader.PARALLEL_THRESHOLD)]
+
+        parsed = loader.parse_test_files(contents, workers=2)
+        assert [tests[0]['name'] for tests, _ in parsed] == [
+            str(i) for i in range(loader.PARALLEL_THRESHOLD)]
@@ -0,0 +1,148 @@
+import gzip
+import json
+import logging
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from validator import loki
+
+
+class StubLoki(ThreadingHTTPServer):
+    """Local HTTP server recording pushed streams, failing the first
+    `failures` pushes with a 503."""
+
+    def __init__(self, failures=0):
+        super().__init__(('127.0.0.1', 0), StubLokiRequestHandler)
+        self.failures = failures
+        self.pushes = []
+        self.attempts = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/loki/api/v1/push"
+
+    def lines(self):
+        return [value[1] for push in self.pushes for stream in push['streams']
+                for value in stream['values']]
+
+
+class StubLokiRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.attempts += 1
+
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+        else:
+            assert self.headers['Content-Encoding'] == 'gzip'
+            self.server.pushes.append(json.loads(gzip.decompress(body)))
+            self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    def start(failures=0):
+        server = StubLoki(failures)
+        threading.Thread(target=server.serve_forever, args=(0.05,),
+                         daemon=True).start()
+        servers.append(server)
+        return server
+
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_record(message, level=logging.INFO):
+    return logging.LogRecord('test', level, __file__, 1, message, None, None)
+
+
+class TestBatchingLokiHandler:
+    def test_batches(self, stub):
+        """
+        Test that records are pushed in batches with their labels and
+        flushed when the handler is closed.
+        """
+        server = stub()
+        handler = loki.BatchingLokiHandler(
+            server.url, tags={'application': 'test'}, batch_size=2,
+            flush_interval=60)
+
+        for i in range(5):
+            handler.handle(make_record(f"record {i}"))
+        handler.close()
+
+        assert server.lines() == [f"record {i}" for i in range(5)]
+        assert len(server.pushes) == 3
+        assert server.pushes[0]['streams'][0]['stream'] == {
+            'application': 'test', 'severity': 'info', 'logger': 'test'}
+        assert handler.stats()['sent'] == 5
+
+    def test_flush_interval(self, stub):
+        """
+        Test that a partial batch is pushed after the flush interval.
+        """
+        server = stub()
+        handler = loki.BatchingLokiHandler(server.url, flush_interval=0.05)
+        try:
+            handler.handle(make_record("record"))
+            with handler.condition:
+                handler.condition.wait_for(lambda: handler.sent, timeout=5)
+            assert server.lines() == ["record"]
+        finally:
+            handler.close()
+
+    def test_retries(self, stub):
+        """
+        Test that failed pushes are retried with backoff.
+        """
+        server = stub(failures=2)
+        handler = loki.BatchingLokiHandler(server.url, backoff=0.01)
+
+        handler.handle(make_record("record"))
+        handler.close()
+
+        assert server.lines() == ["record"]
+        assert server.attempts == 3
+        assert handler.stats()['retries'] == 2
+
+    def test_gives_up(self, stub):
+        """
+        Test that records are counted as failed once retries are exhausted.
+        """
+        server = stub(failures=10)
+        handler = loki.BatchingLokiHandler(server.url, max_retries=1,
+                                           backoff=0.01)
+
+        handler.handle(make_record("record"))
+        handler.close()
+
+        assert handler.stats()['failed'] == 1
+        assert handler.stats()['sent'] == 0
+
+    @pytest.mark.parametrize('policy, kept', [
+        (loki.DROP_OLDEST, ["record 2", "record 3"]),
+        (loki.DROP_NEWEST, ["record 0", "record 1"])])
+    def test_drop_policy(self, stub, policy, kept):
+        """
+        Test that records beyond the queue size are dropped by the policy.
+        """
+        server = stub()
+        handler = loki.BatchingLokiHandler(
+            server.url, queue_size=2, flush_interval=60, drop_policy=policy)
+
+        # Hold the buffer so that the shipper can't drain it in between
+        with handler.condition:
+            for i in range(4):
+                handler.emit(make_record(f"record {i}"))
+        handler.close()
+
+        assert server.lines() == kept
+        assert handler.stats()['dropped'] == 2
@@ -0,0 +1,58 @@
+import socket
+import urllib.request
+from validator import metrics
+
+
+def make_result(name, status):
+    return {'name': name, 'target': None, 'status': status, 'duration': 0.2,
+            'evaluation_time': 0.01, 'pool_wait': 0.001, 'rows_fetched': 10,
+            'bytes_fetched': 80}
+
+
+def sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels)
+
+
+class TestMetrics:
+    def test_observe_result(self):
+        """
+        Test that a result is recorded under its test's labels.
+        """
+        metrics.queue_depth.inc()
+        metrics.observe_result(make_result('metrics a', 'FAIL'))
+
+        assert sample('query_validator_test_results_total',
+                      test='metrics a', target='', status='FAIL') == 1
+        assert sample('query_validator_rows_fetched_total',
+                      test='metrics a') == 10
+        assert sample('query_validator_test_duration_seconds_count',
+                      test='metrics a') == 1
+        assert sample('query_validator_queue_depth') == 0
+
+    def test_textfile(self, tmp_path):
+        """
+        Test that the metrics are written in the text exposition format.
+        """
+        metrics.observe_result(make_result('metrics b', 'PASS'))
+        path = tmp_path / 'query_validator.prom'
+
+        metrics.write_textfile(str(path))
+
+        assert ('query_validator_test_results_total{status="PASS",'
+                'target="",test="metrics b"} 1.0') in path.read_text()
+
+    def test_serve(self):
+        """
+        Test that the metrics are served at /metrics.
+        """
+        metrics.observe_result(make_result('metrics c', 'PASS'))
+        with socket.socket() as free:
+            free.bind(('127.0.0.1', 0))
+            port = free.getsockname()[1]
+
+        metrics.serve(port)
+
+        with urllib.request.urlopen(
+                f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+        assert 'query_validator_rows_fetched_total{test="metrics c"}' in body
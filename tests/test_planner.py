@@ -0,0 +1,334 @@
+import pytest
+import sqlalchemy
+from validator import database, planner, runner, workers
+
+CFG = {
+    'DEDUPLICATE_QUERIES': True,
+    'PUSHDOWN': False,
+    'SHORT_CIRCUIT': True,
+    'LIMIT_COUNT_QUERIES': True,
+    'STREAM_RESULTS': False,
+    'STREAM_BATCH_SIZE': 2,
+    'QUERY_TIMEOUT': 0,
+    'PROFILE': False,
+    'EXPLAIN_THRESHOLD': 0,
+    'COLUMNAR_THRESHOLD': 0,
+    'DISTINCT_EXACT_LIMIT': 100,
+    'BLOOM_FILTER_CAPACITY': 1000,
+    'ASSERTION_PROCESSES': 0,
+    'ERROR_SAMPLE_SIZE': 10,
+    'ERROR_RESERVOIR_SIZE': 0
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            "CREATE TABLE users (id INTEGER, email TEXT)"))
+        conn.execute(sqlalchemy.text(
+            "INSERT INTO users VALUES (1, 'a@example.com'), (2, NULL), "
+            "(3, 'c@example.com')"))
+    yield engine
+    engine.dispose()
+
+
+class TestNormalizeQuery:
+    def test_whitespace_and_comments(self):
+        """
+        Test that whitespace and comments do not distinguish queries.
+        """
+        assert planner.normalize_query(
+            "-- all users\nSELECT id,\n  email /* contact */ FROM users;\n"
+        ) == "SELECT id, email FROM users"
+
+    def test_literals_are_kept(self):
+        """
+        Test that whitespace and comment markers inside literals are kept.
+        """
+        query = "SELECT 'a  -- b', \"x  y\" FROM t"
+        assert planner.normalize_query(query) == query
+
+
+class TestGroupTests:
+    TESTS = [
+        {'name': 'a', 'query': 'SELECT * FROM users'},
+        {'name': 'b', 'query': 'SELECT 1'},
+        {'name': 'c', 'query': 'SELECT *\n  FROM users  -- same\n'},
+        {'name': 'd', 'query': 'SELECT * FROM users', 'timeout': 5}
+    ]
+
+    def test_groups_by_normalized_query(self):
+        """
+        Test that tests sharing a query and its execution are grouped, in
+        the order of their first test.
+        """
+        groups = planner.group_tests(self.TESTS, 'sqlite', CFG)
+        assert [[test['name'] for test in group] for group in groups] == [
+            ['a', 'c'], ['b'], ['d']]
+
+    def test_disabled(self):
+        """
+        Test that every test runs on its own when deduplication is disabled.
+        """
+        groups = planner.group_tests(
+            self.TESTS, 'sqlite', {**CFG, 'DEDUPLICATE_QUERIES': False})
+        assert len(groups) == 4
+
+
+class TestExecuteTests:
+    @pytest.mark.parametrize("stream, processes",
+                             [(False, 0), (True, 0), (True, 1)])
+    def test_grouped_limits(self, engine, stream, processes):
+        """
+        Test that count tests sharing a query only count as short-circuited
+        when the result reached the largest limit.
+        """
+        tests = [{'name': 'one', 'query': 'SELECT id FROM users',
+                  'assertions': {'count': 1}},
+                 {'name': 'all', 'query': 'SELECT id FROM users',
+                  'assertions': {'count': 5}}]
+
+        try:
+            results = runner.execute_tests(tests, engine, {
+                **CFG, 'STREAM_RESULTS': stream,
+                'ASSERTION_PROCESSES': processes})
+        finally:
+            workers.shutdown()
+        assert [(result['status'], result['short_circuited'])
+                for result in results] == [('FAIL', False), ('FAIL', False)]
+        assert results[0]['error_messages'] == [
+            "Assertion 'count' failed: Expected 1, got 3"]
+
+    @pytest.mark.parametrize("cfg", [{}, {'PUSHDOWN': True},
+                                     {'LIMIT_COUNT_QUERIES': False}])
+    def test_trailing_comment(self, engine, cfg):
+        """
+        Test that a query ending in a comment still runs when it is wrapped
+        in a LIMIT or an aggregate query.
+        """
+        test = {'name': 'commented', 'query': 'SELECT id FROM users -- all',
+                'assertions': {'count': 3}}
+        result = runner.execute_test(test, engine, {**CFG, **cfg})
+        assert result['status'] == 'PASS'
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_shared_execution(self, engine, stream):
+        """
+        Test that every test of a group gets its own result from the shared
+        query.
+        """
+        tests = [
+            {'name': 'count', 'query': 'SELECT id, email FROM users',
+             'assertions': {'count': 3}},
+            {'name': 'nulls', 'query': 'SELECT id, email FROM users',
+             'assertions': {'no_nulls': ['email']}},
+            {'name': 'limited', 'query': 'SELECT id, email FROM users',
+             'assertions': {'count': 1}}
+        ]
+
+        results = runner.execute_tests(tests, engine,
+                                       {**CFG, 'STREAM_RESULTS': stream})
+        assert [(result['name'], result['status']) for result in results] == [
+            ('count', 'PASS'), ('nulls', 'FAIL'), ('limited', 'FAIL')]
+        assert results[1]['violations'] == {'no_nulls': 1}
+
+    def test_approximate(self, engine):
+        """
+        Test that verdicts estimated beyond the exact limit are listed.
+        """
+        test = {'name': 'unique', 'query': 'SELECT id, email FROM users',
+                'assertions': {'unique': ['id'], 'count': 3}}
+
+        result = runner.execute_test(test, engine, CFG)
+        assert (result['status'], result['approximate']) == ('PASS', [])
+
+        result = runner.execute_test(
+            test, engine, {**CFG, 'DISTINCT_EXACT_LIMIT': 1})
+        assert (result['status'], result['approximate']) == (
+            'PASS', ['unique'])
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_worker_processes(self, engine, monkeypatch, stream):
+        """
+        Test that assertions evaluated in a worker process reach the same
+        verdicts, with the failing rows, as in the fetching thread.
+        """
+        # The flat module the runner imports, not validator.workers
+        monkeypatch.setattr(runner.workers, 'MIN_ROWS', 1)
+        test = {'name': 'emails', 'query': 'SELECT id, email FROM users',
+                'assertions': {'no_nulls': ['email'], 'unique': ['id'],
+                               'count': 3}}
+        cfg = {**CFG, 'STREAM_RESULTS': stream}
+
+        try:
+            result = runner.execute_test(
+                test, engine, {**cfg, 'ASSERTION_PROCESSES': 1})
+        finally:
+            workers.shutdown()
+        expected = runner.execute_test(test, engine, cfg)
+
+        assert result['status'] == expected['status'] == 'FAIL'
+        assert result['error_messages'] == expected['error_messages']
+        assert result['erroneous_rows'] == expected['erroneous_rows']
+        assert [row._mapping for row in result['erroneous_rows']] == [
+            {'id': 2, 'email': None}]
+        assert result['rows_fetched'] == expected['rows_fetched'] == 3
+
+    def test_timings(self, engine):
+        """
+        Test that the time spent in every phase is reported.
+        """
+        test = {'name': 'count', 'query': 'SELECT id FROM users',
+                'assertions': {'count': 3}}
+
+        result = runner.execute_test(test, engine, CFG)
+        assert set(result['timings']) == {
+            'plan', 'connect', 'execute', 'fetch', 'evaluate'}
+        assert result['profile'] is None
+        assert result['explain'] is None
+
+    def test_profile(self, engine):
+        """
+        Test that a test opting in is profiled.
+        """
+        test = {'name': 'count', 'query': 'SELECT id FROM users',
+                'assertions': {'count': 3}, 'profile': True}
+
+        result = runner.execute_test(test, engine, CFG)
+        assert 'function calls' in result['profile']
+
+    def test_explain_slow_test(self, engine):
+        """
+        Test that the query plan of a test slower than the threshold is
+        captured.
+        """
+        test = {'name': 'count', 'query': 'SELECT id FROM users',
+                'assertions': {'count': 3}}
+
+        result = runner.execute_test(test, engine,
+                                     {**CFG, 'EXPLAIN_THRESHOLD': -1})
+        assert 'SCAN' in result['explain']
+
+
+class TestPushdown:
+    CONDITIONS = [
+        [{'column': 'id', 'operator': 'between', 'value': [1, 3]}],
+        [{'column': 'id', 'operator': '<', 'value': '3'}],
+        [{'column': 'email', 'operator': 'in',
+          'value': ['a@example.com', 'c@example.com']}],
+        [{'column': 'id', 'operator': '!=', 'value': 2},
+         {'column': 'email', 'operator': '<>', 'value': 'c@example.com'}]
+    ]
+
+    @pytest.mark.parametrize('conditions', CONDITIONS)
+    def test_conditions_match_fetched_rows(self, engine, conditions):
+        """
+        Test that pushed down conditions count the same violations as
+        conditions evaluated on the fetched rows.
+        """
+        test = {'name': 'conditions', 'query': 'SELECT id, email FROM users',
+                'assertions': {'conditions': conditions}}
+
+        cfg = {**CFG, 'PUSHDOWN': True}
+        assert runner.plan_test(test, 'sqlite', cfg)['pushdown']
+
+        fetched = runner.execute_test(test, engine, CFG)
+        pushed = runner.execute_test(test, engine, cfg)
+        assert pushed['query'] == fetched['query']
+        assert (pushed['status'], pushed['violations']) == (
+            fetched['status'], fetched['violations'])
+        assert len(pushed['erroneous_rows']) == len(fetched['erroneous_rows'])
+
+    @pytest.mark.parametrize('assertions', [
+        {'count': 3},
+        {'count': 2},
+        {'has': [{'column': 'id', 'values': [1, 4]}]},
+        {'has': [{'column': 'email', 'values': ['a@example.com']}]},
+        {'missing': [{'column': 'id', 'values': [2, 5]}]},
+        {'missing': [{'column': 'email', 'values': ['b@example.com']}]},
+        {'no_nulls': ['id']},
+        {'no_nulls': ['id', 'email']},
+        {'only_nulls': ['email']},
+        {'count': 3, 'no_nulls': ['email'], 'missing': [
+            {'column': 'id', 'values': [3]}]}
+    ])
+    def test_assertions_match_fetched_rows(self, engine, assertions):
+        """
+        Test that pushed down assertions get the verdicts and violations of
+        assertions evaluated on the fetched rows.
+        """
+        test = {'name': 'pushed', 'query': 'SELECT id, email FROM users',
+                'assertions': assertions}
+
+        cfg = {**CFG, 'PUSHDOWN': True}
+        assert runner.plan_test(test, 'sqlite', cfg)['pushdown']
+
+        fetched = runner.execute_test(test, engine, CFG)
+        pushed = runner.execute_test(test, engine, cfg)
+        assert (pushed['status'], pushed['violations']) == (
+            fetched['status'], fetched['violations'])
+
+    @pytest.mark.parametrize('assertions', [
+        {'missing': [{'column': 'email'}]},
+        {'missing': [{'column': 'email', 'values': [], 'regex': []}]},
+        {'has': []},
+        {'has': [{'column': 'id', 'values': []}]},
+        {'no_nulls': []},
+        {'only_nulls': []},
+        {'conditions': []},
+        {'count': 3, 'no_nulls': []}
+    ])
+    def test_empty_rules_not_pushed_down(self, engine, assertions):
+        """
+        Test that rules with nothing to check run on the fetched rows, which
+        they pass.
+        """
+        test = {'name': 'empty', 'query': 'SELECT id, email FROM users',
+                'assertions': assertions}
+
+        cfg = {**CFG, 'PUSHDOWN': True}
+        assert not runner.plan_test(test, 'sqlite', cfg)['pushdown']
+        assert runner.execute_test(test, engine, cfg)['status'] == 'PASS'
+
+    def test_like_not_pushed_down_without_case_sensitivity(self):
+        """
+        Test that LIKE conditions are only pushed down where LIKE is case
+        sensitive, like on fetched rows.
+        """
+        test = {'name': 'like', 'query': 'SELECT email FROM users',
+                'assertions': {'conditions': [
+                    {'column': 'email', 'operator': 'like', 'value': 'a%'}]}}
+
+        cfg = {**CFG, 'PUSHDOWN': True}
+        assert not runner.plan_test(test, 'sqlite', cfg)['pushdown']
+        assert runner.plan_test(test, 'postgresql', cfg)['pushdown']
+
+    def test_regex_needs_database_support(self):
+        """
+        Test that regex rules are pushed down only on databases with case
+        sensitive regular expressions.
+        """
+        test = {'name': 'regex', 'query': 'SELECT email FROM users',
+                'assertions': {'missing': [
+                    {'column': 'email', 'regex': ['^a']}]}}
+
+        cfg = {**CFG, 'PUSHDOWN': True}
+        assert not runner.plan_test(test, 'sqlite', cfg)['pushdown']
+        assert runner.plan_test(test, 'postgresql', cfg)['pushdown']
+        assert runner.plan_test(test, 'mysql', cfg)['pushdown']
+
+
+class TestWatchdog:
+    def test_no_cancel_after_stop(self, engine):
+        """
+        Test that a timer firing after the statement finished cancels
+        nothing.
+        """
+        with engine.connect() as conn:
+            watchdog = database.Watchdog(engine, conn, 60)
+            watchdog.stop()
+            watchdog.cancel_statement()
+            assert not watchdog.expired
+            assert conn.exec_driver_sql("SELECT 1").scalar() == 1
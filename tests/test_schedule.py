@@ -0,0 +1,49 @@
+import pytest
+from datetime import datetime
+from validator.schedule import CronSchedule
+
+
+class TestCronSchedule:
+    def test_step(self):
+        """
+        Test that a step matches every n-th minute.
+        """
+        schedule = CronSchedule('*/15 * * * *')
+        assert schedule.matches(datetime(2024, 5, 6, 10, 30))
+        assert not schedule.matches(datetime(2024, 5, 6, 10, 31))
+
+    def test_macro_and_names(self):
+        """
+        Test that macros and month and day names are expanded.
+        """
+        assert CronSchedule('@hourly').matches(datetime(2024, 5, 6, 10, 0))
+        schedule = CronSchedule('0 9 * jan-mar mon')
+        assert schedule.matches(datetime(2024, 2, 5, 9, 0))
+        assert not schedule.matches(datetime(2024, 5, 6, 9, 0))
+
+    def test_sunday_as_seven(self):
+        """
+        Test that Sunday can be written as 0 or 7.
+        """
+        sunday = datetime(2024, 5, 5, 0, 0)
+        assert CronSchedule('0 0 * * 7').matches(sunday)
+        assert CronSchedule('0 0 * * 0').matches(sunday)
+
+    def test_day_of_month_or_weekday(self):
+        """
+        Test that a restricted day of month and day of week match when either
+        of them does.
+        """
+        schedule = CronSchedule('0 0 1 * mon')
+        assert schedule.matches(datetime(2024, 5, 1, 0, 0))
+        assert schedule.matches(datetime(2024, 5, 6, 0, 0))
+        assert not schedule.matches(datetime(2024, 5, 7, 0, 0))
+
+    @pytest.mark.parametrize('expression', [
+        '* * * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *', 'x * * * *'])
+    def test_invalid(self, expression):
+        """
+        Test that invalid expressions raise a ValueError.
+        """
+        with pytest.raises(ValueError):
+            CronSchedule(expression)
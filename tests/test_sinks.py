@@ -0,0 +1,151 @@
+import json
+import stat
+import uuid
+import decimal
+import ipaddress
+import datetime
+import xml.etree.ElementTree as ElementTree
+import pytest
+from validator import sinks
+
+
+class MockRow:
+    """Mock class to simulate a row returned from a SQL query."""
+
+    def __init__(self, **kwargs):
+        self._mapping = kwargs
+
+
+def make_result(name, status, rows=()):
+    return {'name': name, 'target': None, 'status': status, 'duration': 0.5,
+            'pool_wait': 0.0, 'short_circuited': False,
+            'error_messages': [] if status == 'PASS' else ['went wrong'],
+            'violations': {'no_nulls': len(rows)} if rows else {},
+            'erroneous_rows': list(rows), 'sampled_rows': [],
+            'assertions': {}, 'query': 'SELECT 1 < 2'}
+
+
+SUMMARY = {'total': 3, 'passed': 1, 'failed': 1, 'errors': 1, 'timeouts': 0,
+           'runtime': 1.5}
+
+
+class TestSerialize:
+    def test_column_types(self):
+        """
+        Test that the column types json can't handle are serialized.
+        """
+        value = {
+            'amount': decimal.Decimal('1.10'),
+            'created_at': datetime.datetime(2024, 5, 6, 7, 8, 9),
+            'day': datetime.date(2024, 5, 6),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'blob': b'\x00\xff'
+        }
+        assert json.loads(sinks.dumps(value)) == {
+            'amount': '1.10',
+            'created_at': '2024-05-06T07:08:09',
+            'day': '2024-05-06',
+            'id': '12345678-1234-5678-1234-567812345678',
+            'blob': 'AP8='
+        }
+
+    def test_subclass(self):
+        """
+        Test that subclasses of known types are serialized like their base.
+        """
+        class DriverDecimal(decimal.Decimal):
+            pass
+
+        assert sinks.dumps(DriverDecimal('2.5')) == '"2.5"'
+
+    def test_unknown_type(self):
+        """
+        Test that unknown types are serialized as their string.
+        """
+        assert sinks.dumps(ipaddress.IPv4Address('10.0.0.1')) == '"10.0.0.1"'
+
+
+class TestSinks:
+    def test_json_lines(self, tmp_path):
+        """
+        Test that every result is written as one line as it arrives.
+        """
+        path = tmp_path / 'results.jsonl'
+        sink = sinks.create_sink('jsonl', str(path), 'run-1')
+
+        sink.write(make_result('a', 'PASS'))
+        assert len(path.read_text().splitlines()) == 1
+        sink.write(make_result('b', 'FAIL', [MockRow(
+            id=1, amount=decimal.Decimal('3.00'))]))
+        sink.close(SUMMARY)
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [(line['run'], line['name']) for line in lines] == [
+            ('run-1', 'a'), ('run-1', 'b')]
+        assert lines[1]['erroneous_rows'] == [{'id': 1, 'amount': '3.00'}]
+
+    def test_junit(self, tmp_path):
+        """
+        Test that the JUnit report holds every test case and the totals.
+        """
+        path = tmp_path / 'junit.xml'
+        sink = sinks.create_sink('junit', str(path), 'run-1')
+
+        sink.write(make_result('a', 'PASS'))
+        sink.write(make_result('b <&>', 'FAIL', [MockRow(id=1)]))
+        sink.write(make_result('c', 'ERROR'))
+        sink.close(SUMMARY)
+
+        suite = ElementTree.parse(path).getroot()
+        assert (suite.get('tests'), suite.get('failures'),
+                suite.get('errors')) == ('3', '1', '1')
+        cases = suite.findall('testcase')
+        assert [case.get('name') for case in cases] == ['a', 'b <&>', 'c']
+        assert cases[1].find('failure').get('message') == 'went wrong'
+        assert cases[2].find('error') is not None
+        assert [p.name for p in tmp_path.iterdir()] == ['junit.xml']
+
+    def test_summary(self, tmp_path):
+        """
+        Test that the summary sink writes only the summary.
+        """
+        path = tmp_path / 'summary.json'
+        sink = sinks.create_sink('summary', str(path), 'run-1')
+
+        sink.write(make_result('a', 'PASS'))
+        sink.close(SUMMARY)
+
+        assert json.loads(path.read_text()) == SUMMARY
+
+    def test_write_atomically(self, tmp_path):
+        """
+        Test that a file is only replaced once written in full, through a
+        temporary file that is removed if writing fails.
+        """
+        path = tmp_path / 'summary.json'
+        sinks.write_atomically(str(path), lambda file: file.write('old'))
+
+        def fail(file):
+            file.write('partial')
+            raise OSError("disk full")
+
+        with pytest.raises(OSError):
+            sinks.write_atomically(str(path), fail)
+        assert path.read_text() == 'old'
+        assert [p.name for p in tmp_path.iterdir()] == ['summary.json']
+
+    def test_write_atomically_mode(self, tmp_path):
+        """
+        Test that a file gets the mode of files created by open(), not the
+        owner-only mode of temporary files.
+        """
+        path = tmp_path / 'summary.json'
+        sinks.write_atomically(str(path), lambda file: file.write('{}'))
+        assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~sinks._UMASK
+
+    def test_unknown_format(self):
+        """
+        Test that an unknown format is rejected.
+        """
+        with pytest.raises(ValueError):
+            sinks.create_sink('csv', 'results.csv', 'run-1')
@@ -0,0 +1,66 @@
+import pytest
+from validator import sketches
+
+
+class TestHyperLogLog:
+    @pytest.mark.parametrize("count", [10, 1000, 100_000])
+    def test_estimate(self, count):
+        """
+        Test that the estimate is within a few standard errors of the number
+        of distinct values, however often they repeat.
+        """
+        sketch = sketches.HyperLogLog()
+        sketch.update(range(count))
+        sketch.update([str(value) for value in range(count)])
+        sketch.update(range(count))
+        assert abs(sketch.count() / (2 * count) - 1) < 4 * sketch.error
+
+
+class TestBloomFilter:
+    def test_no_false_negatives(self):
+        """
+        Test that added values are always found, and that the false
+        positive rate stays near the one the filter is sized for.
+        """
+        bloom = sketches.BloomFilter(10_000, error_rate=0.01)
+        false_positives = sum(bloom.add(value) for value in range(10_000))
+        assert all(bloom.add(value) for value in range(10_000))
+        assert false_positives < 100
+        assert bloom.error_rate() == pytest.approx(0.01, rel=0.1)
+
+    @pytest.mark.skipif(sketches.np is None, reason="NumPy not installed")
+    def test_same_bits_with_numpy(self, monkeypatch):
+        """
+        Test that batches hashed with NumPy set the bits and find the
+        repeats of values added one by one.
+        """
+        values = [*range(550), *range(100, 200), 'a', 2.5, (1, 'b')]
+        vectorized = sketches.BloomFilter(1000)
+        repeats = vectorized.update(values)
+
+        monkeypatch.setattr(sketches, 'np', None)
+        scalar = sketches.BloomFilter(1000)
+        assert scalar.update(values) == repeats == list(range(550, 650))
+        assert scalar.bits == vectorized.bits
+
+
+class TestUniqueValues:
+    def test_exact_repeats(self):
+        """
+        Test that repeats are found within and across batches.
+        """
+        seen = sketches.UniqueValues(exact_limit=100)
+        assert seen.repeats([1, 2, 3]) == []
+        assert seen.repeats([4, 2, 4]) == [1, 2]
+        assert (seen.repeated, seen.exact) == (2, True)
+
+    def test_switches_to_bloom_filter(self):
+        """
+        Test that values beyond the exact limit go to a Bloom filter, which
+        still finds repeats of the values held exactly before.
+        """
+        seen = sketches.UniqueValues(exact_limit=10, bloom_capacity=1000)
+        seen.repeats(list(range(20)))
+        assert not seen.exact
+        assert seen.repeats([5, 20]) == [0]
+        assert (seen.repeated, seen.probable, seen.unexplained()) == (0, 1, 1)
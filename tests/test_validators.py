@@ -1,6 +1,7 @@
 
+import random
 import pytest
-from validator import validators
+from validator import columnar, validators
 
 
 class MockRow:
@@ -73,6 +74,50 @@ class TestMissing:
         assert validator_result.erroneous_rows == expected_erroneous
 
 
+class TestMissingRegex:
+    ROWS = [MockRow(id=1, email='alice@example.com'),
+            MockRow(id=2, email='bob@test.com'),
+            MockRow(id=3, email='admin@test.com'),
+            MockRow(id=4, email=None)]
+
+    def test_patterns(self):
+        """
+        Test that values matching any pattern are reported, with the rows
+        matching each pattern.
+        """
+        result = validators.missing(self.ROWS, [
+            {'column': 'email', 'values': ['alice@example.com'],
+             'regex': [r'@test\.com$', '^admin']}])
+        assert not result.success
+        assert result.violations == 3
+        assert result.message == (
+            "Unexpected values found: email in values (1 rows), "
+            "email ~ '@test\\\\.com$' (2 rows), email ~ '^admin' (1 rows)")
+
+    def test_patterns_without_values(self):
+        """
+        Test rules with patterns only.
+        """
+        result = validators.missing(self.ROWS, [
+            {'column': 'email', 'regex': ['^nobody']}])
+        assert result.success
+
+    @pytest.mark.parametrize("patterns", [
+        ['(q)', r'(t)es\1'],
+        ['^x', '(?i)^ADMIN'],
+        ['(?P<user>bob)@', r'(?P<user>admin)@']
+    ])
+    def test_patterns_that_cannot_be_combined(self, patterns):
+        """
+        Test that patterns still match on their own if combining them would
+        change their meaning.
+        """
+        forbidden = validators.Forbidden(
+            {'column': 'email', 'regex': patterns})
+        assert forbidden.search('admin@test.com')
+        assert not forbidden.search('carol@example.com')
+
+
 class TestNulls:
     @pytest.fixture
     def sample_data_with_null(self):
@@ -124,5 +169,357 @@ class TestNulls:
             MockRow(id=1, name='Alice'), MockRow(id=3, name='Charlie')]
 
 
+class TestBatches:
+    def test_checks_across_batches(self, sample_data):
+        """
+        Test that checks fed batch by batch match the single-list result.
+        """
+        checks = [validators.RowCount(3),
+                  validators.Has([{'column': 'name', 'values': ['Alice', 'Charlie']}]),
+                  validators.Missing([{'column': 'name', 'values': ['Dan']}]),
+                  validators.NoNulls(['id'])]
+        for batch in (sample_data[:2], sample_data[2:]):
+            for check in checks:
+                check.feed(batch)
+        assert all(check.finish().success for check in checks)
+
+    def test_row_count_bounded_capture(self, sample_data):
+        """
+        Test that a failing row count keeps only the sampled rows.
+        """
+        check = validators.RowCount(2, validators.Capture(samples=1))
+        check.feed(sample_data)
+        validator_result = check.finish()
+        assert validator_result.success is False
+        assert validator_result.erroneous_rows == sample_data[:1]
+        assert validator_result.violations == 3
+
+
+class TestCapture:
+    def test_counts_beyond_samples(self):
+        """
+        Test that violations are counted past the sample limit.
+        """
+        capture = validators.Capture(samples=2)
+        for row in range(5):
+            capture.add(row)
+        capture.extend([5, 6])
+        assert capture.count == 7
+        assert capture.rows == [0, 1]
+
+    def test_reservoir_sample(self):
+        """
+        Test that the reservoir holds a bounded sample of all violations.
+        """
+        capture = validators.Capture(samples=0, reservoir=3)
+        capture.extend(list(range(100)))
+        assert capture.count == 100
+        assert capture.rows == []
+        assert len(capture.sampled) == 3
+        assert set(capture.sampled) <= set(range(100))
+
+
+class TestAssertionPlan:
+    KEYS = ['id', 'name']
+    ROWS = [(1, 'Alice'), (2, None), (3, 'Charlie')]
+
+    @pytest.fixture
+    def assertions(self):
+        return {
+            'count': 3,
+            'has': [{'column': 'name', 'values': ['Alice', 'Dan']}],
+            'missing': [{'column': 'name', 'values': ['Charlie']}],
+            'no_nulls': ['name'],
+            'only_nulls': ['id']
+        }
+
+    def test_evaluates_all_assertions(self, assertions):
+        """
+        Test that a plan evaluates every assertion on positional rows.
+        """
+        evaluation = validators.AssertionPlan(assertions).start(self.KEYS)
+        evaluation.feed(self.ROWS)
+        failed = dict(evaluation.failures())
+        assert set(failed) == {'has', 'missing', 'no_nulls', 'only_nulls'}
+        assert failed['missing'].erroneous_rows == [(3, 'Charlie')]
+        assert failed['no_nulls'].erroneous_rows == [(2, None)]
+
+    def test_plan_is_reusable(self, assertions):
+        """
+        Test that runs of a plan neither share state nor modify the rules.
+        """
+        plan = validators.compile_assertions(assertions)
+        for _ in range(2):
+            evaluation = plan.start(self.KEYS)
+            evaluation.feed(self.ROWS)
+            assert len(evaluation.failures()) == 4
+        assert assertions['has'][0]['values'] == ['Alice', 'Dan']
+        assert validators.compile_assertions(assertions) is plan
+
+    def test_plans_are_evicted(self, monkeypatch):
+        """
+        Test that the least recently used plans are evicted once the cache
+        is full.
+        """
+        monkeypatch.setattr(validators, 'MAX_PLANS', 2)
+        monkeypatch.setattr(validators, '_plans', validators.OrderedDict())
+        first = validators.compile_assertions({'count': 1})
+        validators.compile_assertions({'count': 2})
+        assert validators.compile_assertions({'count': 1}) is first
+
+        validators.compile_assertions({'count': 3})
+        assert list(validators._plans) == [repr({'count': 1}),
+                                           repr({'count': 3})]
+
+    def test_unknown_assertion(self):
+        """
+        Test that unknown assertions are reported as failures.
+        """
+        evaluation = validators.AssertionPlan({'bogus': 1}).start(self.KEYS)
+        evaluation.feed(self.ROWS)
+        assert evaluation.failures()[0][0] == 'bogus'
+
+
+class TestShortCircuit:
+    KEYS = ['id', 'name']
+
+    def test_decided_on_first_violation(self):
+        """
+        Test that failing checks are decided before the result is exhausted.
+        """
+        evaluation = validators.AssertionPlan(
+            {'count': 1, 'no_nulls': ['name']}).start(self.KEYS)
+        evaluation.feed([(1, 'Alice')])
+        assert not evaluation.decided
+        evaluation.feed([(2, None)])
+        assert evaluation.decided
+        evaluation.stop()
+        failed = dict(evaluation.failures())
+        assert failed['count'].message == "Expected 1, got at least 2"
+
+    def test_has_decided_once_all_found(self):
+        """
+        Test that has is decided once every expected value has been seen.
+        """
+        check = validators.Has([{'column': 'name', 'values': ['Alice']}])
+        assert not check.decided
+        check.feed([MockRow(id=1, name='Alice')])
+        assert check.decided
+
+
+class TestConditions:
+    KEYS = ['id', 'name', 'score']
+    ROWS = [(1, 'Alice', '9.5'), (2, 'Bob', None), (3, 'Charlie', '4')]
+
+    @pytest.mark.parametrize("rule,violations", [
+        ({'column': 'id', 'operator': '>', 'value': '1'}, 1),
+        ({'column': 'id', 'operator': '<=', 'value': 2}, 1),
+        ({'column': 'id', 'operator': 'between', 'value': [1, 3]}, 0),
+        ({'column': 'id', 'operator': 'not in', 'value': ['2']}, 1),
+        ({'column': 'name', 'operator': 'like', 'value': '%li%'}, 1),
+        ({'column': 'name', 'operator': '!=', 'value': 'Bob'}, 1),
+        ({'column': 'score', 'operator': '>=', 'value': '4'}, 0)
+    ])
+    def test_operators(self, rule, violations):
+        """
+        Test the operators, with values converted to the column's type and
+        null values satisfying every condition.
+        """
+        check = validators.Conditions(
+            validators.Conditions.compile([rule]))
+        check.bind(self.KEYS)
+        check.feed(self.ROWS)
+        result = check.finish()
+        assert result.success is (violations == 0)
+        assert result.violations == violations
+
+    def test_row_counted_once(self):
+        """
+        Test that a row violating several conditions is captured once.
+        """
+        result = validators.conditions(
+            [MockRow(id=1, name='Alice'), MockRow(id=2, name='Bob')],
+            [{'column': 'id', 'operator': '=', 'value': 1},
+             {'column': 'name', 'operator': 'like', 'value': 'A%'}])
+        assert result.erroneous_rows == [MockRow(id=2, name='Bob')]
+        assert result.message == (
+            "Rows not matching conditions: id = 1 (1 rows), "
+            "name like 'A%' (1 rows)")
+
+    def test_invalid_value(self):
+        """
+        Test that a value that can't be converted to the column's type is
+        reported.
+        """
+        with pytest.raises(ValueError, match="Cannot compare column 'id'"):
+            validators.conditions(
+                [MockRow(id=1)],
+                [{'column': 'id', 'operator': '>', 'value': 'abc'}])
+
+    def test_unknown_operator(self):
+        """
+        Test that unknown operators are rejected when the test is compiled.
+        """
+        with pytest.raises(ValueError, match="Unknown operator"):
+            validators.AssertionPlan(
+                {'conditions': [{'column': 'id', 'operator': '~',
+                                 'value': 'x'}]})
+
+
+class TestCardinality:
+    KEYS = ['id', 'tenant', 'email']
+    ROWS = [(1, 'a', 'x@example.com'), (2, 'a', 'y@example.com'),
+            (2, 'b', None), (3, 'b', 'x@example.com'), (None, 'b', None)]
+
+    def evaluate(self, assertions, batches, **sketch):
+        evaluation = validators.AssertionPlan(assertions).start(
+            self.KEYS, sketch=sketch)
+        for batch in batches:
+            evaluation.feed(batch)
+        return evaluation
+
+    def test_unique(self):
+        """
+        Test that repeated keys are found across batches, skipping keys
+        with a null value.
+        """
+        evaluation = self.evaluate(
+            {'unique': ['id', ['tenant', 'email'], ['id', 'tenant']]},
+            [self.ROWS[:2], self.ROWS[2:]])
+        assert evaluation.decided
+        [(key, result)] = evaluation.failures()
+        assert result.message == "Duplicate values found: id (1 rows)"
+        assert result.erroneous_rows == [self.ROWS[2]]
+        assert not result.approximate
+
+    def test_unique_beyond_exact_limit(self):
+        """
+        Test that uniqueness is approximate beyond the exact limit, and
+        still finds repeats.
+        """
+        rows = [(value, 'a', None) for value in range(1000)]
+        evaluation = self.evaluate({'unique': ['id']}, [rows],
+                                   exact_limit=10, bloom_capacity=10_000)
+        assert evaluation.failures() == []
+        assert evaluation.approximate == ['unique']
+
+        evaluation = self.evaluate({'unique': ['id']}, [rows, rows[:50]],
+                                   exact_limit=10, bloom_capacity=10_000)
+        [(key, result)] = evaluation.failures()
+        assert result.message == ("Duplicate values found: id (about 50 "
+                                  "rows, approximate)")
+        assert result.approximate
+
+    @pytest.mark.parametrize("rule,message", [
+        ({'column': 'email', 'max': 2}, None),
+        ({'column': 'email', 'max': 1},
+         "Distinct values out of range: email: 2, expected at most 1"),
+        ({'column': 'tenant', 'min': 3, 'max': 4},
+         "Distinct values out of range: tenant: 2, expected between 3 and 4")
+    ])
+    def test_distinct_count(self, rule, message):
+        """
+        Test that distinct non-null values are counted against the bounds.
+        """
+        [result] = [result for _, result in self.evaluate(
+            {'distinct_count': [rule]}, [self.ROWS]).failures()] or [None]
+        assert (result.message if result else None) == message
+
+    def test_distinct_ratio(self):
+        """
+        Test that the ratio is taken over non-null values.
+        """
+        evaluation = self.evaluate(
+            {'distinct_ratio': [{'column': 'email', 'min': 0.7},
+                                {'column': 'id', 'min': 0.7}]}, [self.ROWS])
+        [(key, result)] = evaluation.failures()
+        assert result.message == ("Distinct ratio out of range: email: "
+                                  "0.6667, expected at least 0.7")
+
+    def test_distinct_count_beyond_exact_limit(self):
+        """
+        Test that counts beyond the exact limit are estimated and marked as
+        approximate.
+        """
+        rows = [(value % 5000, 'a', None) for value in range(20_000)]
+        assertions = {'distinct_count': [{'column': 'id', 'min': 4800,
+                                          'max': 5200}],
+                      'distinct_ratio': [{'column': 'id', 'min': 0.5}]}
+        evaluation = self.evaluate(assertions, [rows[:10_000], rows[10_000:]],
+                                   exact_limit=100)
+        assert evaluation.approximate == ['distinct_count', 'distinct_ratio']
+        [(key, result)] = evaluation.failures()
+        assert key == 'distinct_ratio'
+        assert result.message.startswith(
+            "Distinct ratio out of range: id: about 0.2")
+        assert result.approximate
+
+
+@pytest.mark.skipif(not columnar.available(), reason="NumPy not installed")
+class TestColumnar:
+    KEYS = ['id', 'name', 'score']
+    ASSERTIONS = {
+        'count': 200,
+        'has': [{'column': 'name', 'values': ['a', 'b', 'z']},
+                {'column': 'id', 'values': [3, 5]}],
+        'missing': [{'column': 'name', 'values': ['c'], 'regex': ['^d', 'e$']},
+                    {'column': 'score', 'values': [7]}],
+        'no_nulls': ['name', 'score'],
+        'only_nulls': ['unknown', 'score'],
+        'conditions': [{'column': 'score', 'operator': 'between',
+                        'value': ['2', '8']},
+                       {'column': 'name', 'operator': 'not like',
+                        'value': 'b%'},
+                       {'column': 'id', 'operator': 'not in',
+                        'value': [1, 2]}]
+    }
+
+    @pytest.fixture
+    def rows(self):
+        rng = random.Random(42)
+        return [(rng.randrange(20),
+                 rng.choice(['a', 'b', 'c', 'd', 'be', None]),
+                 rng.choice([None, *range(10)]))
+                for _ in range(300)]
+
+    def evaluate(self, batches, columnar_threshold):
+        evaluation = validators.AssertionPlan(self.ASSERTIONS).start(
+            self.KEYS, samples=5, columnar_threshold=columnar_threshold)
+        for batch in batches:
+            evaluation.feed(batch)
+        return [(key, result.message, result.violations,
+                 result.erroneous_rows)
+                for key, result in evaluation.failures()]
+
+    @pytest.mark.parametrize("batch_size", [300, 64])
+    def test_same_results_as_rows(self, rows, batch_size):
+        """
+        Test that evaluating batches column by column gives the results of
+        visiting the rows one by one, also when the last smaller batch is
+        visited row by row.
+        """
+        batches = [rows[start:start + batch_size]
+                   for start in range(0, len(rows), batch_size)]
+
+        expected = self.evaluate(batches, 0)
+        assert [key for key, *_ in expected] == [
+            'count', 'has', 'missing', 'no_nulls', 'only_nulls',
+            'conditions']
+        assert self.evaluate(batches, 50) == expected
+
+    def test_threshold(self, rows):
+        """
+        Test that only batches of at least the threshold are columnar.
+        """
+        evaluation = validators.AssertionPlan({'count': 1}).start(
+            self.KEYS, columnar_threshold=100)
+        assert evaluation.columnar(rows)
+        assert not evaluation.columnar(rows[:99])
+
+        evaluation = validators.AssertionPlan({'count': 1}).start(
+            columnar_threshold=100)
+        assert not evaluation.columnar(rows)
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,44 @@
+import decimal
+import pytest
+from validator import workers
+
+
+class TestEncodeBatch:
+    @pytest.mark.parametrize("rows", [
+        [(1, 2.5, 'a'), (None, None, None), (3, -0.0, 'é')],
+        [(None,), (None,)],
+        [(2 ** 70,), (1,)],
+        [(decimal.Decimal('1.5'), True), (None, False)],
+        [],
+    ])
+    def test_round_trip(self, rows):
+        """
+        Test that rows come back unchanged, whatever the column types.
+        """
+        header, parts = workers.encode_batch(rows, 3)
+        buffer = memoryview(b''.join(parts))
+        assert workers.decode_batch(buffer, header) == rows
+
+    def test_columnar_encoding(self):
+        """
+        Test that numbers and text are not pickled.
+        """
+        header, _ = workers.encode_batch([(1, 1.5, 'a', None)], 4)
+        assert [kind for kind, _, _ in header[1]] == [
+            'int', 'float', 'str', 'null']
+
+
+class TestSlot:
+    def test_grows(self):
+        """
+        Test that a slot keeps its block while batches fit, and grows it
+        when they do not.
+        """
+        slot = workers.Slot(0)
+        try:
+            name = slot.write([memoryview(b'abc')])
+            assert slot.write([memoryview(b'de')]) == name
+            assert slot.write([memoryview(b'x' * 10)]) != name
+            assert bytes(slot.block.buf[:10]) == b'x' * 10
+        finally:
+            slot.release()
@@ -0,0 +1,269 @@
+import time
+import asyncio
+import sqlalchemy
+import database
+import planner
+import pushdown
+import runner
+import validators
+
+
+async def run_pushdown(conn, query, assertions, capture):
+    """
+    Answer the assertions with one aggregate query in the database, like
+    `runner.run_pushdown`.
+
+    Returns:
+        list: List of (key, TestResult) tuples for failed assertions.
+    """
+
+    aggregate = pushdown.AggregateQuery(query, assertions, conn.dialect)
+    result = await conn.execute(sqlalchemy.text(aggregate.sql),
+                                aggregate.params)
+    failed_assertions = aggregate.failures(result.one())
+
+    for key, test_result in failed_assertions:
+        result = await conn.execute(
+            sqlalchemy.text(aggregate.sample(key, capture['samples'])),
+            aggregate.params)
+        test_result.erroneous_rows = result.all()
+
+    return failed_assertions
+
+
+async def close_stream(conn, result):
+    """
+    Stop a streamed query before it is exhausted, like
+    `database.close_stream`. aiomysql drains the rest of an unbuffered
+    result when its cursor is closed, so MySQL connections are discarded
+    instead.
+    """
+
+    if conn.dialect.name in ('mysql', 'mariadb'):
+        await conn.invalidate()
+    else:
+        await result.close()
+
+
+async def stream_assertions(conn, result, checks, plan):
+    """
+    Run the assertions of the tests sharing a query on batches of a
+    streamed result, like `runner.run_shared_assertions`.
+
+    Returns:
+        list: The Evaluation of each test, in order.
+    """
+
+    keys = list(result.keys())
+    evaluations = [validators.compile_assertions(assertions).start(
+        keys, columnar_threshold=plan['columnar_threshold'],
+        sketch=plan['sketch'], **capture)
+        for assertions, capture in checks]
+
+    async for batch in result.partitions(plan['batch_size']):
+        validators.feed_shared(evaluations, batch)
+        if plan['short_circuit'] and all(evaluation.decided
+                                         for evaluation in evaluations):
+            for evaluation in evaluations:
+                evaluation.stop()
+            break
+
+    if evaluations[0].short_circuited:
+        await close_stream(conn, result)
+
+    return evaluations
+
+
+async def evaluate_tests(conn, plans):
+    """
+    Run the query shared by the tests on the connection once and evaluate
+    every test's assertions, like `runner.evaluate_tests`. Tests are not
+    profiled, as cProfile can't tell the tasks sharing the thread apart.
+
+    Returns:
+        list: The outcome of each test, as keyword arguments for
+        `runner.build_result`.
+    """
+
+    plan = plans[0]
+    start_time = time.perf_counter()
+
+    if plan['pushdown']:
+        failed_assertions = await run_pushdown(
+            conn, plan['query'], plan['assertions'], plan['capture'])
+        return [{'failed_assertions': failed_assertions,
+                 'timings': {'execute': time.perf_counter() - start_time}}]
+
+    statement, limit = runner.shared_statement(plans)
+    statement = sqlalchemy.text(statement)
+    checks = [(plan['assertions'], plan['capture']) for plan in plans]
+    timings = {}
+
+    if plan['stream']:
+        result = await conn.stream(
+            statement, execution_options={'yield_per': plan['batch_size']})
+        fetch_time = time.perf_counter()
+        timings['execute'] = fetch_time - start_time
+
+        evaluations = await stream_assertions(conn, result, checks, plan)
+        timings['fetch'] = (time.perf_counter() - fetch_time -
+                            sum(evaluation.elapsed
+                                for evaluation in evaluations))
+    else:
+        result = await conn.execute(statement)
+        fetch_time = time.perf_counter()
+        timings['execute'] = fetch_time - start_time
+
+        rows = result.all()
+        timings['fetch'] = time.perf_counter() - fetch_time
+
+        evaluations = runner.run_shared_assertions(
+            rows, checks, result.keys(), False, plan['columnar_threshold'],
+            plan['sketch'])
+
+    runner.stop_at_limit(evaluations, limit)
+
+    return [{'evaluation': evaluation,
+             'timings': {**timings, 'evaluate': evaluation.elapsed}}
+            for evaluation in evaluations]
+
+
+async def capture_explain(conn, plan):
+    """
+    Explain the query of a slow test, like `runner.capture_explain`.
+
+    Returns:
+        str: The query plan, or why it could not be captured.
+    """
+
+    statement = database.explain_statement(conn.dialect.name, plan['query'])
+    if statement is None:
+        return None
+
+    try:
+        result = await asyncio.wait_for(
+            conn.execute(sqlalchemy.text(statement)), plan['timeout'] or None)
+        return database.format_plan(result)
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+
+
+async def interrupt_after(conn, seconds):
+    """
+    asyncpg cancels the statement on the server when its task is cancelled
+    and MySQL enforces max_execution_time, but aiosqlite keeps running the
+    statement on its thread. Interrupt it once the timeout has passed.
+
+    Returns:
+        TimerHandle: The scheduled interrupt, or None.
+    """
+
+    if not seconds or conn.dialect.name != 'sqlite':
+        return None
+
+    driver_conn = (await conn.get_raw_connection()).driver_connection
+    return asyncio.get_running_loop().call_later(
+        seconds, lambda: asyncio.ensure_future(driver_conn.interrupt()))
+
+
+async def execute_tests(tests, engine, semaphore, cfg):
+    """
+    Execute a group of tests sharing a query on an async engine, running the
+    query once for all of them. At most as many groups as the semaphore
+    allows wait on the database at the same time. Tests running into their
+    timeout are cancelled, which makes the driver cancel the statement, and
+    the connection is discarded from the pool.
+
+    Returns:
+        list: The result of each test, in order.
+    """
+
+    async with semaphore:
+        start_time = time.time()
+        started = time.perf_counter()
+        plans = [runner.plan_test(test, engine.dialect.name, cfg)
+                 for test in tests]
+        timings = {'plan': time.perf_counter() - started}
+        timeout = plans[0]['timeout']
+        pool_wait = 0.0
+
+        try:
+            connect_time = time.perf_counter()
+            async with engine.connect() as conn:
+                pool_wait = time.perf_counter() - connect_time
+                timings['connect'] = pool_wait
+
+                set_timeout, reset_timeout = database.timeout_statements(
+                    conn.dialect.name, timeout or 0)
+                interrupt = await interrupt_after(conn, timeout)
+                try:
+                    if timeout and set_timeout:
+                        await conn.exec_driver_sql(set_timeout)
+                    outcomes = await asyncio.wait_for(
+                        evaluate_tests(conn, plans), timeout or None)
+                except Exception as e:
+                    if not (isinstance(e, asyncio.TimeoutError) or
+                            database.is_timeout(e)):
+                        raise
+                    await conn.invalidate()
+                    return [runner.build_result(test, start_time, pool_wait,
+                                                timeout=timeout,
+                                                timings=timings)
+                            for test in tests]
+                finally:
+                    if interrupt is not None:
+                        interrupt.cancel()
+                    # The session's limit would apply to the next test on the
+                    # pooled connection, whatever this test's outcome
+                    if (timeout and reset_timeout and
+                            not conn.invalidated):
+                        try:
+                            await conn.exec_driver_sql(reset_timeout)
+                        except sqlalchemy.exc.DBAPIError:
+                            await conn.invalidate()
+
+                explain = (await capture_explain(conn, plans[0])
+                           if runner.is_slow(plans[0], started) else None)
+
+            return [runner.build_result(test, start_time, pool_wait,
+                                        **outcome)
+                    for test, outcome in zip(tests, runner.finish_outcomes(
+                        outcomes, timings, explain))]
+
+        except Exception as e:
+            return [runner.build_result(test, start_time, pool_wait, error=e,
+                                        timings=timings)
+                    for test in tests]
+
+
+async def run_tests(tests, engine, cfg, on_result):
+    """
+    Run all tests concurrently on the event loop, executing each query
+    shared by several tests once.
+
+    Args:
+        tests (list): The test definitions.
+        engine (AsyncEngine): The shared async engine.
+        cfg (dict): The configuration.
+        on_result (callable): Called with each test result as it completes.
+    """
+
+    semaphore = asyncio.Semaphore(cfg['ASYNC_CONCURRENCY'])
+    groups = planner.group_tests(tests, engine.dialect.name, cfg)
+
+    # Tasks are created in submission order, so the semaphore admits tests
+    # in the order they were scheduled
+    tasks = [asyncio.ensure_future(
+        execute_tests(group, engine, semaphore, cfg)) for group in groups]
+    for future in asyncio.as_completed(tasks):
+        for result in await future:
+            on_result(result)
+
+
+async def run_once(tests, engine, cfg, on_result):
+    """Run all tests like `run_tests`, then dispose of the engine."""
+
+    try:
+        await run_tests(tests, engine, cfg, on_result)
+    finally:
+        await engine.dispose()
@@ -0,0 +1,170 @@
+import time
+import queue
+import logging
+import database
+import planner
+import runner
+from concurrent.futures import as_completed
+
+
+class SnapshotSession:
+    """
+    A connection running many tests in one read-only, repeatable read
+    transaction, instead of a connection and transaction per test. Tests run
+    in batch mode see one consistent state of the database.
+
+    The connection is opened when the session runs its first tests, and
+    reopened if it had to be discarded, e.g. after a timeout.
+
+    Args:
+        engine (Engine): The shared engine.
+        snapshot_id (str): The PostgreSQL snapshot to import, if any.
+    """
+
+    def __init__(self, engine, snapshot_id=None):
+        self.engine = engine
+        self.snapshot_id = snapshot_id
+        self.conn = None
+
+    def connection(self):
+        """
+        Returns:
+            tuple: The session's connection and the seconds spent waiting
+            for it, if it had to be opened.
+        """
+
+        if self.conn is not None and self.conn.invalidated:
+            logging.warning("Snapshot connection was discarded, "
+                            "opening a new one")
+            self.close()
+
+        if self.conn is None:
+            conn, pool_wait = database.connect(self.engine)
+            try:
+                database.begin_snapshot(conn, self.snapshot_id)
+            except Exception:
+                conn.close()
+                raise
+            self.conn = conn
+            return conn, pool_wait
+
+        return self.conn, 0.0
+
+    def recover(self):
+        """
+        Undo the effects of the last tests on the transaction. PostgreSQL
+        aborts the transaction on errors and keeps the statement timeout set
+        for a test until it ends, so it rolls back to the savepoint taken at
+        the start of the session.
+        """
+
+        if self.conn is None or self.conn.invalidated:
+            return
+
+        if self.conn.dialect.name == 'postgresql':
+            try:
+                self.conn.exec_driver_sql(
+                    f"ROLLBACK TO SAVEPOINT {database.SNAPSHOT_SAVEPOINT}")
+            except Exception:
+                self.conn.invalidate()
+
+    def execute_tests(self, tests, cfg):
+        """
+        Execute a group of tests sharing a query in the session's
+        transaction, like `runner.execute_tests`.
+
+        Returns:
+            list: The result of each test, in order.
+        """
+
+        start_time = time.time()
+        started = time.perf_counter()
+        plans = [runner.plan_test(test, self.engine.dialect.name, cfg)
+                 for test in tests]
+        timings = {'plan': time.perf_counter() - started}
+        timeout = plans[0]['timeout']
+        pool_wait = 0.0
+        watchdog = None
+
+        try:
+            conn, pool_wait = self.connection()
+            timings['connect'] = pool_wait
+            try:
+                with database.statement_timeout(
+                        self.engine, conn, timeout) as watchdog:
+                    outcomes = runner.evaluate_tests(conn, plans, watchdog)
+            except Exception as e:
+                self.recover()
+                if not ((watchdog and watchdog.expired) or
+                        database.is_timeout(e)):
+                    raise
+                return [runner.build_result(test, start_time, pool_wait,
+                                            timeout=timeout, timings=timings)
+                        for test in tests]
+
+            explain = None
+            if runner.is_slow(plans[0], started):
+                explain = runner.capture_explain(self.engine, conn, plans[0])
+                self.recover()
+            elif timeout:
+                self.recover()
+
+            return [runner.build_result(test, start_time, pool_wait,
+                                        **outcome)
+                    for test, outcome in zip(tests, runner.finish_outcomes(
+                        outcomes, timings, explain))]
+
+        except Exception as e:
+            return [runner.build_result(test, start_time, pool_wait, error=e,
+                                        timings=timings)
+                    for test in tests]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_batched(tests, on_result, engine, cfg, executor):
+    """
+    Run the tests on a fixed set of snapshot sessions, one per worker
+    thread. Each worker takes the next group of tests and runs it on a free
+    session, so the sessions are shared by all tests of the run.
+
+    On PostgreSQL, one more connection exports its snapshot and holds it
+    for the duration of the run, and every session imports it, so that all
+    tests see the same point in time. Other backends take a snapshot per
+    session when it starts.
+    """
+
+    groups = planner.group_tests(tests, engine.dialect.name, cfg)
+    workers = min(cfg['MAX_WORKERS'], len(groups)) or 1
+
+    exporter = None
+    snapshot_id = None
+    if engine.dialect.name == 'postgresql':
+        exporter = engine.connect()
+        snapshot_id = database.export_snapshot(exporter)
+
+    sessions = queue.Queue()
+    for _ in range(workers):
+        sessions.put(SnapshotSession(engine, snapshot_id))
+
+    def execute(group):
+        session = sessions.get()
+        try:
+            return session.execute_tests(group, cfg)
+        finally:
+            sessions.put(session)
+
+    try:
+        futures = [executor.submit(execute, group) for group in groups]
+
+        for future in as_completed(futures):
+            for result in future.result():
+                on_result(result)
+    finally:
+        while not sessions.empty():
+            sessions.get().close()
+        if exporter is not None:
+            exporter.close()
@@ -0,0 +1,159 @@
+from itertools import repeat
+from operator import itemgetter
+
+# NumPy is optional. Without it, assertions are always evaluated row by row.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available():
+    return np is not None
+
+
+def scalar(value):
+    """
+    Wrap a value in a 0-d object array, so that NumPy compares it with every
+    element instead of broadcasting it, e.g. a string or a tuple.
+    """
+
+    array = np.empty((), dtype=object)
+    array[()] = value
+    return array
+
+
+def contains(values, collection):
+    """
+    Returns:
+        ndarray: Whether each value is in the collection, with the hashing
+        and equality of Python sets.
+    """
+
+    return np.fromiter(map(collection.__contains__, values), dtype=bool,
+                       count=len(values))
+
+
+def strings(values):
+    """
+    Returns:
+        ndarray: Whether each value is a string.
+    """
+
+    return np.fromiter(map(isinstance, values, repeat(str)), dtype=bool,
+                       count=len(values))
+
+
+def searches(values, search):
+    """
+    Returns:
+        ndarray: Whether the regular expression search finds a match in each
+        value. The values must be strings.
+    """
+
+    matches = np.fromiter(map(search, values), dtype=object,
+                          count=len(values))
+    return np.not_equal(matches, None)
+
+
+# Vectorized condition operators, taking the non-null values and the value
+# converted to their type. Other operators apply the predicate's test to
+# every value.
+OPERATORS = {
+    '=': lambda values, value: values == scalar(value),
+    '!=': lambda values, value: values != scalar(value),
+    '<>': lambda values, value: values != scalar(value),
+    '<': lambda values, value: values < scalar(value),
+    '<=': lambda values, value: values <= scalar(value),
+    '>': lambda values, value: values > scalar(value),
+    '>=': lambda values, value: values >= scalar(value),
+    'between': lambda values, value: (
+        (values >= scalar(value[0])) & (values <= scalar(value[1]))),
+    'not between': lambda values, value: ~(
+        (values >= scalar(value[0])) & (values <= scalar(value[1]))),
+    'in': lambda values, value: contains(values, frozenset(value)),
+    'not in': lambda values, value: ~contains(values, frozenset(value))
+}
+
+
+def satisfies(predicate, values, sample):
+    """
+    Evaluate a condition on the non-null values of its column.
+
+    Args:
+        predicate (Predicate): The condition.
+        values (ndarray): The non-null values.
+        sample: A value of the column, that the condition's value is
+            converted to the type of.
+
+    Returns:
+        ndarray: Whether each value satisfies the condition.
+    """
+
+    operator = OPERATORS.get(predicate.operator)
+    if operator is not None:
+        return operator(values, predicate.convert(sample))
+
+    return np.fromiter(map(predicate.bind(sample), values), dtype=bool,
+                       count=len(values))
+
+
+def any_of(masks):
+    """
+    Returns:
+        ndarray: Whether any of the masks is set, per row.
+    """
+
+    return np.logical_or.reduce(masks)
+
+
+def positions(masks):
+    """
+    Returns:
+        list: The positions of the rows hit by the masks in row order. A row
+        is listed once for every mask it is hit by, like when the rows are
+        visited one by one.
+    """
+
+    if len(masks) == 1:
+        return np.flatnonzero(masks[0]).tolist()
+    return np.nonzero(np.stack(masks, axis=1))[0].tolist()
+
+
+class Columns:
+    """
+    A batch of rows as one NumPy object array per column, with a mask of its
+    null values. Columns are converted when they are first used, so only
+    the columns an assertion refers to are converted, once for all of them.
+
+    Args:
+        rows (list): The batch of rows.
+        keys (list): Column names of the result.
+    """
+
+    def __init__(self, rows, keys):
+        self.rows = rows
+        self.keys = list(keys)
+        self.arrays = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        """
+        Returns:
+            tuple: The values of the column as an object array and the mask
+            of its null values. Columns missing from the result are all
+            null, like when the rows are visited one by one.
+        """
+
+        array = self.arrays.get(name)
+        if array is None:
+            if name in self.keys:
+                values = np.fromiter(
+                    map(itemgetter(self.keys.index(name)), self.rows),
+                    dtype=object, count=len(self.rows))
+            else:
+                values = np.full(len(self.rows), None, dtype=object)
+            array = self.arrays[name] = (values, np.equal(values, None))
+        return array
@@ -1,5 +1,6 @@
 from evarify import ConfigStore, EnvironmentVariable
-from evarify.filters.python_basics import validate_is_boolean_true
+from evarify.filters.python_basics import (validate_is_boolean_true,
+                                           value_to_bool, value_to_int)
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file (optional)
@@ -7,9 +8,264 @@ load_dotenv()
 
 # Define the configuration schema using evarify
 settings = ConfigStore({
+    # Required unless the tests run on the named TARGETS
     'DB_URL': EnvironmentVariable(
         name='DB_URL',
-        is_required=True
+        default_val='',
+        is_required=False
+    ),
+    # Connection pool shared by all tests of a run. A pool size of 0 sizes
+    # the pool to the number of worker threads.
+    'DB_POOL_SIZE': EnvironmentVariable(
+        name='DB_POOL_SIZE',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    'DB_MAX_OVERFLOW': EnvironmentVariable(
+        name='DB_MAX_OVERFLOW',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    'DB_POOL_PRE_PING': EnvironmentVariable(
+        name='DB_POOL_PRE_PING',
+        filters=[value_to_bool],
+        default_val='true',
+        is_required=False
+    ),
+    'DB_POOL_RECYCLE': EnvironmentVariable(
+        name='DB_POOL_RECYCLE',
+        filters=[value_to_int],
+        default_val=1800,
+        is_required=False
+    ),
+    'DB_POOL_TIMEOUT': EnvironmentVariable(
+        name='DB_POOL_TIMEOUT',
+        filters=[value_to_int],
+        default_val=30,
+        is_required=False
+    ),
+    # Validate results batch by batch on a server-side cursor
+    'STREAM_RESULTS': EnvironmentVariable(
+        name='STREAM_RESULTS',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    'STREAM_BATCH_SIZE': EnvironmentVariable(
+        name='STREAM_BATCH_SIZE',
+        filters=[value_to_int],
+        default_val=1000,
+        is_required=False
+    ),
+    # Answer assertions with an aggregate query inside the database
+    'PUSHDOWN': EnvironmentVariable(
+        name='PUSHDOWN',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    # Stop fetching rows once every assertion has a final verdict
+    'SHORT_CIRCUIT': EnvironmentVariable(
+        name='SHORT_CIRCUIT',
+        filters=[value_to_bool],
+        default_val='true',
+        is_required=False
+    ),
+    # Wrap the query of a test that only checks the row count in a LIMIT of
+    # count + 1. MySQL rejects the wrapped query if columns share a name.
+    'LIMIT_COUNT_QUERIES': EnvironmentVariable(
+        name='LIMIT_COUNT_QUERIES',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    # Offending rows kept per failed assertion: the first ERROR_SAMPLE_SIZE
+    # rows plus an optional reservoir sample over all of them
+    'ERROR_SAMPLE_SIZE': EnvironmentVariable(
+        name='ERROR_SAMPLE_SIZE',
+        filters=[value_to_int],
+        default_val=10,
+        is_required=False
+    ),
+    'ERROR_RESERVOIR_SIZE': EnvironmentVariable(
+        name='ERROR_RESERVOIR_SIZE',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Run tests on asyncio with async drivers (asyncpg, aiomysql, aiosqlite)
+    'ASYNC_MODE': EnvironmentVariable(
+        name='ASYNC_MODE',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    'ASYNC_CONCURRENCY': EnvironmentVariable(
+        name='ASYNC_CONCURRENCY',
+        filters=[value_to_int],
+        default_val=100,
+        is_required=False
+    ),
+    # Threads running tests concurrently
+    'MAX_WORKERS': EnvironmentVariable(
+        name='MAX_WORKERS',
+        filters=[value_to_int],
+        default_val=4,
+        is_required=False
+    ),
+    # Durations of previous runs, used to submit the longest tests first.
+    # Defaults to a file next to TEST_FILES.
+    'HISTORY_FILE': EnvironmentVariable(
+        name='HISTORY_FILE',
+        default_val='',
+        is_required=False
+    ),
+    # Seconds after which a test's statement is cancelled, 0 for no limit
+    'QUERY_TIMEOUT': EnvironmentVariable(
+        name='QUERY_TIMEOUT',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Lock preventing overlapping runs. Defaults to a file next to TEST_FILES.
+    'LOCK_FILE': EnvironmentVariable(
+        name='LOCK_FILE',
+        default_val='',
+        is_required=False
+    ),
+    # Cache of parsed and validated test files. Defaults to a file next to
+    # TEST_FILES.
+    'TEST_CACHE_FILE': EnvironmentVariable(
+        name='TEST_CACHE_FILE',
+        default_val='',
+        is_required=False
+    ),
+    # Processes parsing changed test files, 0 for the number of CPUs
+    'LOADER_WORKERS': EnvironmentVariable(
+        name='LOADER_WORKERS',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Execute a query shared by several tests once for all of them
+    'DEDUPLICATE_QUERIES': EnvironmentVariable(
+        name='DEDUPLICATE_QUERIES',
+        filters=[value_to_bool],
+        default_val='true',
+        is_required=False
+    ),
+    # Run all tests of a run in read-only snapshot transactions on a fixed
+    # set of connections
+    'BATCH_MODE': EnvironmentVariable(
+        name='BATCH_MODE',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    # Where each test result is written: 'jsonl', 'junit', 'summary' or ''
+    # for none
+    'RESULT_FORMAT': EnvironmentVariable(
+        name='RESULT_FORMAT',
+        default_val='',
+        is_required=False
+    ),
+    'RESULT_FILE': EnvironmentVariable(
+        name='RESULT_FILE',
+        default_val='',
+        is_required=False
+    ),
+    # Port of the /metrics endpoint in daemon mode, 0 to disable it
+    'METRICS_PORT': EnvironmentVariable(
+        name='METRICS_PORT',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # File the metrics are written to after every run, for node_exporter's
+    # textfile collector
+    'METRICS_TEXTFILE': EnvironmentVariable(
+        name='METRICS_TEXTFILE',
+        default_val='',
+        is_required=False
+    ),
+    # Rows from which a result, or a batch of a streamed result, is
+    # validated column by column with NumPy, if it is installed. 0 disables
+    # it.
+    'COLUMNAR_THRESHOLD': EnvironmentVariable(
+        name='COLUMNAR_THRESHOLD',
+        filters=[value_to_int],
+        default_val=1000,
+        is_required=False
+    ),
+    # Distinct values per column that the unique, distinct_count and
+    # distinct_ratio assertions hold exactly, before they switch to
+    # approximate Bloom filter and HyperLogLog sketches
+    'DISTINCT_EXACT_LIMIT': EnvironmentVariable(
+        name='DISTINCT_EXACT_LIMIT',
+        filters=[value_to_int],
+        default_val=100000,
+        is_required=False
+    ),
+    # Values the Bloom filter of a unique column is sized for, at about 1.8
+    # bytes per value
+    'BLOOM_FILTER_CAPACITY': EnvironmentVariable(
+        name='BLOOM_FILTER_CAPACITY',
+        filters=[value_to_int],
+        default_val=10000000,
+        is_required=False
+    ),
+    # Worker processes evaluating the assertions of streamed and large
+    # results, 0 evaluates them in the threads fetching the rows
+    'ASSERTION_PROCESSES': EnvironmentVariable(
+        name='ASSERTION_PROCESSES',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Named databases every test runs on, instead of DB_URL: `name=url`
+    # pairs separated by whitespace, and the targets listed in a YAML file
+    'TARGETS': EnvironmentVariable(
+        name='TARGETS',
+        default_val='',
+        is_required=False
+    ),
+    'TARGETS_FILE': EnvironmentVariable(
+        name='TARGETS_FILE',
+        default_val='',
+        is_required=False
+    ),
+    # Tests running on one target at once, unless the target sets its own
+    # `concurrency`. 0 leaves only the limit of MAX_WORKERS or
+    # ASYNC_CONCURRENCY on all targets together.
+    'TARGET_CONCURRENCY': EnvironmentVariable(
+        name='TARGET_CONCURRENCY',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Run the assertions of every test under cProfile and log the hottest
+    # functions. Tests can also enable it with `profile: true`
+    'PROFILE': EnvironmentVariable(
+        name='PROFILE',
+        filters=[value_to_bool],
+        default_val='false',
+        is_required=False
+    ),
+    # Seconds after which the query plan of a slow test is captured with
+    # EXPLAIN, 0 to disable it
+    'EXPLAIN_THRESHOLD': EnvironmentVariable(
+        name='EXPLAIN_THRESHOLD',
+        filters=[value_to_int],
+        default_val=0,
+        is_required=False
+    ),
+    # Schedule of tests without their own schedule in daemon mode
+    'CRON_SCHEDULE': EnvironmentVariable(
+        name='CRON_SCHEDULE',
+        default_val='*/5 * * * *',
+        is_required=False
     ),
     'TEST_FILES': EnvironmentVariable(
         name='TEST_FILES',
@@ -50,6 +306,44 @@ settings = ConfigStore({
         name='LOKI_TAGS',
         default_val='application=query-validator',
         is_required=False
+    ),
+    # Ship records to Loki in batches from a background thread
+    'LOKI_BATCHING': EnvironmentVariable(
+        name='LOKI_BATCHING',
+        filters=[value_to_bool],
+        default_val='true',
+        is_required=False
+    ),
+    'LOKI_BATCH_SIZE': EnvironmentVariable(
+        name='LOKI_BATCH_SIZE',
+        filters=[value_to_int],
+        default_val=500,
+        is_required=False
+    ),
+    # Seconds after which buffered records are pushed
+    'LOKI_FLUSH_INTERVAL': EnvironmentVariable(
+        name='LOKI_FLUSH_INTERVAL',
+        filters=[value_to_int],
+        default_val=2,
+        is_required=False
+    ),
+    'LOKI_QUEUE_SIZE': EnvironmentVariable(
+        name='LOKI_QUEUE_SIZE',
+        filters=[value_to_int],
+        default_val=10000,
+        is_required=False
+    ),
+    # Record dropped when the buffer is full, 'oldest' or 'newest'
+    'LOKI_DROP_POLICY': EnvironmentVariable(
+        name='LOKI_DROP_POLICY',
+        default_val='oldest',
+        is_required=False
+    ),
+    'LOKI_MAX_RETRIES': EnvironmentVariable(
+        name='LOKI_MAX_RETRIES',
+        filters=[value_to_int],
+        default_val=5,
+        is_required=False
     )
 })
 
@@ -0,0 +1,229 @@
+import signal
+import contextlib
+import asyncio
+import logging
+import datetime
+import threading
+import config
+import logger
+import loader
+import database
+import async_runner
+import main
+import metrics
+import workers
+import targets
+import fanout
+from schedule import CronSchedule
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Daemon:
+    """
+    Resident process running the tests on their schedules, replacing the
+    cron job that starts a new process for every run. Tests are loaded once
+    and reloaded on SIGHUP or when the test files change, and the connection
+    pool stays warm between runs.
+
+    Tests run on the global CRON_SCHEDULE unless they define their own
+    `schedule`. A test still running when it is due again is skipped. With
+    TARGETS, every run fans out to the targets its tests select.
+
+    Args:
+        cfg (dict): The configuration.
+        use_cache (bool): Whether to load the tests from the test cache.
+    """
+
+    def __init__(self, cfg, use_cache=True):
+        self.cfg = cfg
+        self.use_cache = use_cache
+        self.default_schedule = CronSchedule(cfg['CRON_SCHEDULE'])
+        self.tests = []
+        self.snapshot = None
+        self.running = set()
+        self.running_lock = threading.Lock()
+        self.runs = []
+        self.wake = threading.Event()
+        self.stopping = False
+        self.reload_requested = False
+
+        self.engine = None
+        self.executor = None
+        self.loop = None
+        target_list = targets.load_targets(cfg)
+        self.fanout = (fanout.Fanout(target_list, cfg) if target_list
+                       else None)
+        self.async_engine = (
+            database.create_async_pool(cfg, cfg['ASYNC_CONCURRENCY'])
+            if cfg['ASYNC_MODE'] and not cfg['BATCH_MODE'] and
+            self.fanout is None else None)
+
+        if self.async_engine is not None or (
+                self.fanout is not None and self.fanout.async_mode):
+            # The async engine's connections belong to one event loop, which
+            # is kept running on its own thread for the daemon's lifetime
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever,
+                             daemon=True).start()
+        else:
+            if self.fanout is None:
+                self.engine = database.create_pool(
+                    cfg, cfg['MAX_WORKERS'] + (1 if cfg['BATCH_MODE'] else 0))
+                self.run_tests = main.select_runner(self.engine, cfg)
+            # Snapshot sessions hold their connections for a whole run, so
+            # overlapping runs in batch mode take turns instead of waiting
+            # on each other for connections
+            self.batch_lock = (threading.Lock() if cfg['BATCH_MODE']
+                               else contextlib.nullcontext())
+            self.executor = ThreadPoolExecutor(
+                max_workers=cfg['MAX_WORKERS'])
+
+    def load(self):
+        """Load the test files and their schedules."""
+
+        path = self.cfg['TEST_FILES']
+        self.snapshot = loader.snapshot(path)
+        self.tests = []
+
+        load_report = main.load_tests(self.cfg, self.use_cache)
+
+        for test in load_report.tests:
+            try:
+                schedule = (CronSchedule(test['schedule'])
+                            if test.get('schedule') else self.default_schedule)
+            except ValueError as e:
+                logging.error(f"Invalid schedule of test "
+                              f"'{test.get('name')}': {e}")
+                continue
+            self.tests.append((test, schedule))
+
+        logging.info(f"Loaded {len(self.tests)} tests, test cache hits: "
+                     f"{load_report.cache_hits}, "
+                     f"misses: {load_report.cache_misses}")
+
+    def execute(self, tests, on_result):
+        if self.loop is not None and self.fanout is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.fanout.run_async(tests, on_result), self.loop).result()
+        elif self.async_engine is not None:
+            asyncio.run_coroutine_threadsafe(
+                async_runner.run_tests(tests, self.async_engine, self.cfg,
+                                       on_result),
+                self.loop).result()
+        else:
+            with self.batch_lock:
+                if self.fanout is not None:
+                    self.fanout.run_threaded(tests, on_result, self.executor)
+                else:
+                    self.run_tests(tests, on_result, self.engine, self.cfg,
+                                   self.executor)
+
+    def run_due(self, tests):
+        try:
+            main.run_suite(tests, self.cfg, self.execute,
+                           expected=(self.fanout.count_results
+                                     if self.fanout is not None else len))
+        except Exception:
+            logging.exception("Scheduled run failed")
+        finally:
+            with self.running_lock:
+                self.running.difference_update(
+                    test.get('name') for test in tests)
+
+    def tick(self, moment):
+        """Start a run of the tests due at the minute of `moment`."""
+
+        if loader.snapshot(self.cfg['TEST_FILES']) != self.snapshot:
+            logging.info("Test files changed, reloading")
+            self.load()
+
+        with self.running_lock:
+            due = [test for test, schedule in self.tests
+                   if schedule.matches(moment) and
+                   test.get('name') not in self.running]
+            self.running.update(test.get('name') for test in due)
+
+        if due:
+            run = threading.Thread(target=self.run_due, args=(due,))
+            run.start()
+            self.runs = [thread for thread in self.runs if thread.is_alive()]
+            self.runs.append(run)
+
+    def request_reload(self, signum=None, frame=None):
+        self.reload_requested = True
+        self.wake.set()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        self.wake.set()
+
+    def run_forever(self):
+        """Run the tests on their schedules until SIGTERM or SIGINT."""
+
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if self.cfg['METRICS_PORT']:
+            metrics.serve(self.cfg['METRICS_PORT'])
+            logging.info(f"Serving metrics on port {self.cfg['METRICS_PORT']}")
+
+        self.load()
+        next_tick = _next_minute(datetime.datetime.now())
+
+        while not self.stopping:
+            timeout = (next_tick - datetime.datetime.now()).total_seconds()
+            if self.wake.wait(max(timeout, 0)):
+                self.wake.clear()
+                if self.reload_requested:
+                    self.reload_requested = False
+                    logging.info("Received SIGHUP, reloading")
+                    self.load()
+                continue
+
+            self.tick(next_tick)
+            # Minutes missed while the process was suspended are skipped
+            next_tick = _next_minute(max(next_tick, datetime.datetime.now()))
+
+        self.shutdown()
+
+    def shutdown(self):
+        logging.info("Stopping, waiting for running tests")
+
+        for run in self.runs:
+            run.join()
+
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.fanout.dispose_async() if self.fanout is not None
+                else self.async_engine.dispose(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        else:
+            self.executor.shutdown()
+            workers.shutdown()
+            if self.fanout is not None:
+                self.fanout.dispose()
+            else:
+                self.engine.dispose()
+
+
+def _next_minute(moment):
+    return (moment + datetime.timedelta(minutes=1)).replace(
+        second=0, microsecond=0)
+
+
+def run():
+    args = main.parse_args()
+    cfg = config.settings
+    logger.setup_logging(cfg)
+
+    with main.run_lock(main.lock_path(cfg)) as acquired:
+        if not acquired:
+            logging.error("Another run is in progress, not starting daemon")
+            return
+
+        Daemon(cfg, use_cache=not args.no_cache).run_forever()
+
+
+if __name__ == '__main__':
+    run()
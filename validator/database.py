@@ -1,14 +1,367 @@
+import time
+import logging
+import threading
+import importlib.util
+from contextlib import contextmanager
 import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine
 
+# Async driver used for each backend in asyncio mode
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+    'mariadb': 'aiomysql',
+    'sqlite': 'aiosqlite'
+}
+
+
+def create_db_engine(uri, pool_size=5, max_overflow=0, pool_pre_ping=True,
+                     pool_recycle=-1, pool_timeout=30):
+    """ Creates the engine whose connection pool is shared by all tests of a
+    run. SQLite does not pay for connection setup, so it keeps the pool
+    SQLAlchemy picks for it.
+    """
+
+    options = {'pool_pre_ping': pool_pre_ping}
+
+    if sqlalchemy.engine.make_url(uri).get_backend_name() != 'sqlite':
+        options.update(pool_size=pool_size,
+                       max_overflow=max_overflow,
+                       pool_recycle=pool_recycle,
+                       pool_timeout=pool_timeout)
 
-def create_db_engine(uri):
     if uri.startswith('postgres'):
-        return sqlalchemy.create_engine(uri, client_encoding='utf8')
+        options['client_encoding'] = 'utf8'
+
+    return sqlalchemy.create_engine(uri, **options)
+
+
+def create_pool(cfg, workers, url=None, pool_size=0):
+    """ Creates the shared engine from the configuration, sized to the number
+    of worker threads unless DB_POOL_SIZE is set. A target of a fan-out run
+    passes its own URL and pool size.
+    """
+
+    return create_db_engine(
+        url or cfg['DB_URL'],
+        pool_size=pool_size or cfg['DB_POOL_SIZE'] or workers,
+        max_overflow=cfg['DB_MAX_OVERFLOW'],
+        pool_pre_ping=cfg['DB_POOL_PRE_PING'],
+        pool_recycle=cfg['DB_POOL_RECYCLE'],
+        pool_timeout=cfg['DB_POOL_TIMEOUT'])
+
+
+def async_url(uri):
+    """ Rewrites a database URI to the backend's async driver.
+
+    Returns:
+        URL: The async URL, or None if the backend has no installed async
+        driver.
+    """
+
+    url = sqlalchemy.engine.make_url(uri)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+
+    if driver is None or importlib.util.find_spec(driver) is None:
+        return None
+
+    return url.set(drivername=f'{backend}+{driver}')
+
+
+def create_async_pool(cfg, concurrency, url=None, pool_size=0):
+    """ Creates the shared async engine from the configuration, sized to the
+    concurrency limit unless DB_POOL_SIZE is set. A target of a fan-out run
+    passes its own URL and pool size.
+
+    Returns:
+        AsyncEngine: The engine, or None if the backend has no async driver.
+    """
+
+    url = async_url(url or cfg['DB_URL'])
+    if url is None:
+        return None
+
+    options = {'pool_pre_ping': cfg['DB_POOL_PRE_PING']}
+
+    if url.get_backend_name() != 'sqlite':
+        options.update(pool_size=(pool_size or cfg['DB_POOL_SIZE'] or
+                                  concurrency),
+                       max_overflow=cfg['DB_MAX_OVERFLOW'],
+                       pool_recycle=cfg['DB_POOL_RECYCLE'],
+                       pool_timeout=cfg['DB_POOL_TIMEOUT'])
+
+    return create_async_engine(url, **options)
+
+
+def connect(engine):
+    """ Checks a connection out of the pool.
+
+    Returns:
+        tuple: The connection and the seconds spent waiting for it.
+    """
+
+    start_time = time.perf_counter()
+    conn = engine.connect()
+    return conn, time.perf_counter() - start_time
+
+
+def execute_query(conn, query, params=None):
+    return conn.execute(sqlalchemy.text(query), params or {})
+
+
+def stream_query(conn, query, batch_size, params=None):
+    """ Executes the query on a server-side cursor (psycopg2 named cursor,
+    PyMySQL SSCursor), so that `result.partitions()` fetches `batch_size`
+    rows at a time instead of buffering the whole result on the client.
+    """
+
+    return conn.execute(sqlalchemy.text(query), params or {},
+                        execution_options={'stream_results': True,
+                                           'yield_per': batch_size})
+
+
+def close_stream(conn, result):
+    """ Stops a streamed query before it is exhausted. PyMySQL drains the
+    rest of an unbuffered result when its cursor is closed, so MySQL
+    connections are discarded instead of being returned to the pool.
+    """
+
+    if conn.dialect.name in ('mysql', 'mariadb'):
+        conn.invalidate()
+    else:
+        result.close()
+
+
+def explain_statement(dialect_name, query):
+    """ The statement explaining how the database executes a query. On
+    PostgreSQL, the query is executed again to report actual timings and
+    buffer usage.
+
+    Returns:
+        str: The statement, or None if the backend is not supported.
+    """
+
+    query = query.strip().rstrip(';')
+
+    if dialect_name == 'postgresql':
+        return f"EXPLAIN (ANALYZE, BUFFERS) {query}"
+    if dialect_name in ('mysql', 'mariadb'):
+        return f"EXPLAIN {query}"
+    if dialect_name == 'sqlite':
+        return f"EXPLAIN QUERY PLAN {query}"
+    return None
+
+
+def explain(conn, query):
+    """ Explains the query on the connection.
+
+    Returns:
+        str: The plan, one row per line, or None if the backend is not
+        supported.
+    """
+
+    statement = explain_statement(conn.dialect.name, query)
+    if statement is None:
+        return None
+
+    return format_plan(execute_query(conn, statement))
+
+
+def format_plan(result):
+    keys = list(result.keys())
+    rows = result.all()
+
+    # PostgreSQL's plan is one column of text lines
+    if len(keys) == 1:
+        return '\n'.join(str(row[0]) for row in rows)
+    return '\n'.join(', '.join(f'{key}={value}'
+                               for key, value in zip(keys, row))
+                     for row in rows)
+
+
+SNAPSHOT_SAVEPOINT = 'query_validator_batch'
+
+
+def snapshot_statements(dialect_name, snapshot_id=None):
+    """ Statements beginning the read-only, repeatable read transaction a
+    batch of tests runs in. On PostgreSQL, the transaction can import a
+    snapshot exported by another one, and a savepoint lets a failed or timed
+    out test roll back without aborting the transaction.
+
+    Returns:
+        list: The statements, or None if the backend is not supported.
+    """
+
+    if dialect_name == 'postgresql':
+        statements = [
+            "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"]
+        if snapshot_id:
+            statements.append(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'")
+        return statements + [f"SAVEPOINT {SNAPSHOT_SAVEPOINT}"]
+    if dialect_name in ('mysql', 'mariadb'):
+        return ["SET TRANSACTION ISOLATION LEVEL REPEATABLE READ",
+                "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY"]
+    if dialect_name == 'sqlite':
+        return ["BEGIN"]
+    return None
+
+
+def begin_snapshot(conn, snapshot_id=None):
+    """ Begins the transaction of `snapshot_statements` on the connection.
+    psycopg2 accepts several statements at once, so PostgreSQL sessions are
+    set up in a single round trip.
+    """
+
+    statements = snapshot_statements(conn.dialect.name, snapshot_id)
+
+    if conn.dialect.name == 'postgresql':
+        statements = ['; '.join(statements)]
+
+    for statement in statements:
+        conn.exec_driver_sql(statement)
+
+
+def export_snapshot(conn):
+    """ Begins a snapshot transaction and exports its snapshot, so that
+    transactions on other connections see the same state of the database.
+    Only PostgreSQL can share snapshots between connections.
+
+    Returns:
+        str: The snapshot id, or None if the backend can't export snapshots.
+    """
+
+    if conn.dialect.name != 'postgresql':
+        return None
+
+    begin_snapshot(conn)
+    return conn.exec_driver_sql("SELECT pg_export_snapshot()").scalar()
+
+
+def timeout_statements(dialect_name, seconds):
+    """ Statements limiting the execution time of queries on the server.
+    PostgreSQL's limit is transaction-local, MySQL's is set on the session
+    and must be reset before the connection goes back to the pool.
+
+    Returns:
+        tuple: The statement setting the limit and the one resetting it,
+        either of which may be None.
+    """
+
+    milliseconds = int(seconds * 1000)
+
+    if dialect_name == 'postgresql':
+        return f"SET LOCAL statement_timeout = {milliseconds}", None
+    if dialect_name in ('mysql', 'mariadb'):
+        return (f"SET SESSION max_execution_time = {milliseconds}",
+                "SET SESSION max_execution_time = 0")
+    return None, None
+
+
+class Watchdog:
+    """ Cancels the statement running on a connection once the timeout has
+    passed, in case the server-side limit does not apply (streamed fetches,
+    SQLite, statements other than SELECT on MySQL).
+
+    Args:
+        engine (Engine): The engine the connection belongs to.
+        conn (Connection): The connection running the statement.
+        seconds (float): The timeout.
+    """
+
+    def __init__(self, engine, conn, seconds):
+        self.engine = engine
+        self.dbapi_conn = conn.connection.dbapi_connection
+        self.expired = False
+        self.stopped = False
+        # Held while cancelling, so that a cancellation already under way
+        # completes before the connection runs anything else
+        self.lock = threading.Lock()
+        self.timer = threading.Timer(seconds, self.cancel_statement)
+        self.timer.daemon = True
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.cancel()
+        with self.lock:
+            self.stopped = True
+
+    def cancel_statement(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.expired = True
+            self._cancel()
+
+    def _cancel(self):
+        dialect = self.engine.dialect
+
+        try:
+            if dialect.name == 'postgresql':
+                self.dbapi_conn.cancel()
+            elif dialect.name in ('mysql', 'mariadb'):
+                # KILL QUERY has to be sent on a connection outside the pool
+                cargs, cparams = dialect.create_connect_args(self.engine.url)
+                killer = dialect.connect(*cargs, **cparams)
+                try:
+                    with killer.cursor() as cursor:
+                        cursor.execute(
+                            f"KILL QUERY {int(self.dbapi_conn.thread_id())}")
+                finally:
+                    killer.close()
+            elif dialect.name == 'sqlite':
+                self.dbapi_conn.interrupt()
+        except Exception as e:
+            logging.warning(f"Failed to cancel timed out statement: {e}")
+
+
+@contextmanager
+def statement_timeout(engine, conn, seconds):
+    """ Limits the execution time of the statements run on the connection,
+    both on the server and with a watchdog cancelling the statement.
+
+    Yields:
+        Watchdog: The watchdog, or None without a timeout.
+    """
+
+    if not seconds:
+        yield None
+        return
+
+    set_timeout, reset_timeout = timeout_statements(conn.dialect.name,
+                                                    seconds)
+    if set_timeout:
+        conn.exec_driver_sql(set_timeout)
+
+    watchdog = Watchdog(engine, conn, seconds)
+    watchdog.start()
+
+    try:
+        yield watchdog
+    finally:
+        watchdog.stop()
+        if reset_timeout and not conn.invalidated:
+            try:
+                conn.exec_driver_sql(reset_timeout)
+            except sqlalchemy.exc.DBAPIError:
+                conn.invalidate()
+
 
-    return sqlalchemy.create_engine(uri)
+def is_timeout(error):
+    """ Whether a database error was raised because the server cancelled a
+    statement that ran into its time limit.
+    """
 
+    orig = getattr(error, 'orig', None)
+    if orig is None:
+        return False
 
-def execute_query(connection, query, params=None):
-    with connection.connect() as conn:
-        result = conn.execute(sqlalchemy.text(query), params or {})
-    return result
+    if getattr(orig, 'pgcode', None) == '57014':
+        return True
+    if getattr(orig, 'sqlstate', None) == '57014':
+        return True
+    if orig.args and orig.args[0] in (1317, 3024):
+        return True
+    return 'interrupted' in str(orig)
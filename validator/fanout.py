@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+import database
+import planner
+import runner
+import batch
+import async_runner
+
+
+def _tag(results, target):
+    for result in results:
+        result['target'] = target.name
+    return results
+
+
+class Fanout:
+    """
+    Runs every test on each target it selects from one process, instead of
+    a process per database.
+
+    Every target has its own connection pool and runs at most its
+    `concurrency` tests at once, and all targets together at most
+    MAX_WORKERS tests on threads, or ASYNC_CONCURRENCY tests in asyncio
+    mode. Tests sharing a query are grouped per target. Groups are
+    submitted in the order of their first test, on all its targets before
+    the next, so that the longest tests still start first. A target at its
+    limit is passed over for the next one with room to spare. The limits
+    hold across runs overlapping in daemon mode.
+
+    Args:
+        targets (list): The Targets.
+        cfg (dict): The configuration.
+    """
+
+    def __init__(self, targets, cfg):
+        self.targets = targets
+        self.cfg = cfg
+        self.engines = {}
+        self.async_mode = cfg['ASYNC_MODE'] and not cfg['BATCH_MODE']
+
+        if self.async_mode:
+            for target in targets:
+                engine = database.create_async_pool(
+                    cfg, self.capacity(target), target.url, target.pool_size)
+                if engine is None:
+                    logging.warning(f"No async driver installed for target "
+                                    f"'{target.name}', running tests on "
+                                    f"threads")
+                    self.async_mode = False
+                    break
+                self.engines[target.name] = engine
+
+        if not self.async_mode:
+            # Batch mode holds one more connection exporting the snapshot
+            extra = 1 if cfg['BATCH_MODE'] else 0
+            self.engines = {
+                target.name: database.create_pool(
+                    cfg, self.capacity(target) + extra, target.url,
+                    target.pool_size)
+                for target in targets}
+
+        # Tests running on each target, on threads
+        self.running = {target.name: 0 for target in targets}
+        self.released = threading.Condition()
+        # The limits in asyncio mode, created on the loop of the runs
+        self.limit = None
+        self.semaphores = None
+
+    def capacity(self, target):
+        """Tests running on the target at once."""
+
+        limit = (self.cfg['ASYNC_CONCURRENCY'] if self.async_mode
+                 else self.cfg['MAX_WORKERS'])
+        return min(target.concurrency or limit, limit)
+
+    def count_results(self, tests):
+        """Results of a run of the tests, one per test and target."""
+
+        return sum(target.selected_by(test)
+                   for test in tests for target in self.targets)
+
+    def jobs(self, tests):
+        """
+        Group the tests of every target that share a query. Tests selecting
+        no target are logged and skipped.
+
+        Returns:
+            list: (order, target, group) tuples in submission order.
+        """
+
+        order = {id(test): index for index, test in enumerate(tests)}
+        selected = set()
+        jobs = []
+
+        for position, target in enumerate(self.targets):
+            chosen = [test for test in tests if target.selected_by(test)]
+            selected.update(map(id, chosen))
+            groups = planner.group_tests(
+                chosen, self.engines[target.name].dialect.name, self.cfg)
+            jobs.extend(((order[id(group[0])], position), target, group)
+                        for group in groups)
+
+        for test in tests:
+            if id(test) not in selected:
+                logging.warning(f"Test '{test.get('name')}' selects no "
+                                f"target, skipping it")
+
+        jobs.sort(key=lambda job: job[0])
+        return jobs
+
+    def execute_tests(self, target, group):
+        return _tag(runner.execute_tests(
+            group, self.engines[target.name], self.cfg), target)
+
+    def release(self, target):
+        """Free a slot of the target for the next queued group."""
+
+        with self.released:
+            self.running[target.name] -= 1
+            self.released.notify_all()
+
+    def schedule(self, queues, on_result, executor):
+        """
+        Run the queued groups of every target on the thread pool, keeping to
+        the limits of the targets and of the pool.
+
+        Args:
+            queues (dict): A deque of (order, group) tuples by target name.
+        """
+
+        running = self.running
+        futures = set()
+
+        try:
+            while futures or any(queues.values()):
+                with self.released:
+                    while len(futures) < self.cfg['MAX_WORKERS']:
+                        ready = [target for target in self.targets
+                                 if queues.get(target.name) and
+                                 running[target.name] < self.capacity(target)]
+                        if not ready:
+                            break
+
+                        target = min(ready, key=lambda target:
+                                     queues[target.name][0][0])
+                        _, group = queues[target.name].popleft()
+                        running[target.name] += 1
+                        future = executor.submit(
+                            self.execute_tests, target, group)
+                        # Slots are freed by the groups themselves, so that
+                        # a failed run does not hold them for the runs
+                        # overlapping it
+                        future.add_done_callback(
+                            lambda _, target=target: self.release(target))
+                        futures.add(future)
+
+                    if not futures:
+                        # Overlapping runs hold the targets of every queued
+                        # group
+                        self.released.wait()
+                        continue
+
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        on_result(result)
+        finally:
+            # Groups not started yet are dropped, which frees their slots
+            for future in futures:
+                future.cancel()
+
+    def run_threaded(self, tests, on_result, executor):
+        """
+        Run the tests on the thread pool. In batch mode, the targets take
+        turns, each running its tests in snapshot sessions.
+        """
+
+        queues = {target.name: deque() for target in self.targets}
+        for order, target, group in self.jobs(tests):
+            queues[target.name].append((order, group))
+
+        if not self.cfg['BATCH_MODE']:
+            self.schedule(queues, on_result, executor)
+            return
+
+        for target in self.targets:
+            engine = self.engines[target.name]
+            if database.snapshot_statements(engine.dialect.name) is None:
+                logging.warning(f"Batch mode is not supported on "
+                                f"{engine.dialect.name}, running each test "
+                                f"of target '{target.name}' on its own "
+                                f"connection")
+                self.schedule({target.name: queues[target.name]}, on_result,
+                              executor)
+                continue
+
+            batch.run_batched(
+                [test for _, group in queues[target.name] for test in group],
+                lambda result, target=target: on_result(
+                    _tag([result], target)[0]),
+                engine, {**self.cfg, 'MAX_WORKERS': self.capacity(target)},
+                executor)
+
+    async def run_async(self, tests, on_result):
+        """Run the tests concurrently on the event loop."""
+
+        if self.limit is None:
+            # Semaphores belong to the loop they are first used on before
+            # Python 3.10, so they are created by the first run on the loop
+            # and shared by the overlapping runs of the daemon
+            self.limit = asyncio.Semaphore(self.cfg['ASYNC_CONCURRENCY'])
+            self.semaphores = {
+                target.name: asyncio.Semaphore(self.capacity(target))
+                for target in self.targets}
+
+        async def execute(target, group):
+            # A group waits for its target before it takes a slot of the
+            # global limit, so that a busy target does not hold slots the
+            # other targets could use
+            async with self.semaphores[target.name]:
+                return _tag(await async_runner.execute_tests(
+                    group, self.engines[target.name], self.limit, self.cfg),
+                    target)
+
+        tasks = [asyncio.ensure_future(execute(target, group))
+                 for _, target, group in self.jobs(tests)]
+        for future in asyncio.as_completed(tasks):
+            for result in await future:
+                on_result(result)
+
+    async def run_once(self, tests, on_result):
+        """Run all tests like `run_async`, then dispose of the engines."""
+
+        try:
+            await self.run_async(tests, on_result)
+        finally:
+            await self.dispose_async()
+
+    async def dispose_async(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+
+    def dispose(self):
+        for engine in self.engines.values():
+            engine.dispose()
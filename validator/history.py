@@ -0,0 +1,85 @@
+import os
+import time
+import sqlite3
+
+HISTORY_FILE_NAME = '.query-validator-history.sqlite'
+
+
+def default_path(test_files):
+    """ The history is kept next to the test directory, so it survives the
+    process that cron starts for every run.
+    """
+
+    parent = os.path.dirname(os.path.abspath(test_files))
+    return os.path.join(parent, HISTORY_FILE_NAME)
+
+
+class History:
+    """
+    Durations of previous runs per test, stored in a small SQLite file.
+
+    Args:
+        path (str): Path of the SQLite file.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS durations ("
+            "name TEXT PRIMARY KEY, duration REAL NOT NULL, "
+            "runs INTEGER NOT NULL, updated_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def durations(self):
+        """
+        Returns:
+            dict: Duration of each test's last runs in seconds, by test name.
+        """
+
+        return dict(self.conn.execute("SELECT name, duration FROM durations"))
+
+    def record(self, durations, smoothing=0.5):
+        """
+        Store the durations of a run. Durations are smoothed over previous
+        runs so that a single outlier does not reorder the whole suite.
+
+        Args:
+            durations (dict): Duration in seconds by test name.
+            smoothing (float): Weight of the new duration.
+        """
+
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO durations (name, duration, runs, updated_at) "
+                "VALUES (:name, :duration, 1, :now) "
+                "ON CONFLICT (name) DO UPDATE SET "
+                "duration = :smoothing * excluded.duration + "
+                "(1 - :smoothing) * durations.duration, "
+                "runs = durations.runs + 1, updated_at = :now",
+                [{'name': name, 'duration': duration, 'now': now,
+                  'smoothing': smoothing}
+                 for name, duration in durations.items()])
+
+    def close(self):
+        self.conn.close()
+
+
+def order_tests(tests, durations):
+    """
+    Order tests for submission: higher `priority` first, then the longest
+    tests of previous runs first, so that a slow test submitted last does
+    not set the wall-clock time of the run. Tests without history are
+    treated as the longest.
+
+    Args:
+        tests (list): The test definitions.
+        durations (dict): Duration of previous runs by test name.
+
+    Returns:
+        list: The tests in submission order.
+    """
+
+    return sorted(tests, key=lambda test: (
+        -test.get('priority', 0),
+        -durations.get(test.get('name'), float('inf'))))
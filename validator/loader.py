@@ -1,27 +1,261 @@
 import os
+import pickle
+import hashlib
+import logging
+import multiprocessing
 import yaml
 import schema
 from cerberus import Validator
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
 
+CACHE_FILE_NAME = '.query-validator-cache.pickle'
+TEST_FILE_EXTENSIONS = ('.yml', '.yaml')
 
-def load_test_files(path):
-    """ Loads test files and constructs object from the yml representation
+# Cached tests are only valid for the schema they were validated against and
+# the layout of the cache entries
+CACHE_FORMAT = 2
+SCHEMA_VERSION = hashlib.sha256(
+    repr((CACHE_FORMAT, schema.schema)).encode()).hexdigest()
+
+# libyaml's loader is several times faster than the pure-Python one
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Below this number of files to parse, starting worker processes costs more
+# than it saves
+PARALLEL_THRESHOLD = 64
+
+_validator = None
+
+
+@dataclass
+class LoadError:
+    """Data class representing a test file or document that was skipped"""
+
+    file: str
+    document: int = None
+    name: str = None
+    errors: object = None
+
+
+@dataclass
+class LoadReport:
+    """Data class representing the loaded tests and how they were loaded"""
+
+    tests: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+def default_cache_path(test_files):
+    """ The cache is kept next to the test directory, like the run history
     """
 
-    test_files = [f for f in os.listdir(path) if f.endswith('.yml')]
+    parent = os.path.dirname(os.path.abspath(test_files))
+    return os.path.join(parent, CACHE_FILE_NAME)
+
+
+def find_test_files(path):
+    """ Lists the test files in the directory and its subdirectories, as paths
+    relative to the directory. Hidden files and directories are skipped.
+    """
+
+    test_files = []
+
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        test_files.extend(
+            os.path.relpath(os.path.join(root, f), path) for f in sorted(files)
+            if f.endswith(TEST_FILE_EXTENSIONS) and not f.startswith('.'))
 
-    validator = Validator(schema.schema)
-    test_objects = []
+    return test_files
+
+
+def snapshot(path):
+    """ Modification times of the test files, to detect changes between runs
+    """
+
+    return {test_file: os.stat(os.path.join(path, test_file)).st_mtime_ns
+            for test_file in find_test_files(path)}
+
+
+def read_cache(cache_path):
+    """ Reads the cached tests by file path. A missing, unreadable or outdated
+    cache is treated as empty.
+    """
+
+    try:
+        with open(cache_path, 'rb') as file:
+            cache = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+            ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or cache.get('schema') != SCHEMA_VERSION:
+        return {}
+    return cache['files']
+
+
+def write_cache(cache_path, files):
+    """ Writes the cache atomically, so that a crashed run does not leave a
+    truncated cache behind
+    """
+
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            pickle.dump({'schema': SCHEMA_VERSION, 'files': files}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not write test cache {cache_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def parse_test_file(content, test_file):
+    """ Parses and validates the content of a test file. A file can hold
+    several tests as YAML documents separated by `---`.
+
+    Returns:
+        tuple: The valid tests of the file and a list of LoadErrors.
+    """
 
-    for test_file in test_files:
-        with open(os.path.join(path, test_file), 'r', encoding='utf-8') as file:
+    global _validator
+    if _validator is None:
+        _validator = Validator(schema.schema)
 
-            test = yaml.safe_load(file)
-            if not validator.validate(test):
-                errors = validator.errors
-                print(f"Validation errors in {test_file}: {errors}")
-                continue
+    tests = []
+    errors = []
 
-        test_objects.append(test)
+    try:
+        documents = list(yaml.load_all(content, Loader=SafeLoader))
+    except yaml.YAMLError as e:
+        return [], [LoadError(test_file, errors=str(e))]
+
+    for document, test in enumerate(documents):
+        if test is None:
+            continue
+
+        if not isinstance(test, dict):
+            errors.append(LoadError(
+                test_file, document,
+                errors=f"Expected a test, got a {type(test).__name__}"))
+            continue
+
+        # The schema has no normalization rules, and skipping normalization
+        # makes validation several times faster
+        if not _validator.validate(test, normalize=False):
+            errors.append(LoadError(test_file, document, test.get('name'),
+                                    _validator.errors))
+            continue
+
+        tests.append(test)
+
+    return tests, errors
+
+
+def _parse_test_files(contents):
+    return [parse_test_file(content, test_file)
+            for test_file, content in contents]
+
+
+def parse_test_files(contents, workers=None):
+    """ Parses and validates the contents of many test files, across worker
+    processes when there are enough of them
+
+    Args:
+        contents (list): List of (test file, content) tuples.
+        workers (int): Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        list: (tests, errors) of each file, in order.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(contents) < PARALLEL_THRESHOLD:
+        return _parse_test_files(contents)
+
+    # Files are sent in chunks, since a single file parses faster than its
+    # round trip to a worker
+    chunk_size = -(-len(contents) // (workers * 4))
+    chunks = [contents[i:i + chunk_size]
+              for i in range(0, len(contents), chunk_size)]
+
+    # The daemon reloads while other threads hold locks, which forking would
+    # copy into the workers
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        return [parsed for chunk in executor.map(_parse_test_files, chunks)
+                for parsed in chunk]
+
+
+def load_tests(path, cache_path=None, workers=None):
+    """ Loads the test files like `load_test_files`. With a cache path, parsed
+    and validated tests are cached by file path, modification time and content
+    hash, so only changed files are parsed and validated again.
+
+    Returns:
+        LoadReport: The tests, the skipped files and documents, and the cache
+            hits and misses.
+    """
+
+    cached = read_cache(cache_path) if cache_path else {}
+    files = {}
+    changed = False
+    report = LoadReport()
+    misses = []
+
+    for test_file in find_test_files(path):
+        file_path = os.path.join(path, test_file)
+        stat = os.stat(file_path)
+        entry = cached.get(file_path)
+
+        # Unchanged modification time and size: trust the cache without
+        # reading the file
+        if not (entry and (entry['mtime'], entry['size']) ==
+                (stat.st_mtime_ns, stat.st_size)):
+            with open(file_path, 'rb') as file:
+                content = file.read()
+            digest = hashlib.sha256(content).hexdigest()
+
+            # A touched file with unchanged content, e.g. after a checkout,
+            # is not parsed again
+            if not (entry and entry['hash'] == digest):
+                entry = {'hash': digest, 'tests': None, 'errors': None}
+                misses.append((file_path, test_file, content))
+            else:
+                report.cache_hits += 1
+
+            entry = {**entry, 'mtime': stat.st_mtime_ns,
+                     'size': stat.st_size}
+            changed = True
+        else:
+            report.cache_hits += 1
+
+        files[file_path] = entry
+
+    parsed = parse_test_files(
+        [(test_file, content) for _, test_file, content in misses], workers)
+    for (file_path, _, _), (tests, errors) in zip(misses, parsed):
+        files[file_path]['tests'] = tests
+        files[file_path]['errors'] = errors
+    report.cache_misses = len(misses)
+
+    for entry in files.values():
+        report.tests.extend(entry['tests'])
+        report.errors.extend(entry['errors'])
+
+    if cache_path and (changed or files.keys() != cached.keys()):
+        write_cache(cache_path, files)
+
+    return report
+
+
+def load_test_files(path):
+    """ Loads test files and constructs object from the yml representation
+    """
 
-    return test_objects
+    return load_tests(path).tests
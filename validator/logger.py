@@ -1,6 +1,11 @@
 import logging
 import logging_loki
 import json
+import loki
+import sinks
+
+# The batching Loki handler of the current setup, if any
+loki_handler = None
 
 
 class JsonFormatter(logging.Formatter):
@@ -13,7 +18,7 @@ class JsonFormatter(logging.Formatter):
         extra_fields = self.get_extra_fields(record)
         log_record.update(extra_fields)
 
-        return json.dumps(log_record)
+        return json.dumps(log_record, default=sinks.serialize)
 
     def create_log_record(self, record):
         return {
@@ -63,36 +68,85 @@ def setup_logging(config):
 
     # Loki handler
     if config['LOKI_HOST']:
-        loki_handler = logging_loki.LokiHandler(
-            url=config['LOKI_HOST'],
-            tags=dict(tag.split('=')
-                      for tag in config['LOKI_TAGS'].split(',')),
-            auth=(config['LOKI_USERNAME'], config['LOKI_PASSWORD']),
-            version="1",
-        )
-
-        loki_handler.setLevel(getattr(logging, config['LOG_LEVEL']))
-        loki_handler.setFormatter(json_formatter)
-        handlers.append(loki_handler)
+        global loki_handler
+
+        tags = dict(tag.split('=') for tag in config['LOKI_TAGS'].split(','))
+        auth = (config['LOKI_USERNAME'], config['LOKI_PASSWORD'])
+
+        if config['LOKI_BATCHING']:
+            loki_handler = loki.BatchingLokiHandler(
+                url=config['LOKI_HOST'],
+                tags=tags,
+                auth=auth,
+                batch_size=config['LOKI_BATCH_SIZE'],
+                flush_interval=config['LOKI_FLUSH_INTERVAL'],
+                queue_size=config['LOKI_QUEUE_SIZE'],
+                drop_policy=config['LOKI_DROP_POLICY'],
+                max_retries=config['LOKI_MAX_RETRIES'])
+            handler = loki_handler
+        else:
+            handler = logging_loki.LokiHandler(
+                url=config['LOKI_HOST'],
+                tags=tags,
+                auth=auth,
+                version="1",
+            )
+
+        handler.setLevel(getattr(logging, config['LOG_LEVEL']))
+        handler.setFormatter(json_formatter)
+        handlers.append(handler)
 
     logging.basicConfig(handlers=handlers, level=getattr(
         logging, config['LOG_LEVEL']))
 
 
-def log_test_result(test_name, test_result, duration, query, error_msg, err):
-    """Log the result of a test case."""
+def log_load_errors(errors):
+    """Log the test files and documents skipped while loading the tests."""
+
+    for error in errors:
+        location = error.file
+        if error.document is not None:
+            location += f", document {error.document + 1}"
+        if error.name:
+            location += f" ('{error.name}')"
+
+        logging.error(f"Invalid test definition in {location}: "
+                      f"{error.errors}",
+                      extra={'file': error.file, 'document': error.document,
+                             'test_name': error.name,
+                             'validation_errors': error.errors})
 
-    message = (f"Test: {test_name}, "
-               f"Result: {test_result}, "
-               f"Duration: {duration:.2f} seconds")
 
-    if test_result == 'PASS':
-        logging.info(message)
+def log_test_result(result):
+    """Log the result of a test case."""
+
+    message = f"Test: {result['name']}, "
+    if result['target'] is not None:
+        message += f"Target: {result['target']}, "
+    message += (f"Result: {result['status']}, "
+               f"Duration: {result['duration']:.2f} seconds")
+
+    extra = {'target': result['target'],
+             'pool_wait': result['pool_wait'],
+             'short_circuited': result['short_circuited'],
+             'timings': result['timings']}
+    if result['profile'] is not None:
+        extra['profile'] = result['profile']
+    if result['explain'] is not None:
+        extra['explain'] = result['explain']
+    if result['approximate']:
+        extra['approximate'] = result['approximate']
+
+    if result['status'] == 'PASS':
+        logging.info(message, extra=extra)
     else:
         logging.error(message, extra={
-            'assertions': error_msg,
-            'errornous_rows': [dict(row._mapping) for row in err],
-            'query': query})
+            **extra,
+            'assertions': result['error_messages'],
+            'violations': result['violations'],
+            'errornous_rows': sinks.rows_to_dicts(result['erroneous_rows']),
+            'sampled_rows': sinks.rows_to_dicts(result['sampled_rows']),
+            'query': result['query']})
 
 
 def log_summary(summary):
@@ -102,6 +156,24 @@ def log_summary(summary):
                f"Tests: {summary['total']}, "
                f"Passed: {summary['passed']}, "
                f"Failed: {summary['failed']}, "
-               f"Errors: {summary['errors']}")
-
-    logging.info(message)
+               f"Errors: {summary['errors']}, "
+               f"Timeouts: {summary['timeouts']}, "
+               f"Pool wait: {summary['pool_wait']:.2f} seconds, "
+               f"Short-circuited: {summary['short_circuited']}")
+
+    if 'cache_hits' in summary:
+        message += (f", Test cache hits: {summary['cache_hits']}, "
+                    f"misses: {summary['cache_misses']}")
+
+    extra = {'timings': summary['timings']}
+    if 'targets' in summary:
+        failing = [name for name, counts in summary['targets'].items()
+                   if counts['passed'] < counts['total']]
+        message += (f", Targets: {len(summary['targets'])}, "
+                    f"failing: {', '.join(sorted(failing)) or 'none'}")
+        extra['targets'] = summary['targets']
+    if loki_handler is not None:
+        extra.update({f'loki_{key}': value
+                      for key, value in loki_handler.stats().items()})
+
+    logging.info(message, extra=extra)
@@ -0,0 +1,217 @@
+import gzip
+import json
+import time
+import base64
+import random
+import logging
+import threading
+import collections
+import urllib.error
+import urllib.request
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+# Longest pause between two attempts to send a batch
+MAX_BACKOFF = 30.0
+
+
+class BatchingLokiHandler(logging.Handler):
+    """
+    Logging handler shipping records to Loki from a background thread, so
+    that logging never waits on Loki. Records are buffered and pushed in
+    batches once `batch_size` records are buffered or `flush_interval`
+    seconds have passed, gzip compressed, with retries and exponential
+    backoff. Remaining records are flushed when the handler is closed, which
+    `logging.shutdown()` does at exit.
+
+    The buffer holds at most `queue_size` records. When it is full, either
+    the oldest buffered record or the new one is dropped, according to
+    `drop_policy`.
+
+    Args:
+        url (str): The Loki push endpoint.
+        tags (dict): Labels of all records.
+        auth (tuple): Username and password for basic authentication.
+        batch_size (int): Maximum number of records per push.
+        flush_interval (float): Seconds after which buffered records are
+            pushed even if the batch is not full.
+        queue_size (int): Maximum number of buffered records.
+        drop_policy (str): `oldest` or `newest`.
+        max_retries (int): Retries of a failed push before its records are
+            given up.
+        backoff (float): Seconds to wait before the first retry, doubled
+            with every further retry.
+        timeout (float): Seconds to wait for Loki to answer a push.
+        close_timeout (float): Seconds to wait for remaining records to be
+            shipped when the handler is closed.
+    """
+
+    def __init__(self, url, tags=None, auth=None, batch_size=500,
+                 flush_interval=2.0, queue_size=10000,
+                 drop_policy=DROP_OLDEST, max_retries=5, backoff=0.5,
+                 timeout=10.0, close_timeout=10.0):
+        super().__init__()
+
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy '{drop_policy}'")
+
+        self.url = url
+        self.tags = tags or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+
+        self.headers = {'Content-Type': 'application/json',
+                        'Content-Encoding': 'gzip'}
+        if auth and auth[0]:
+            credentials = base64.b64encode(
+                f"{auth[0]}:{auth[1]}".encode()).decode()
+            self.headers['Authorization'] = f"Basic {credentials}"
+
+        self.buffer = collections.deque()
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.flush_requested = False
+        self.closing = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+
+        self.thread = threading.Thread(target=self.ship_forever,
+                                       name='loki-shipper', daemon=True)
+        self.thread.start()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Counts of sent records, records dropped because the buffer
+            was full, records given up after failed pushes, retried pushes
+            and records still buffered.
+        """
+
+        with self.condition:
+            return {'sent': self.sent, 'dropped': self.dropped,
+                    'failed': self.failed, 'retries': self.retries,
+                    'buffered': len(self.buffer) + self.in_flight}
+
+    def emit(self, record):
+        try:
+            entry = (self.labels(record),
+                     str(int(record.created * 1e9)),
+                     self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self.condition:
+            if self.closing:
+                return
+
+            if len(self.buffer) >= self.queue_size:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                self.buffer.popleft()
+
+            self.buffer.append(entry)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify_all()
+
+    def labels(self, record):
+        # The labels python-logging-loki sets, so existing queries keep
+        # matching
+        return tuple(sorted({**self.tags,
+                             'severity': record.levelname.lower(),
+                             'logger': record.name}.items()))
+
+    def ship_forever(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: (len(self.buffer) >= self.batch_size or
+                             self.flush_requested or self.closing),
+                    timeout=self.flush_interval)
+
+                batch = [self.buffer.popleft() for _ in range(
+                    min(self.batch_size, len(self.buffer)))]
+                self.in_flight = len(batch)
+
+                if not self.buffer:
+                    self.flush_requested = False
+                if not batch and self.closing:
+                    return
+
+            if batch:
+                self.push(batch)
+
+            with self.condition:
+                self.in_flight = 0
+                self.condition.notify_all()
+
+    def push(self, batch):
+        """Send a batch of records, retrying with backoff on failures."""
+
+        body = gzip.compress(self.payload(batch), compresslevel=6)
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.condition:
+                    self.retries += 1
+                delay = min(self.backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+            request = urllib.request.Request(
+                self.url, data=body, headers=self.headers, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            except urllib.error.HTTPError as e:
+                # Rejected records would be rejected again
+                if e.code < 500 and e.code != 429:
+                    break
+                continue
+            except OSError:
+                continue
+
+            with self.condition:
+                self.sent += len(batch)
+            return
+
+        with self.condition:
+            self.failed += len(batch)
+
+    @staticmethod
+    def payload(batch):
+        streams = {}
+        for labels, timestamp, line in batch:
+            streams.setdefault(labels, []).append([timestamp, line])
+
+        return json.dumps({'streams': [
+            {'stream': dict(labels), 'values': values}
+            for labels, values in streams.items()]}).encode()
+
+    def flush(self, timeout=None):
+        """Push the buffered records and wait until they are shipped."""
+
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            self.condition.wait_for(
+                lambda: not self.buffer and not self.in_flight,
+                timeout=self.close_timeout if timeout is None else timeout)
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+
+        self.thread.join(self.close_timeout)
+        super().close()
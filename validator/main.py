@@ -1,138 +1,313 @@
+import os
 import time
+import datetime
+import argparse
+import fcntl
+import asyncio
+import logging
 import config
 import logger
 import loader
+import runner
+import planner
+import batch
+import async_runner
+import history
+import sinks
+import metrics
 import database
-import validators
-from validators import TestResult
+import workers
+import targets
+import fanout
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+LOCK_FILE_NAME = '.query-validator.lock'
 
-def run_assertions(rows, assertions):
+
+@contextmanager
+def run_lock(path):
     """
-    Run a series of assertions on the result set.
+    Hold an exclusive lock for the duration of a run, so that a run started
+    by cron while the previous one is still going does not overlap it.
 
-    Args:
-        rows (list): List of rows returned from the SQL query.
-        assertions (dict): Dictionary of assertions to apply to the result set.
+    Yields:
+        bool: Whether the lock was acquired.
+    """
+
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def count_status(counts, status):
+    counts['total'] += 1
+    if status == 'PASS':
+        counts['passed'] += 1
+    elif status == 'FAIL':
+        counts['failed'] += 1
+    elif status == 'TIMEOUT':
+        counts['timeouts'] += 1
+    else:
+        counts['errors'] += 1
+
+
+def record_result(summary, sink, result):
+    """
+    Add a test result to the summary, log it and write it to the sink. The
+    results of a fan-out run are also counted per target, and a test's
+    duration is that of its slowest target.
+    """
+
+    count_status(summary, result['status'])
+    if result['target'] is not None:
+        count_status(summary.setdefault('targets', {}).setdefault(
+            result['target'], dict.fromkeys(
+                ('total', 'passed', 'failed', 'errors', 'timeouts'), 0)),
+            result['status'])
+    summary['pool_wait'] += result['pool_wait']
+    summary['short_circuited'] += result['short_circuited']
+    durations = summary['durations']
+    durations[result['name']] = max(result['duration'],
+                                    durations.get(result['name'], 0.0))
+    timings = summary['timings']
+    for phase, seconds in result['timings'].items():
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    logger.log_test_result(result)
+    metrics.observe_result(result)
+    try:
+        sink.write(result)
+    except (OSError, TypeError, ValueError) as e:
+        logging.error(f"Could not write result of test "
+                      f"'{result['name']}': {e}")
+
+
+def run_threaded(tests, on_result, engine, cfg, executor):
+    """
+    Run the tests on a thread pool with blocking database drivers, executing
+    each query shared by several tests once.
+    """
+
+    groups = planner.group_tests(tests, engine.dialect.name, cfg)
+    futures = [executor.submit(runner.execute_tests, group, engine, cfg)
+               for group in groups]
+
+    for future in as_completed(futures):
+        for result in future.result():
+            on_result(result)
+
+
+def load_tests(cfg, use_cache=True):
+    """
+    Load the test files, from the test cache unless disabled, and log the
+    files and documents that were skipped.
 
     Returns:
-        list: List of TestResult objects for failed assertions.
+        LoadReport: The tests and the cache hits and misses.
     """
 
-    assertion_map = {
-        'count': validators.row_count,
-        'has': validators.has,
-        'missing': validators.missing,
-        'no_nulls': validators.no_nulls,
-        'only_nulls': validators.only_nulls
-    }
+    cache_path = None
+    if use_cache:
+        cache_path = (cfg['TEST_CACHE_FILE'] or
+                      loader.default_cache_path(cfg['TEST_FILES']))
 
-    failed_assertions = []
+    load_report = loader.load_tests(cfg['TEST_FILES'], cache_path,
+                                    cfg['LOADER_WORKERS'])
+    logger.log_load_errors(load_report.errors)
 
-    for key, assertion in assertions.items():
-        if key in assertion_map:
-            result = assertion_map[key](rows, assertion)
-            if not result.success:
-                failed_assertions.append((key, result))
-        else:
-            failed_assertions.append(
-                (key, TestResult(False, f"Unknown assertion '{key}'")))
+    return load_report
 
-    return failed_assertions
 
+def select_runner(engine, cfg):
+    """
+    Choose how tests run on the thread pool: in snapshot sessions in batch
+    mode, if the backend supports it, or each on its own connection.
 
-def execute_test(test, db_url):
-    start_time = time.time()
-    name = test.get('name')
-    query = test.get('query')
-    assertions = test.get('assertions', {})
-    result_status = 'PASS'
-    error_messages = []
-    erroneous_rows = []
-    rows = []
+    Returns:
+        callable: `run_threaded` or `batch.run_batched`.
+    """
 
-    try:
-        engine = database.create_db_engine(db_url)
-        result = database.execute_query(engine, query)
-        rows = result.all()
-
-        failed_assertions = run_assertions(rows, assertions)
-
-        if failed_assertions:
-            result_status = 'FAIL'
-            for key, test_result in failed_assertions:
-                error_messages.append(
-                    f"Assertion '{key}' failed: {test_result.message}")
-                if test_result.erroneous_rows:
-                    erroneous_rows.extend(test_result.erroneous_rows)
-
-    except Exception as e:
-        result_status = 'ERROR'
-        error_messages.append(str(e))
-
-    duration = time.time() - start_time
-
-    return {
-        'name': name,
-        'status': result_status,
-        'duration': duration,
-        'error_messages': error_messages,
-        'erroneous_rows': erroneous_rows,
-        'assertions': assertions,
-        'query': query,
-        'data': [tuple(row) for row in rows]
-    }
+    if not cfg['BATCH_MODE']:
+        return run_threaded
 
+    if cfg['ASYNC_MODE']:
+        logging.warning("Batch mode runs tests on threads, ignoring "
+                        "ASYNC_MODE")
 
-def main():
-    """Main function to execute the tests and log the results."""
+    if database.snapshot_statements(engine.dialect.name) is None:
+        logging.warning(f"Batch mode is not supported on "
+                        f"{engine.dialect.name}, running each test on its "
+                        f"own connection")
+        return run_threaded
 
-    cfg = config.settings
+    return batch.run_batched
 
-    test_files = loader.load_test_files(cfg['TEST_FILES'])
-    engine = database.create_db_engine(cfg['DB_URL'])
-    logger.setup_logging(cfg)
+
+def run_suite(tests, cfg, execute, load_report=None, expected=len):
+    """
+    Run the tests once, longest first, writing each result to the result
+    sink as it completes, then log the summary and record the durations for
+    the next run.
+
+    Args:
+        tests (list): The test definitions.
+        cfg (dict): The configuration.
+        execute (callable): Called with the ordered tests and a callback
+            taking each test result, runs the tests.
+        load_report (LoadReport): How the tests were loaded, if they were
+            loaded for this run.
+        expected (callable): Called with the tests, returns the number of
+            results the run produces, e.g. one per target in a fan-out run.
+
+    Returns:
+        dict: The summary of the run.
+    """
+
+    run_history = history.History(
+        cfg['HISTORY_FILE'] or history.default_path(cfg['TEST_FILES']))
+    tests = history.order_tests(tests, run_history.durations())
 
     summary = {
         'total': 0,
         'passed': 0,
         'failed': 0,
         'errors': 0,
-        'details': []
+        'timeouts': 0,
+        'pool_wait': 0.0,
+        'short_circuited': 0,
+        'durations': {},
+        'timings': {}
     }
 
+    if load_report is not None:
+        summary['cache_hits'] = load_report.cache_hits
+        summary['cache_misses'] = load_report.cache_misses
+
     start_time = time.time()
+    sink = sinks.create_sink(
+        cfg['RESULT_FORMAT'], cfg['RESULT_FILE'],
+        datetime.datetime.fromtimestamp(start_time).isoformat())
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(execute_test, test, cfg['DB_URL'])
-                   for test in test_files]
-
-        for future in as_completed(futures):
-            result = future.result()
-            summary['total'] += 1
-            if result['status'] == 'PASS':
-                summary['passed'] += 1
-            elif result['status'] == 'FAIL':
-                summary['failed'] += 1
-            else:
-                summary['errors'] += 1
-
-            summary['details'].append(result)
-            logger.log_test_result(
-                result['name'],
-                result['status'],
-                result['duration'],
-                result['query'],
-                result['error_messages'],
-                result['erroneous_rows'])
+    queued = expected(tests)
+    metrics.queue_depth.inc(queued)
+    try:
+        execute(tests, lambda result: record_result(summary, sink, result))
+    finally:
+        # A failed run leaves the results it did not record in the queue
+        metrics.queue_depth.dec(queued - summary['total'])
 
     end_time = time.time()
     summary['runtime'] = end_time - start_time
+    sink.close(summary)
 
-    engine.dispose()
+    run_history.record(summary['durations'])
+    run_history.close()
     logger.log_summary(summary)
 
+    metrics.observe_run(summary)
+    if cfg['METRICS_TEXTFILE']:
+        try:
+            metrics.write_textfile(cfg['METRICS_TEXTFILE'])
+        except OSError as e:
+            logging.error(f"Could not write metrics textfile: {e}")
+
+    return summary
+
+
+def lock_path(cfg):
+    return cfg['LOCK_FILE'] or os.path.join(
+        os.path.dirname(os.path.abspath(cfg['TEST_FILES'])), LOCK_FILE_NAME)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Validate SQL query results against YAML test files.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="parse and validate all test files, bypassing "
+                             "the test cache")
+    return parser.parse_args(args)
+
+
+def main():
+    """Main function to execute the tests and log the results."""
+
+    args = parse_args()
+    cfg = config.settings
+    logger.setup_logging(cfg)
+
+    with run_lock(lock_path(cfg)) as acquired:
+        if not acquired:
+            logging.warning("Previous run is still in progress, skipping run")
+            return
+
+        run(cfg, use_cache=not args.no_cache)
+
+
+def run_targets(test_files, cfg, target_list, load_report):
+    """Execute the tests on the targets they select and log the results."""
+
+    matrix = fanout.Fanout(target_list, cfg)
+
+    if matrix.async_mode:
+        run_suite(test_files, cfg, lambda tests, on_result: asyncio.run(
+            matrix.run_once(tests, on_result)), load_report,
+            matrix.count_results)
+        return
+
+    with ThreadPoolExecutor(max_workers=cfg['MAX_WORKERS']) as executor:
+        run_suite(test_files, cfg, lambda tests, on_result:
+                  matrix.run_threaded(tests, on_result, executor),
+                  load_report, matrix.count_results)
+
+    workers.shutdown()
+    matrix.dispose()
+
+
+def run(cfg, use_cache=True):
+    """Execute the tests and log the results."""
+
+    target_list = targets.load_targets(cfg)
+    load_report = load_tests(cfg, use_cache)
+    test_files = load_report.tests
+
+    if target_list:
+        run_targets(test_files, cfg, target_list, load_report)
+        return
+
+    async_engine = (database.create_async_pool(cfg, cfg['ASYNC_CONCURRENCY'])
+                    if cfg['ASYNC_MODE'] and not cfg['BATCH_MODE'] else None)
+
+    if async_engine is not None:
+        run_suite(test_files, cfg, lambda tests, on_result: asyncio.run(
+            async_runner.run_once(tests, async_engine, cfg, on_result)),
+            load_report)
+        return
+
+    if cfg['ASYNC_MODE'] and not cfg['BATCH_MODE']:
+        logging.warning("No async driver installed for the database, "
+                        "running tests on threads")
+
+    # Batch mode holds one more connection exporting the snapshot
+    engine = database.create_pool(
+        cfg, cfg['MAX_WORKERS'] + (1 if cfg['BATCH_MODE'] else 0))
+    run_tests = select_runner(engine, cfg)
+
+    with ThreadPoolExecutor(max_workers=cfg['MAX_WORKERS']) as executor:
+        run_suite(test_files, cfg, lambda tests, on_result: run_tests(
+            tests, on_result, engine, cfg, executor), load_report)
+
+    workers.shutdown()
+    engine.dispose()
+
 
 if __name__ == '__main__':
     main()
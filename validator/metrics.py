@@ -0,0 +1,97 @@
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               disable_created_metrics, start_http_server,
+                               write_to_textfile)
+
+# The *_created series only double the size of every scrape
+disable_created_metrics()
+
+# Metrics of the validator only, without the default process collectors,
+# so that the textfile written in cron mode holds nothing but test metrics
+registry = CollectorRegistry()
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+                    300, 600)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+test_duration = Histogram(
+    'query_validator_test_duration_seconds',
+    "Wall-clock duration of a test, from planning to its result.",
+    ['test'], buckets=DURATION_BUCKETS, registry=registry)
+evaluation_time = Histogram(
+    'query_validator_assertion_evaluation_seconds',
+    "Time spent evaluating a test's assertions on the fetched rows.",
+    ['test'], buckets=DURATION_BUCKETS, registry=registry)
+pool_wait = Histogram(
+    'query_validator_pool_wait_seconds',
+    "Time a test waited to check a connection out of the pool.",
+    ['test'], buckets=WAIT_BUCKETS, registry=registry)
+rows_fetched = Counter(
+    'query_validator_rows_fetched',
+    "Rows fetched from the database and evaluated by a test.",
+    ['test'], registry=registry)
+bytes_fetched = Counter(
+    'query_validator_bytes_fetched',
+    "Estimated size of the rows fetched by a test, from the lengths of "
+    "string and binary values and 8 bytes per other value.",
+    ['test'], registry=registry)
+test_results = Counter(
+    'query_validator_test_results',
+    "Test results by test, target and status (PASS, FAIL, ERROR, "
+    "TIMEOUT).",
+    ['test', 'target', 'status'], registry=registry)
+queue_depth = Gauge(
+    'query_validator_queue_depth',
+    "Tests of the current runs that have not completed yet.",
+    registry=registry)
+run_duration = Gauge(
+    'query_validator_last_run_duration_seconds',
+    "Wall-clock duration of the last run.",
+    registry=registry)
+run_timestamp = Gauge(
+    'query_validator_last_run_timestamp_seconds',
+    "Time the last run completed, in seconds since the epoch.",
+    registry=registry)
+run_tests = Gauge(
+    'query_validator_last_run_tests',
+    "Tests of the last run by status.",
+    ['status'], registry=registry)
+
+
+def observe_result(result):
+    """Record the metrics of a test result."""
+
+    name = result['name']
+    test_duration.labels(name).observe(result['duration'])
+    evaluation_time.labels(name).observe(result['evaluation_time'])
+    pool_wait.labels(name).observe(result['pool_wait'])
+    rows_fetched.labels(name).inc(result['rows_fetched'])
+    bytes_fetched.labels(name).inc(result['bytes_fetched'])
+    # Only the results are counted per target, the other metrics of a
+    # fan-out run would have a series per test and target. Results of a run
+    # on DB_URL have an empty target
+    test_results.labels(name, result['target'] or '', result['status']).inc()
+    queue_depth.dec()
+
+
+def observe_run(summary):
+    """Record the metrics of a completed run."""
+
+    run_duration.set(summary['runtime'])
+    run_timestamp.set_to_current_time()
+    for status in ('passed', 'failed', 'errors', 'timeouts'):
+        run_tests.labels(status).set(summary[status])
+
+
+def serve(port):
+    """Expose the metrics at `/metrics` on the port, from a thread."""
+
+    start_http_server(port, registry=registry)
+
+
+def write_textfile(path):
+    """
+    Write the metrics for node_exporter's textfile collector. The file is
+    replaced atomically, so the collector never reads a partial file.
+    """
+
+    write_to_textfile(path, registry)
@@ -0,0 +1,61 @@
+import re
+import runner
+
+# String literals and quoted identifiers are kept as they are, comments and
+# runs of whitespace outside of them collapse into a single space
+TOKENS = re.compile(
+    r"""(?P<literal>'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)"""
+    r"""|(?P<space>(?:--[^\n]*|/\*.*?\*/|\s+)+)""",
+    re.DOTALL)
+
+
+def normalize_query(query):
+    """
+    Normalize a query's text so that queries differing only in whitespace
+    and comments compare equal.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        str: The normalized query.
+    """
+
+    normalized = TOKENS.sub(
+        lambda match: match.group('literal') or ' ', query)
+    return normalized.strip().rstrip(';').rstrip()
+
+
+def group_tests(tests, dialect_name, cfg):
+    """
+    Group tests running the same query, so that it is executed once and every
+    test's assertions are evaluated on the shared result. Only tests that
+    fetch their rows the same way and share a timeout are grouped; pushed
+    down tests run their own aggregate query.
+
+    Groups keep the order of the tests, placed at their first test.
+
+    Args:
+        tests (list): The test definitions, in submission order.
+        dialect_name (str): The database dialect.
+        cfg (dict): The configuration.
+
+    Returns:
+        list: The groups, each a list of test definitions.
+    """
+
+    if not cfg['DEDUPLICATE_QUERIES']:
+        return [[test] for test in tests]
+
+    groups = {}
+
+    for index, test in enumerate(tests):
+        plan = runner.plan_test(test, dialect_name, cfg)
+        if plan['pushdown']:
+            key = index
+        else:
+            key = (normalize_query(plan['query']), plan['stream'],
+                   plan['timeout'])
+        groups.setdefault(key, []).append(test)
+
+    return list(groups.values())
@@ -0,0 +1,334 @@
+from validators import Forbidden, Predicate, TestResult
+
+DIALECTS = {'postgresql', 'mysql', 'mariadb', 'sqlite'}
+
+# LIKE ignores case on MySQL and SQLite, unlike conditions on fetched rows
+CASE_SENSITIVE_LIKE = {'postgresql'}
+
+# Case sensitive regular expression matches, by dialect. SQLite has no
+# regular expressions unless an extension is loaded.
+REGEX_MATCH = {
+    'postgresql': "{column} ~ {pattern}",
+    'mysql': "REGEXP_LIKE({column}, {pattern}, 'c')"
+}
+
+# Every expected value of a `has` rule becomes one aggregate column
+MAX_HAS_VALUES = 500
+
+
+def supports(assertions, dialect_name):
+    """
+    Check whether a test's assertions can be answered by an aggregate query.
+
+    Args:
+        assertions (dict): Dictionary of assertions to apply to the result set.
+        dialect_name (str): Name of the SQLAlchemy dialect.
+
+    Returns:
+        bool: True if every assertion can be pushed down.
+    """
+
+    if dialect_name not in DIALECTS:
+        return False
+
+    for key, assertion in assertions.items():
+        if key not in {'count', 'has', 'missing', 'no_nulls', 'only_nulls',
+                       'conditions'}:
+            return False
+        if (key == 'conditions' and
+                dialect_name not in CASE_SENSITIVE_LIKE and
+                any('like' in rule['operator'].lower()
+                    for rule in assertion)):
+            return False
+        if (key == 'missing' and dialect_name not in REGEX_MATCH and
+                any(rule.get('regex') for rule in assertion)):
+            return False
+        if key == 'has' and sum(len(rule['values'])
+                                for rule in assertion) > MAX_HAS_VALUES:
+            return False
+        # Rules with nothing to check have no aggregate column to answer them
+        if key in ('has', 'missing'):
+            if not any(rule.get('values') or rule.get('regex')
+                       for rule in assertion):
+                return False
+        elif key != 'count' and not assertion:
+            return False
+
+    return True
+
+
+def count_limit(assertions, dialect_name):
+    """
+    For tests that only check the row count, the verdict is known once one
+    row more than expected has been seen.
+
+    Returns:
+        int: The limit the query can be rewritten with, or None.
+    """
+
+    if dialect_name in DIALECTS and list(assertions) == ['count']:
+        return assertions['count'] + 1
+    return None
+
+
+def limit_query(query, limit):
+    """
+    Wrap a query so that it returns at most `limit` rows. The query keeps
+    lines of its own, so that a trailing `--` comment ends with it.
+    """
+
+    return (f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) AS q "
+            f"LIMIT {int(limit)}")
+
+
+class AggregateQuery:
+    """
+    Rewrites a test's query and assertions into a single aggregate query,
+    which answers every assertion in one row, e.g.
+
+        SELECT count(*), count(*) FILTER (WHERE email IS NULL), ...
+        FROM (<query>) AS q
+
+    Args:
+        query (str): The test's query.
+        assertions (dict): Dictionary of assertions to apply to the result set.
+        dialect (Dialect): Dialect of the engine the query runs on.
+    """
+
+    def __init__(self, query, assertions, dialect):
+        self.query = query.strip().rstrip(';')
+        self.assertions = assertions
+        self.dialect = dialect
+        self.params = {}
+        self.columns = []
+        self.conditions = {}
+
+        for key, assertion in assertions.items():
+            getattr(self, f'_add_{key}')(assertion)
+
+        self.sql = (f"SELECT {', '.join(self.columns)} "
+                    f"FROM (\n{self.query}\n) AS q")
+
+    def _quote(self, column):
+        return self.dialect.identifier_preparer.quote(column)
+
+    def _param(self, value):
+        name = f'p{len(self.params)}'
+        self.params[name] = value
+        return f':{name}'
+
+    def _in(self, column, values):
+        params = ', '.join(self._param(value) for value in values)
+        return f"{self._quote(column)} IN ({params})"
+
+    def _count_where(self, condition):
+        if self.dialect.name == 'postgresql':
+            expression = f"count(*) FILTER (WHERE {condition})"
+        else:
+            expression = (f"COALESCE(SUM(CASE WHEN {condition} "
+                          f"THEN 1 ELSE 0 END), 0)")
+
+        self.columns.append(f"{expression} AS c{len(self.columns)}")
+        return len(self.columns) - 1
+
+    def _add_count(self, expected_value):
+        self.columns.append(f"count(*) AS c{len(self.columns)}")
+        self.count_index = len(self.columns) - 1
+
+    def _add_has(self, rules):
+        self.has_indices = []
+        offending = []
+
+        for rule in rules:
+            column = self._quote(rule['column'])
+            for value in rule['values']:
+                index = self._count_where(f"{column} = {self._param(value)}")
+                self.has_indices.append((rule['column'], value, index))
+            if rule['values']:
+                offending.append(f"({column} IS NOT NULL AND NOT "
+                                 f"{self._in(rule['column'], rule['values'])})")
+
+        self.conditions['has'] = ' OR '.join(offending)
+        self.has_index = (self._count_where(self.conditions['has'])
+                          if offending else None)
+
+    def _regex(self, column, pattern):
+        return REGEX_MATCH[self.dialect.name].format(
+            column=self._quote(column), pattern=self._param(pattern))
+
+    def _add_missing(self, rules):
+        # Like on fetched rows, every part of a rule is counted on its own
+        # and a row hitting the rule counts once
+        self.missing_indices = []
+        conditions = []
+
+        for rule in rules:
+            forbidden = Forbidden(rule)
+            parts = [self._in(rule['column'], rule['values'])
+                     if rule.get('values') else None]
+            parts += [self._regex(rule['column'], pattern)
+                      for pattern in forbidden.patterns]
+            present = [part for part in parts if part]
+            if not present:
+                continue
+
+            indices = [self._count_where(part) if part else None
+                       for part in parts]
+            condition = ' OR '.join(f"({part})" for part in present)
+            index = (self._count_where(condition) if len(present) > 1
+                     else next(index for index in indices
+                               if index is not None))
+
+            conditions.append(condition)
+            self.missing_indices.append((forbidden, index, indices))
+
+        self.conditions['missing'] = ' OR '.join(conditions)
+
+    def _add_no_nulls(self, columns):
+        self.conditions['no_nulls'] = ' OR '.join(
+            f"{self._quote(column)} IS NULL" for column in columns)
+        self.no_nulls_index = self._count_where(self.conditions['no_nulls'])
+
+    def _predicate(self, predicate):
+        column = self._quote(predicate.column)
+        if 'between' in predicate.operator:
+            return (f"{column} {predicate.operator.upper()} "
+                    f"{self._param(predicate.value[0])} AND "
+                    f"{self._param(predicate.value[1])}")
+        if predicate.operator in ('in', 'not in'):
+            params = ', '.join(self._param(value)
+                               for value in predicate.value)
+            return f"{column} {predicate.operator.upper()} ({params})"
+        if predicate.operator in ('like', 'not like'):
+            return (f"{column} {predicate.operator.upper()} "
+                    f"{self._param(str(predicate.value))}")
+        return f"{column} {predicate.operator} {self._param(predicate.value)}"
+
+    def _add_conditions(self, rules):
+        # Rows for which a condition is null, e.g. on null values, satisfy
+        # it, like when the conditions are evaluated on fetched rows
+        self.predicates = [Predicate(rule) for rule in rules]
+        conditions = [self._predicate(predicate)
+                      for predicate in self.predicates]
+        self.conditions['conditions'] = "NOT ({})".format(' AND '.join(
+            f"({condition})" for condition in conditions))
+        self.conditions_indices = [self._count_where(f"NOT ({condition})")
+                                   for condition in conditions]
+        self.conditions_index = self._count_where(
+            self.conditions['conditions'])
+
+    def _add_only_nulls(self, columns):
+        self.conditions['only_nulls'] = ' OR '.join(
+            f"{self._quote(column)} IS NOT NULL" for column in columns)
+        self.only_nulls_index = self._count_where(
+            self.conditions['only_nulls'])
+
+    def failures(self, row):
+        """
+        Evaluate the assertions from the aggregate query's single row.
+
+        Returns:
+            list: List of (key, TestResult) tuples for failed assertions,
+            without erroneous rows.
+        """
+
+        failed_assertions = []
+
+        for key in self.assertions:
+            result = getattr(self, f'_check_{key}')(row)
+            if not result.success:
+                failed_assertions.append((key, result))
+
+        return failed_assertions
+
+    def _check_count(self, row):
+        count = row[self.count_index]
+        if count != self.assertions['count']:
+            return TestResult(
+                success=False,
+                message=f"Expected {self.assertions['count']}, got {count}",
+                violations=count)
+
+        return TestResult(success=True,
+                          message="Row count matches expected value")
+
+    def _check_has(self, row):
+        remaining = {}
+        for column, value, index in self.has_indices:
+            if not row[index]:
+                remaining.setdefault(column, set()).add(value)
+
+        if remaining:
+            remaining_rules = [{'column': column, 'values': values}
+                               for column, values in remaining.items()]
+            return TestResult(
+                success=False,
+                message=f"Expected values not found: {remaining_rules}",
+                violations=(row[self.has_index]
+                            if self.has_index is not None else 0))
+
+        return TestResult(success=True, message="All expected values found")
+
+    def _check_missing(self, row):
+        violations = sum(row[index] for _, index, _ in self.missing_indices)
+        if violations:
+            details = [detail
+                       for forbidden, _, indices in self.missing_indices
+                       for detail in forbidden.describe(
+                           [row[index] if index is not None else 0
+                            for index in indices])]
+            return TestResult(success=False,
+                              message=f"Unexpected values found: "
+                                      f"{', '.join(details)}",
+                              violations=violations)
+
+        return TestResult(success=True, message="No unexpected values found")
+
+    def _check_no_nulls(self, row):
+        if row[self.no_nulls_index]:
+            return TestResult(success=False,
+                              message="Unexpected 'null' values found",
+                              violations=row[self.no_nulls_index])
+
+        return TestResult(success=True,
+                          message="No null values found in specified columns")
+
+    def _check_only_nulls(self, row):
+        if row[self.only_nulls_index]:
+            return TestResult(success=False,
+                              message="Unexpected non-null values found",
+                              violations=row[self.only_nulls_index])
+
+        return TestResult(
+            success=True,
+            message="Only null values found in specified columns")
+
+    def _check_conditions(self, row):
+        if row[self.conditions_index]:
+            failed = [f"{predicate} ({row[index]} rows)"
+                      for predicate, index
+                      in zip(self.predicates, self.conditions_indices)
+                      if row[index]]
+            return TestResult(success=False,
+                              message=f"Rows not matching conditions: "
+                                      f"{', '.join(failed)}",
+                              violations=row[self.conditions_index])
+
+        return TestResult(success=True, message="All rows match conditions")
+
+    def sample(self, key, limit):
+        """
+        Build a query fetching sample offending rows of a failed assertion.
+
+        Args:
+            key (str): The failed assertion.
+            limit (int): Maximum number of rows to fetch.
+
+        Returns:
+            str: The query, using the same parameters as the aggregate query.
+        """
+
+        condition = self.conditions.get(key)
+        where = f" WHERE {condition}" if condition else ''
+        return (f"SELECT * FROM (\n{self.query}\n) AS q{where} "
+                f"LIMIT {int(limit)}")
@@ -0,0 +1,459 @@
+import io
+import time
+import pstats
+import cProfile
+import database
+import pushdown
+import validators
+import workers
+
+
+def run_assertions(rows, assertions, keys=None, capture=None,
+                   short_circuit=False, columnar_threshold=0, sketch=None):
+    """
+    Run a series of assertions on the result set in a single pass.
+
+    Args:
+        rows (iterable): Rows returned from the SQL query, either as one list
+            or as an iterable of row batches when streaming.
+        assertions (dict): Dictionary of assertions to apply to the result set.
+        keys (list): Column names of the result, used to index rows by
+            position.
+        capture (dict): Limits of the offending rows kept per assertion,
+            with the `samples` and `reservoir` sizes.
+        short_circuit (bool): Stop consuming batches once every assertion
+            has reached its final verdict. Has no effect on a single list.
+        columnar_threshold (int): Evaluate batches of at least this many rows
+            column by column with NumPy, 0 to never do so.
+        sketch (dict): Limits of the exact evaluation of the `unique`,
+            `distinct_count` and `distinct_ratio` assertions, with the
+            `exact_limit` and `bloom_capacity`.
+
+    Returns:
+        Evaluation: The evaluated assertions. `failures()` lists the failed
+        ones and `short_circuited` tells whether batches were left unread.
+    """
+
+    return run_shared_assertions(rows, [(assertions, capture)], keys,
+                                 short_circuit, columnar_threshold,
+                                 sketch)[0]
+
+
+def run_shared_assertions(rows, checks, keys=None, short_circuit=False,
+                          columnar_threshold=0, sketch=None):
+    """
+    Run the assertions of several tests on one result set in a single pass,
+    like `run_assertions`. Batches stop being consumed once every test's
+    assertions have reached their final verdict.
+
+    Args:
+        checks (list): List of (assertions, capture) tuples, one per test.
+
+    Returns:
+        list: The Evaluation of each test, in order.
+    """
+
+    evaluations = [validators.compile_assertions(assertions).start(
+        keys, columnar_threshold=columnar_threshold, sketch=sketch,
+        **(capture or {}))
+        for assertions, capture in checks]
+
+    if isinstance(rows, list):
+        rows, short_circuit = [rows], False
+
+    for batch in rows:
+        validators.feed_shared(evaluations, batch)
+        if short_circuit and all(evaluation.decided
+                                 for evaluation in evaluations):
+            for evaluation in evaluations:
+                evaluation.stop()
+            break
+
+    return evaluations
+
+
+# Functions listed in a test's profile, by cumulative time
+PROFILE_LINES = 25
+
+
+def run_profiled(enabled, func, *args):
+    """
+    Call a function, under cProfile if enabled.
+
+    Returns:
+        tuple: The function's return value and the profile's most expensive
+        functions as text, or None if not profiled.
+    """
+
+    if not enabled:
+        return func(*args), None
+
+    profiler = cProfile.Profile()
+    value = profiler.runcall(func, *args)
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(
+        'cumulative').print_stats(PROFILE_LINES)
+    return value, output.getvalue()
+
+
+def run_pushdown(conn, query, assertions, capture):
+    """
+    Answer the assertions with one aggregate query in the database. Sample
+    offending rows, up to the capture's `samples` limit, are only fetched
+    for assertions that failed.
+
+    Returns:
+        list: List of (key, TestResult) tuples for failed assertions.
+    """
+
+    aggregate = pushdown.AggregateQuery(query, assertions, conn.dialect)
+    row = database.execute_query(conn, aggregate.sql, aggregate.params).one()
+    failed_assertions = aggregate.failures(row)
+
+    for key, test_result in failed_assertions:
+        test_result.erroneous_rows = database.execute_query(
+            conn, aggregate.sample(key, capture['samples']),
+            aggregate.params).all()
+
+    return failed_assertions
+
+
+def plan_test(test, dialect_name, cfg):
+    """
+    Resolve how a test is executed from its definition and the
+    configuration.
+
+    Returns:
+        dict: The test's execution plan.
+    """
+
+    query = test.get('query')
+    assertions = test.get('assertions', {})
+    push_down = bool(test.get('pushdown', cfg['PUSHDOWN']) and
+                     pushdown.supports(assertions, dialect_name))
+    short_circuit = cfg['SHORT_CIRCUIT']
+    limit = (pushdown.count_limit(assertions, dialect_name)
+             if short_circuit and cfg['LIMIT_COUNT_QUERIES'] and
+             not push_down else None)
+
+    return {
+        'query': query,
+        'statement': pushdown.limit_query(query, limit) if limit else query,
+        'assertions': assertions,
+        'stream': test.get('stream', cfg['STREAM_RESULTS']),
+        'batch_size': cfg['STREAM_BATCH_SIZE'],
+        'pushdown': push_down,
+        'short_circuit': short_circuit,
+        'limit': limit,
+        'timeout': test.get('timeout', cfg['QUERY_TIMEOUT']),
+        'profile': test.get('profile', cfg['PROFILE']),
+        'explain_threshold': cfg['EXPLAIN_THRESHOLD'],
+        'columnar_threshold': cfg['COLUMNAR_THRESHOLD'],
+        'sketch': {'exact_limit': cfg['DISTINCT_EXACT_LIMIT'],
+                   'bloom_capacity': cfg['BLOOM_FILTER_CAPACITY']},
+        'processes': cfg['ASSERTION_PROCESSES'],
+        'capture': {'samples': cfg['ERROR_SAMPLE_SIZE'],
+                    'reservoir': cfg['ERROR_RESERVOIR_SIZE'],
+                    **test.get('capture', {})}
+    }
+
+
+def shared_statement(plans):
+    """
+    The statement run for a group of tests sharing a query. Its row limit is
+    the largest of the tests' limits, or none if any test needs every row.
+    """
+
+    if len(plans) == 1:
+        return plans[0]['statement'], plans[0]['limit']
+
+    limits = [plan['limit'] for plan in plans]
+    limit = max(limits) if all(limits) else None
+    query = plans[0]['query']
+
+    return pushdown.limit_query(query, limit) if limit else query, limit
+
+
+def build_result(test, start_time, pool_wait=0.0, evaluation=None,
+                 failed_assertions=None, error=None, timeout=None,
+                 timings=None, profile=None, explain=None):
+    """
+    Build the result record of a test.
+
+    Args:
+        test (dict): The test definition.
+        start_time (float): `time.time()` when the test started.
+        pool_wait (float): Seconds spent waiting for a pooled connection.
+        evaluation (Evaluation): The evaluated assertions, if the rows were
+            validated in Python.
+        failed_assertions (list): List of (key, TestResult) tuples, if the
+            assertions were evaluated otherwise.
+        error (Exception): Error raised while executing the test.
+        timeout (float): The timeout the test ran into, if it timed out.
+        timings (dict): Seconds spent in each phase of the test.
+        profile (str): The profile of the assertion phase, if profiled.
+        explain (str): The query plan, if the test was slow.
+
+    Returns:
+        dict: The test result.
+    """
+
+    result_status = 'PASS'
+    error_messages = []
+    erroneous_rows = []
+    sampled_rows = []
+    violations = {}
+
+    if evaluation is not None:
+        failed_assertions = evaluation.failures()
+
+    if timeout is not None:
+        result_status = 'TIMEOUT'
+        error_messages.append(f"Timed out after {timeout} seconds")
+    elif error is not None:
+        result_status = 'ERROR'
+        error_messages.append(str(error))
+    elif failed_assertions:
+        result_status = 'FAIL'
+        for key, test_result in failed_assertions:
+            error_messages.append(
+                f"Assertion '{key}' failed: {test_result.message}")
+            violations[key] = test_result.violations
+            if test_result.erroneous_rows:
+                erroneous_rows.extend(test_result.erroneous_rows)
+            if test_result.sampled_rows:
+                sampled_rows.extend(test_result.sampled_rows)
+
+    duration = time.time() - start_time
+
+    return {
+        'name': test.get('name'),
+        'target': None,
+        'status': result_status,
+        'duration': duration,
+        'pool_wait': pool_wait,
+        'short_circuited': bool(evaluation and evaluation.short_circuited),
+        'approximate': evaluation.approximate if evaluation else [],
+        'rows_fetched': evaluation.rows if evaluation else 0,
+        'bytes_fetched': evaluation.bytes if evaluation else 0,
+        'evaluation_time': evaluation.elapsed if evaluation else 0.0,
+        'timings': timings or {},
+        'profile': profile,
+        'explain': explain,
+        'error_messages': error_messages,
+        'violations': violations,
+        'erroneous_rows': erroneous_rows,
+        'sampled_rows': sampled_rows,
+        'assertions': test.get('assertions', {}),
+        'query': test.get('query')
+    }
+
+
+def watch(batches, watchdog):
+    """ Stop consuming a streamed result once its timeout has expired, as
+    the server-side limit does not cover time spent between fetches.
+    """
+
+    for batch in batches:
+        if watchdog is not None and watchdog.expired:
+            raise TimeoutError("Statement timeout expired while streaming")
+        yield batch
+
+
+def stop_at_limit(evaluations, limit):
+    """
+    A test whose verdict is decided within the row limit of the statement
+    did not need the rest of the result, if the result reached the limit.
+    A shorter result was read in full.
+    """
+
+    if limit and evaluations and evaluations[0].rows >= limit:
+        for evaluation in evaluations:
+            if evaluation.decided:
+                evaluation.stop()
+
+
+def timed(batches, timings):
+    """Count the time spent fetching the batches as the `fetch` phase."""
+
+    timings['fetch'] = 0.0
+    batches = iter(batches)
+    while True:
+        start_time = time.perf_counter()
+        batch = next(batches, None)
+        timings['fetch'] += time.perf_counter() - start_time
+        if batch is None:
+            return
+        yield batch
+
+
+def evaluate_tests(conn, plans, watchdog=None):
+    """
+    Run the query shared by the tests on the connection once and evaluate
+    every test's assertions on its result. A pushed down test is always
+    evaluated on its own.
+
+    The time until the database returned a result is the `execute` phase,
+    retrieving the rows the `fetch` phase and evaluating the assertions the
+    `evaluate` phase. For streamed results, fetching and evaluating take
+    turns, and the fetch time is what the evaluations did not account for.
+
+    With ASSERTION_PROCESSES, streamed and large results are evaluated in a
+    worker process while the thread goes on fetching, and are not profiled.
+
+    Returns:
+        list: The outcome of each test, as keyword arguments for
+        `build_result`.
+    """
+
+    plan = plans[0]
+    start_time = time.perf_counter()
+
+    if plan['pushdown']:
+        failed_assertions = run_pushdown(
+            conn, plan['query'], plan['assertions'], plan['capture'])
+        return [{'failed_assertions': failed_assertions,
+                 'timings': {'execute': time.perf_counter() - start_time}}]
+
+    statement, limit = shared_statement(plans)
+    checks = [(plan['assertions'], plan['capture']) for plan in plans]
+    profile = any(plan['profile'] for plan in plans)
+    timings = {}
+
+    if plan['stream']:
+        result = database.stream_query(conn, statement, plan['batch_size'])
+        fetch_time = time.perf_counter()
+        timings['execute'] = fetch_time - start_time
+        batches = watch(result.partitions(), watchdog)
+
+        if plan['processes']:
+            evaluations, profile_stats = workers.run_shared_assertions(
+                timed(batches, timings), checks, result.keys(), plan,
+                plan['short_circuit'], limit), None
+        else:
+            evaluations, profile_stats = run_profiled(
+                profile, run_shared_assertions, batches, checks,
+                result.keys(), plan['short_circuit'],
+                plan['columnar_threshold'], plan['sketch'])
+            timings['fetch'] = (time.perf_counter() - fetch_time -
+                                sum(evaluation.elapsed
+                                    for evaluation in evaluations))
+
+        if evaluations[0].short_circuited:
+            database.close_stream(conn, result)
+    else:
+        result = database.execute_query(conn, statement)
+        fetch_time = time.perf_counter()
+        timings['execute'] = fetch_time - start_time
+
+        rows = result.all()
+        timings['fetch'] = time.perf_counter() - fetch_time
+
+        if plan['processes'] and len(rows) >= workers.MIN_ROWS:
+            evaluations, profile_stats = workers.run_shared_assertions(
+                workers.batched(rows), checks, result.keys(), plan,
+                limit=limit), None
+        else:
+            evaluations, profile_stats = run_profiled(
+                profile, run_shared_assertions, rows, checks, result.keys(),
+                False, plan['columnar_threshold'], plan['sketch'])
+
+    stop_at_limit(evaluations, limit)
+
+    return [{'evaluation': evaluation,
+             'timings': {**timings, 'evaluate': evaluation.elapsed},
+             'profile': profile_stats if plan['profile'] else None}
+            for plan, evaluation in zip(plans, evaluations)]
+
+
+def capture_explain(engine, conn, plan):
+    """
+    Explain the query of a slow test, within the test's timeout.
+
+    Returns:
+        str: The query plan, or why it could not be captured.
+    """
+
+    try:
+        with database.statement_timeout(engine, conn, plan['timeout']):
+            return database.explain(conn, plan['query'])
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+
+
+def is_slow(plan, start_time):
+    threshold = plan['explain_threshold']
+    return bool(threshold) and time.perf_counter() - start_time >= threshold
+
+
+def finish_outcomes(outcomes, timings, explain=None):
+    """Add the phases timed outside of `evaluate_tests` to the outcomes."""
+
+    for outcome in outcomes:
+        outcome['timings'] = {**timings, **outcome['timings']}
+        outcome['explain'] = explain
+    return outcomes
+
+
+def execute_test(test, engine, cfg):
+    """
+    Execute a test and evaluate its assertions.
+
+    With streaming enabled, the query runs on a server-side cursor and rows
+    are validated batch by batch instead of being loaded all at once. With
+    pushdown enabled, the assertions are answered by a single aggregate
+    query, falling back to the validators when a test can't be pushed down.
+    A test running into its timeout has its statement cancelled and its
+    connection discarded from the pool.
+    """
+
+    return execute_tests([test], engine, cfg)[0]
+
+
+def execute_tests(tests, engine, cfg):
+    """
+    Execute a group of tests sharing a query, like `execute_test`, running
+    the query once for all of them. Every test gets its own result. Slow
+    tests get the plan of their query if EXPLAIN_THRESHOLD is set.
+
+    Returns:
+        list: The result of each test, in order.
+    """
+
+    start_time = time.time()
+    started = time.perf_counter()
+    plans = [plan_test(test, engine.dialect.name, cfg) for test in tests]
+    timings = {'plan': time.perf_counter() - started}
+    timeout = plans[0]['timeout']
+    pool_wait = 0.0
+    watchdog = None
+
+    try:
+        conn, pool_wait = database.connect(engine)
+        timings['connect'] = pool_wait
+        with conn:
+            try:
+                with database.statement_timeout(
+                        engine, conn, timeout) as watchdog:
+                    outcomes = evaluate_tests(conn, plans, watchdog)
+            except Exception as e:
+                if not ((watchdog and watchdog.expired) or
+                        database.is_timeout(e)):
+                    raise
+                conn.invalidate()
+                return [build_result(test, start_time, pool_wait,
+                                     timeout=timeout, timings=timings)
+                        for test in tests]
+
+            explain = (capture_explain(engine, conn, plans[0])
+                       if is_slow(plans[0], started) else None)
+
+        return [build_result(test, start_time, pool_wait, **outcome)
+                for test, outcome in zip(
+                    tests, finish_outcomes(outcomes, timings, explain))]
+
+    except Exception as e:
+        return [build_result(test, start_time, pool_wait, error=e,
+                             timings=timings)
+                for test in tests]
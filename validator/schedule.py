@@ -0,0 +1,114 @@
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *'
+}
+
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+          'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+# (minimum, maximum, names) of the minute, hour, day of month, month and
+# day of week fields
+FIELDS = [
+    (0, 59, None),
+    (0, 23, None),
+    (1, 31, None),
+    (1, 12, MONTHS),
+    (0, 7, DAYS)
+]
+
+
+class CronSchedule:
+    """
+    A schedule in crontab syntax, e.g. `*/5 * * * *` or `@hourly`.
+
+    Args:
+        expression (str): The five-field cron expression or a macro.
+
+    Raises:
+        ValueError: If the expression is invalid.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = MACROS.get(expression.strip(), expression).split()
+
+        if len(fields) != 5:
+            raise ValueError(
+                f"Expected 5 fields in cron expression '{expression}'")
+
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [_parse_field(field, *bounds)
+                           for field, bounds in zip(fields, FIELDS)]
+
+        # Sunday can be written as 0 or 7
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+
+        # As in cron, a restricted day of month and day of week match when
+        # either of them does
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches(self, moment):
+        """
+        Whether the schedule fires at the minute of `moment`.
+
+        Args:
+            moment (datetime): The point in time.
+
+        Returns:
+            bool: True if the schedule is due.
+        """
+
+        if (moment.minute not in self.minutes or
+                moment.hour not in self.hours or
+                moment.month not in self.months):
+            return False
+
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+
+def _parse_value(value, names):
+    if names and value.lower() in names:
+        return names.index(value.lower()) + (1 if names is MONTHS else 0)
+    return int(value)
+
+
+def _parse_field(field, minimum, maximum, names):
+    values = set()
+
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = (_parse_value(value, names)
+                          for value in part.split('-'))
+        else:
+            start = _parse_value(part, names)
+            end = maximum if step != 1 else start
+
+        if start < minimum or end > maximum or start > end or step < 1:
+            raise ValueError(f"Invalid cron field '{field}'")
+
+        values.update(range(start, end + 1, step))
+
+    return values
@@ -8,6 +8,50 @@ schema = {
         'type': 'string',
         'required': True
     },
+    'timeout': {
+        'type': 'number',
+        'min': 0,
+        'required': False
+    },
+    'schedule': {
+        'type': 'string',
+        'required': False
+    },
+    'priority': {
+        'type': 'integer',
+        'required': False
+    },
+    'stream': {
+        'type': 'boolean',
+        'required': False
+    },
+    'pushdown': {
+        'type': 'boolean',
+        'required': False
+    },
+    'profile': {
+        'type': 'boolean',
+        'required': False
+    },
+    'targets': {
+        'type': 'list',
+        'schema': {'type': 'string'},
+        'required': False
+    },
+    'capture': {
+        'type': 'dict',
+        'required': False,
+        'schema': {
+            'samples': {
+                'type': 'integer',
+                'min': 0
+            },
+            'reservoir': {
+                'type': 'integer',
+                'min': 0
+            }
+        }
+    },
     'assertions': {
         'type': 'dict',
         'required': True,
@@ -48,7 +92,7 @@ schema = {
                             'schema': {
                                 'type': ['string', 'number']
                             },
-                            'required': True
+                            'required': False
                         },
                         'regex': {
                             'type': 'list',
@@ -77,11 +121,64 @@ schema = {
                         },
                         'operator': {
                             'type': 'string',
+                            'allowed': ['=', '!=', '<>', '<', '<=', '>', '>=',
+                                        'between', 'not between', 'in',
+                                        'not in', 'like', 'not like'],
                             'required': True
                         },
                         'value': {
+                            'type': ['string', 'number', 'boolean', 'date',
+                                     'datetime', 'list'],
+                            'required': True
+                        }
+                    }
+                }
+            },
+            'unique': {
+                'type': 'list',
+                'schema': {
+                    'type': ['string', 'list'],
+                    'schema': {'type': 'string'}
+                }
+            },
+            'distinct_count': {
+                'type': 'list',
+                'schema': {
+                    'type': 'dict',
+                    'schema': {
+                        'column': {
                             'type': 'string',
                             'required': True
+                        },
+                        'min': {
+                            'type': 'integer',
+                            'min': 0
+                        },
+                        'max': {
+                            'type': 'integer',
+                            'min': 0
+                        }
+                    }
+                }
+            },
+            'distinct_ratio': {
+                'type': 'list',
+                'schema': {
+                    'type': 'dict',
+                    'schema': {
+                        'column': {
+                            'type': 'string',
+                            'required': True
+                        },
+                        'min': {
+                            'type': 'number',
+                            'min': 0,
+                            'max': 1
+                        },
+                        'max': {
+                            'type': 'number',
+                            'min': 0,
+                            'max': 1
                         }
                     }
                 }
@@ -89,3 +186,31 @@ schema = {
         }
     }
 }
+
+# Entries of the TARGETS_FILE
+target_schema = {
+    'name': {
+        'type': 'string',
+        'regex': r'\S+',
+        'required': True
+    },
+    'url': {
+        'type': 'string',
+        'required': True
+    },
+    'concurrency': {
+        'type': 'integer',
+        'min': 0,
+        'required': False
+    },
+    'pool_size': {
+        'type': 'integer',
+        'min': 0,
+        'required': False
+    },
+    'groups': {
+        'type': 'list',
+        'schema': {'type': 'string'},
+        'required': False
+    }
+}
@@ -0,0 +1,252 @@
+import os
+import json
+import uuid
+import base64
+import decimal
+import datetime
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+# Encoders of column types the json module can't serialize, looked up by
+# exact type first since that is much faster than a chain of isinstance
+ENCODERS = {
+    decimal.Decimal: str,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    datetime.timedelta: datetime.timedelta.total_seconds,
+    uuid.UUID: str,
+    bytes: lambda value: base64.b64encode(value).decode('ascii'),
+    bytearray: lambda value: base64.b64encode(value).decode('ascii'),
+    memoryview: lambda value: base64.b64encode(value).decode('ascii'),
+    set: list,
+    frozenset: list
+}
+
+# The umask can only be read by setting it, which is not safe once the
+# daemon's threads write reports, so it is read once on import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def serialize(value):
+    """
+    `default` hook for `json.dumps`, serializing Decimal as a string to keep
+    its precision, dates and times in ISO 8601, UUID as a string and binary
+    data as base64. Other types, e.g. the IPv4Address of a PostgreSQL `inet`
+    column, are serialized as their string.
+    """
+
+    encoder = ENCODERS.get(type(value))
+    if encoder is None:
+        # Subclasses, e.g. the driver's own datetime or UUID types
+        for value_type, type_encoder in ENCODERS.items():
+            if isinstance(value, value_type):
+                encoder = ENCODERS[type(value)] = type_encoder
+                break
+        else:
+            return str(value)
+    return encoder(value)
+
+
+def dumps(value):
+    return json.dumps(value, default=serialize, ensure_ascii=False)
+
+
+def rows_to_dicts(rows):
+    return [dict(row._mapping) for row in rows]
+
+
+def write_atomically(path, write):
+    """
+    Write a file through a temporary file of its own next to it, which
+    replaces the file once complete. Readers never see a partial file, and
+    overlapping runs do not write to the same temporary file.
+
+    Args:
+        path (str): The file.
+        write (callable): Called with the open temporary file.
+    """
+
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f'.{os.path.basename(path)}-', suffix='.tmp',
+            delete=False) as file:
+        try:
+            write(file)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    # Temporary files are only readable by their owner, reports by anyone the
+    # umask allows, like files created by open()
+    os.chmod(file.name, 0o666 & ~_UMASK)
+    os.replace(file.name, path)
+
+
+def result_record(result):
+    """
+    Returns:
+        dict: The JSON-serializable record of a test result.
+    """
+
+    return {**result,
+            'erroneous_rows': rows_to_dicts(result['erroneous_rows']),
+            'sampled_rows': rows_to_dicts(result['sampled_rows'])}
+
+
+class ResultSink:
+    """
+    Receives every test result as soon as the test completes. Results are
+    written out immediately and not kept.
+    """
+
+    def write(self, result):
+        pass
+
+    def close(self, summary):
+        pass
+
+
+class JsonLinesSink(ResultSink):
+    """
+    Appends one JSON object per test result to a file, flushed after every
+    line so that results can be tailed while the run is going.
+
+    Args:
+        path (str): The JSON Lines file.
+        run_id (str): Identifier of the run, added to every line.
+    """
+
+    def __init__(self, path, run_id):
+        self.run_id = run_id
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, result):
+        self.file.write(dumps({'run': self.run_id, **result_record(result)}))
+        self.file.write('\n')
+        self.file.flush()
+
+    def close(self, summary):
+        self.file.close()
+
+
+class JUnitSink(ResultSink):
+    """
+    Writes the results as a JUnit XML report for CI systems. Test cases are
+    streamed to a temporary file next to the report, which becomes the
+    report once the totals for the `<testsuite>` element are known.
+
+    Args:
+        path (str): The JUnit XML file.
+        suite_name (str): Name of the test suite.
+    """
+
+    def __init__(self, path, suite_name='query-validator'):
+        self.path = path
+        self.suite_name = suite_name
+        self.cases = tempfile.NamedTemporaryFile(
+            'w+', encoding='utf-8', dir=os.path.dirname(os.path.abspath(path)),
+            prefix='.junit-', suffix='.tmp', delete=False)
+
+    def write(self, result):
+        # Results of a fan-out run are grouped by target
+        classname = self.suite_name
+        if result['target'] is not None:
+            classname += f'.{result["target"]}'
+        case = (f'  <testcase classname={quoteattr(classname)} '
+                f'name={quoteattr(str(result["name"]))} '
+                f'time="{result["duration"]:.3f}"')
+
+        message = '; '.join(result['error_messages'])
+        if result['status'] == 'PASS':
+            self.cases.write(f'{case}/>\n')
+            return
+
+        if result['status'] == 'FAIL':
+            element = 'failure'
+            details = dumps({
+                'violations': result['violations'],
+                'erroneous_rows': rows_to_dicts(result['erroneous_rows']),
+                'query': result['query']})
+        else:
+            element = 'error'
+            details = result['query'] or ''
+
+        self.cases.write(
+            f'{case}>\n'
+            f'    <{element} type={quoteattr(result["status"])} '
+            f'message={quoteattr(message)}>{escape(details)}</{element}>\n'
+            f'  </testcase>\n')
+
+    def close(self, summary):
+        self.cases.seek(0)
+        failures = summary['failed']
+        errors = summary['errors'] + summary['timeouts']
+
+        def write(report):
+            report.write(
+                f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<testsuite name={quoteattr(self.suite_name)} '
+                f'tests="{summary["total"]}" failures="{failures}" '
+                f'errors="{errors}" time="{summary["runtime"]:.3f}">\n')
+            for line in self.cases:
+                report.write(line)
+            report.write('</testsuite>\n')
+
+        try:
+            write_atomically(self.path, write)
+        finally:
+            self.cases.close()
+            os.remove(self.cases.name)
+
+
+class SummarySink(ResultSink):
+    """
+    Writes only the summary of the run as a JSON object.
+
+    Args:
+        path (str): The JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self, summary):
+        write_atomically(self.path,
+                         lambda file: file.write(dumps(summary)))
+
+
+SINKS = {
+    'jsonl': lambda path, run_id: JsonLinesSink(path, run_id),
+    'junit': lambda path, run_id: JUnitSink(path),
+    'summary': lambda path, run_id: SummarySink(path)
+}
+
+
+def create_sink(result_format, path, run_id):
+    """
+    Create the result sink of a run.
+
+    Args:
+        result_format (str): `jsonl`, `junit`, `summary` or empty for none.
+        path (str): The file the results are written to.
+        run_id (str): Identifier of the run.
+
+    Returns:
+        ResultSink: The sink.
+
+    Raises:
+        ValueError: If the format is unknown or no path is given.
+    """
+
+    if not result_format:
+        return ResultSink()
+
+    if result_format not in SINKS:
+        raise ValueError(f"Unknown result format '{result_format}'")
+    if not path:
+        raise ValueError(f"RESULT_FILE is required for the "
+                         f"'{result_format}' result format")
+
+    return SINKS[result_format](path, run_id)
@@ -0,0 +1,356 @@
+import math
+
+# NumPy is optional. Without it, values are hashed one by one.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Distinct values per column held exactly before switching to a sketch
+EXACT_LIMIT = 100_000
+
+# Values a Bloom filter is sized for, and its false positive rate at that
+# size. About 1.8 bytes per value.
+BLOOM_CAPACITY = 10_000_000
+BLOOM_ERROR_RATE = 0.001
+
+# 2^14 registers of a HyperLogLog sketch, a standard error of about 0.8%
+HLL_PRECISION = 14
+
+MASK = (1 << 64) - 1
+
+# Values from which a batch is hashed with NumPy
+VECTOR_MIN = 64
+
+
+def hash64(value):
+    """
+    Returns:
+        int: A well mixed 64-bit hash of the value. Equal values hash
+        equally, with the equality of Python sets, e.g. 1 and 1.0. Hashes
+        of strings differ between processes, so sketches are not merged
+        across processes.
+    """
+
+    # The splitmix64 finalizer, as integers hash to themselves
+    h = (hash(value) + 0x9E3779B97F4A7C15) & MASK
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK
+    return h ^ (h >> 31)
+
+
+def hash_array(values):
+    """
+    Returns:
+        ndarray: The `hash64` of every value, as unsigned 64-bit integers.
+        The mixing wraps around like the masked integer arithmetic.
+    """
+
+    h = np.fromiter(map(hash, values), dtype=np.int64,
+                    count=len(values)).view(np.uint64)
+    h += np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def vectorized(values):
+    """Whether a batch of values is hashed with NumPy."""
+    return np is not None and len(values) >= VECTOR_MIN
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values in a fixed amount of memory,
+    one byte per register.
+
+    Args:
+        precision (int): The sketch has 2^precision registers.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.registers = bytearray(1 << precision)
+        self.shift = 64 - precision
+
+    @property
+    def error(self):
+        """The relative standard error of the estimate."""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def update(self, values):
+        """
+        Args:
+            values (list): The next values, a list or set.
+        """
+
+        registers = self.registers
+        shift = self.shift
+        mask = (1 << shift) - 1
+
+        if vectorized(values):
+            h = hash_array(values)
+            rest = h & np.uint64(mask)
+            present = rest > 0
+            # Bit lengths from the base 2 logarithm, as the rest fits the
+            # mantissa of a float
+            lengths = np.zeros(len(h), dtype=np.int64)
+            lengths[present] = np.floor(np.log2(
+                rest[present].astype(np.float64))).astype(np.int64) + 1
+            np.maximum.at(np.frombuffer(registers, dtype=np.uint8),
+                          (h >> np.uint64(shift)).astype(np.intp),
+                          (shift + 1 - lengths).astype(np.uint8))
+            return
+
+        for value in values:
+            h = hash64(value)
+            # The position of the leftmost set bit after the register index
+            rank = shift + 1 - (h & mask).bit_length()
+            index = h >> shift
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        """
+        Returns:
+            int: The estimated number of distinct values.
+        """
+
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(
+            2.0 ** -rank for rank in self.registers)
+
+        # Small cardinalities are estimated from the empty registers
+        empty = self.registers.count(0)
+        if empty and estimate <= 2.5 * size:
+            estimate = size * math.log(size / empty)
+        return round(estimate)
+
+
+class BloomFilter:
+    """
+    A set of values in a fixed amount of memory, which may take a value
+    that was never added for one that was.
+
+    Args:
+        capacity (int): Values the filter is sized for.
+        error_rate (float): The false positive rate once `capacity` values
+            were added.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) /
+                                      math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, value):
+        """
+        Add a value.
+
+        Returns:
+            bool: Whether the value was possibly added before.
+        """
+
+        return bool(self.update([value]))
+
+    def update(self, values):
+        """
+        Add values.
+
+        Args:
+            values (list): The values, a list or set.
+
+        Returns:
+            list: Positions of the values possibly added before, including
+            earlier in the list.
+        """
+
+        if vectorized(values):
+            positions = self.update_array(hash_array(values))
+            self.count += len(values) - len(positions)
+            return positions
+
+        bits = self.bits
+        size = self.size
+        probes = range(self.hashes)
+        positions = []
+
+        for index, value in enumerate(values):
+            h = hash64(value)
+            # Double hashing derives every bit position from one hash
+            step = (h >> 32) | 1
+            present = True
+            for _ in probes:
+                position = h % size
+                byte, bit = position >> 3, 1 << (position & 7)
+                if not bits[byte] & bit:
+                    present = False
+                    bits[byte] |= bit
+                h = (h + step) & MASK
+
+            if present:
+                positions.append(index)
+
+        self.count += len(values) - len(positions)
+        return positions
+
+    def update_array(self, h):
+        """
+        Add values by their `hash_array`, like `update`. Repeats within the
+        batch are found by their hashes, as the bits are set all at once.
+        """
+
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        size = np.uint64(self.size)
+        step = (h >> np.uint64(32)) | np.uint64(1)
+        present = np.ones(len(h), dtype=bool)
+        probe = h
+
+        for _ in range(self.hashes):
+            position = probe % size
+            byte = (position >> np.uint64(3)).astype(np.intp)
+            bit = np.left_shift(1, (position & np.uint64(7)).astype(np.uint8),
+                                dtype=np.uint8)
+            present &= (bits[byte] & bit).astype(bool)
+            np.bitwise_or.at(bits, byte, bit)
+            probe = probe + step
+
+        _, first = np.unique(h, return_index=True)
+        repeated = np.ones(len(h), dtype=bool)
+        repeated[first] = False
+        return np.flatnonzero(present | repeated).tolist()
+
+    def error_rate(self):
+        """
+        Returns:
+            float: The probability that a new value is taken for one added
+            before, at the filter's current fill.
+        """
+
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** \
+            self.hashes
+
+
+class DistinctValues:
+    """
+    The distinct non-null values of a column. They are counted exactly in a
+    set up to `exact_limit` values, then estimated with a HyperLogLog
+    sketch, so that memory stays bounded however many values there are.
+
+    Args:
+        exact_limit (int): Distinct values held exactly.
+    """
+
+    def __init__(self, exact_limit=EXACT_LIMIT):
+        self.exact_limit = exact_limit
+        self.values = set()
+        self.sketch = None
+        # Values counted exactly before switching, a lower bound of the count
+        self.floor = 0
+
+    @property
+    def exact(self):
+        return self.sketch is None
+
+    @property
+    def error(self):
+        return 0.0 if self.sketch is None else self.sketch.error
+
+    def update(self, values):
+        if self.sketch is not None:
+            self.sketch.update([value for value in values
+                                if value is not None])
+            return
+
+        self.values.update(values)
+        self.values.discard(None)
+        if len(self.values) > self.exact_limit:
+            self.sketch = HyperLogLog()
+            self.sketch.update(self.values)
+            self.floor = len(self.values)
+            self.values = set()
+
+    def count(self):
+        if self.sketch is None:
+            return len(self.values)
+        return max(self.sketch.count(), self.floor)
+
+
+class UniqueValues:
+    """
+    The values seen so far, to find the repeated ones. They are held
+    exactly in a set up to `exact_limit` values, then in a Bloom filter,
+    which may take a new value for a repeated one. The repeats found by the
+    filter are only probable, and its expected false positives are tracked
+    to tell them apart from actual repeats.
+
+    Args:
+        exact_limit (int): Distinct values held exactly.
+        bloom_capacity (int): Values the Bloom filter is sized for.
+    """
+
+    def __init__(self, exact_limit=EXACT_LIMIT, bloom_capacity=BLOOM_CAPACITY):
+        self.exact_limit = exact_limit
+        self.bloom_capacity = bloom_capacity
+        self.values = set()
+        self.bloom = None
+        self.repeated = 0
+        self.probable = 0
+        self.false_positives = 0.0
+
+    @property
+    def exact(self):
+        return self.bloom is None
+
+    def repeats(self, values):
+        """
+        Add the next values and find the ones seen before.
+
+        Args:
+            values (list): The next non-null values.
+
+        Returns:
+            list: Positions of the values seen before, including earlier in
+            the list.
+        """
+
+        if self.bloom is not None:
+            positions = self.bloom.update(values)
+            self.probable += len(positions)
+            self.false_positives += len(values) * self.bloom.error_rate()
+            return positions
+
+        seen = self.values
+        batch = set(values)
+        if len(batch) == len(values) and seen.isdisjoint(batch):
+            seen |= batch
+            positions = []
+        else:
+            positions = []
+            for position, value in enumerate(values):
+                if value in seen:
+                    positions.append(position)
+                else:
+                    seen.add(value)
+            self.repeated += len(positions)
+
+        if len(seen) > self.exact_limit:
+            self.bloom = BloomFilter(self.bloom_capacity)
+            self.bloom.update(seen)
+            self.values = set()
+
+        return positions
+
+    def unexplained(self):
+        """
+        Returns:
+            int: The probable repeats beyond what false positives of the
+            Bloom filter explain, allowing three standard deviations above
+            their expected number.
+        """
+
+        allowed = self.false_positives + 3 * math.sqrt(self.false_positives)
+        return max(0, self.probable - int(allowed))
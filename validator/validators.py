@@ -1,5 +1,18 @@
+import re
+import time
+import random
+import decimal
+import datetime
+import operator
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
 from dataclasses import dataclass
+from functools import partial
+from operator import itemgetter
 from typing import List, Any
+import columnar
+import sketches
 
 
 @dataclass
@@ -7,100 +20,1257 @@ class TestResult:
     success: bool
     message: str
     erroneous_rows: List[Any] = None
+    violations: int = 0
+    sampled_rows: List[Any] = None
+    approximate: bool = False
 
 
-def row_count(result, expected_value):
+class Capture:
     """
-    Assert the number of returned rows.
+    Bounded capture of a check's offending rows: the total number of
+    violations, the first `samples` rows and, optionally, a uniform
+    reservoir sample of `reservoir` rows over all violations.
 
     Args:
-        result (list): Rows returned from the SQL query.
-        expected_value (int): The expected number of rows.
+        samples (int): Number of leading rows to keep, None for all of them.
+        reservoir (int): Size of the reservoir sample, 0 to disable it.
+    """
 
-    Returns:
-        TestResult: Object containing test result.
+    def __init__(self, samples=None, reservoir=0):
+        self.samples = samples
+        self.reservoir = reservoir
+        self.count = 0
+        self.rows = []
+        self.sampled = []
+        self.random = random.Random()
+
+    def add(self, row):
+        self.count += 1
+        if self.samples is None or len(self.rows) < self.samples:
+            self.rows.append(row)
+
+        if len(self.sampled) < self.reservoir:
+            self.sampled.append(row)
+        elif self.reservoir:
+            index = self.random.randrange(self.count)
+            if index < self.reservoir:
+                self.sampled[index] = row
+
+    def extend(self, rows):
+        if self.reservoir:
+            for row in rows:
+                self.add(row)
+            return
+
+        room = (len(rows) if self.samples is None
+                else self.samples - len(self.rows))
+        if room > 0:
+            self.rows.extend(rows[:room])
+        self.count += len(rows)
+
+    def extend_from(self, rows, positions):
+        """Add the rows at the positions, only taking the rows kept."""
+
+        if self.reservoir:
+            self.extend([rows[position] for position in positions])
+            return
+
+        room = (len(positions) if self.samples is None
+                else self.samples - len(self.rows))
+        if room > 0:
+            self.rows.extend(rows[position] for position in positions[:room])
+        self.count += len(positions)
+
+
+def _null(row):
+    return None
+
+
+class Check:
     """
+    Base class for validators that consume the result set in batches, so a
+    result can be validated without holding all of its rows in memory.
+
+    Column values are read through getters. Unbound checks look columns up
+    by attribute name; `bind` resolves them to positions once, so rows can
+    be indexed directly.
+
+    A check is `decided` once further rows can no longer change its
+    verdict, which lets callers stop fetching early. Checks that estimate
+    their verdict with sketches are `sketched`, and take the limits of the
+    exact evaluation as keyword arguments.
+    """
+
+    decided = False
+    exhausted = True
+    sketched = False
+    approximate = False
+
+    def __init__(self, columns=(), capture=None):
+        self.columns = list(columns)
+        self.capture = capture or Capture()
+        self.bind()
 
-    count = len(result)
-    if count != expected_value:
+    @staticmethod
+    def compile(assertion):
+        """
+        Prepare an assertion once per test. The compiled assertion is shared
+        by every run of the test, so it must not be modified.
+        """
+        if isinstance(assertion, list):
+            return [_freeze(rule) for rule in assertion]
+        return assertion
+
+    def bind(self, keys=None):
+        """Resolve the check's columns against the result's keys."""
+        self.getters = [self.getter(column, keys) for column in self.columns]
+
+    @staticmethod
+    def getter(column, keys=None):
+        if keys is None:
+            return lambda row: getattr(row, column, None)
+        if column in keys:
+            return itemgetter(keys.index(column))
+        return _null
+
+    def visit(self, row):
+        """Process a single row."""
+        raise NotImplementedError
+
+    def feed(self, rows):
+        """Process the next batch of rows."""
+        for row in rows:
+            self.visit(row)
+
+    def feed_columns(self, columns):
+        """Process the next batch of rows, as columnar.Columns."""
+        self.feed(columns.rows)
+
+    def capture_masks(self, columns, masks):
+        """Capture the rows hit by the masks, in row order."""
+        self.capture.extend_from(columns.rows, columnar.positions(masks))
+
+    def finish(self):
+        """Return the TestResult once every batch has been fed."""
+        raise NotImplementedError
+
+    def failure(self, message):
+        """A failed TestResult carrying the captured offending rows."""
         return TestResult(
             success=False,
-            message=f"Expected {expected_value}, got {count}",
-            erroneous_rows=result
+            message=message,
+            erroneous_rows=self.capture.rows,
+            violations=self.capture.count,
+            sampled_rows=self.capture.sampled or None,
+            approximate=self.approximate
         )
 
-    return TestResult(success=True, message="Row count matches expected value")
 
+class RowCount(Check):
+    """
+    Assert the number of returned rows.
 
-def has(result, rules):
+    Args:
+        expected_value (int): The expected number of rows.
+        capture (Capture): Capture of the rows reported on failure.
+    """
+
+    per_row = False
+
+    def __init__(self, expected_value, capture=None):
+        super().__init__(capture=capture)
+        self.expected_value = expected_value
+        self.count = 0
+
+    @property
+    def decided(self):
+        return self.count > self.expected_value
+
+    def feed(self, rows):
+        self.count += len(rows)
+        self.capture.extend(rows)
+
+    def finish(self):
+        if self.count != self.expected_value:
+            got = self.count if self.exhausted else f"at least {self.count}"
+            return self.failure(f"Expected {self.expected_value}, got {got}")
+
+        return TestResult(success=True,
+                          message="Row count matches expected value")
+
+
+class Has(Check):
     """
     Assert existence of specific values in the returned rows.
 
     Args:
-        result (list): Rows returned from the SQL query.
         rules (list): List of expected values in columns.
-
-    Returns:
-        TestResult: Object containing test result.
+        capture (Capture): Capture of the rows reported on failure.
     """
 
-    remaining_rules = []
-    erroneous_rows = []
+    per_row = True
 
-    for rule in rules:
-        rule['values'] = set(rule['values'])
+    def __init__(self, rules, capture=None):
+        super().__init__((rule['column'] for rule in rules), capture)
+        self.remaining = [set(rule['values']) for rule in rules]
 
-    for row in result:
-        for rule in rules:
-            col_val = getattr(row, rule['column'], None)
-            if col_val in rule['values']:
-                rule['values'].discard(col_val)
+    @property
+    def decided(self):
+        return not any(self.remaining)
+
+    def visit(self, row):
+        for getter, remaining in zip(self.getters, self.remaining):
+            col_val = getter(row)
+            if col_val in remaining:
+                remaining.discard(col_val)
             elif col_val is not None:
-                erroneous_rows.append(row)
+                self.capture.add(row)
+
+    def feed_columns(self, columns):
+        masks = []
+        for column, remaining in zip(self.columns, self.remaining):
+            values, nulls = columns.column(column)
+            offending = ~nulls
+
+            if remaining:
+                found = columnar.contains(values, remaining)
+                # The first row holding each remaining value, as the
+                # mapping keeps the last position of every value
+                first = dict(zip(reversed(values[found].tolist()),
+                                 reversed(found.nonzero()[0].tolist())))
+                remaining.difference_update(first)
+                offending[list(first.values())] = False
+
+            masks.append(offending)
+
+        self.capture_masks(columns, masks)
+
+    def finish(self):
+        remaining_rules = [{'column': column, 'values': remaining}
+                           for column, remaining
+                           in zip(self.columns, self.remaining) if remaining]
+
+        if remaining_rules:
+            return self.failure(
+                f"Expected values not found: {remaining_rules}")
+
+        return TestResult(success=True, message="All expected values found")
+
+
+class Forbidden:
+    """
+    The values and patterns a column must not contain, compiled once per
+    test. The patterns are combined into one alternation, so a value is
+    scanned once however many patterns there are; which patterns matched is
+    only worked out for the values that hit.
+
+    Patterns match anywhere in a value, like `re.search`, and only match
+    string values.
+
+    Args:
+        rule (dict): The `missing` rule, with its `column`, `values` and
+            optional `regex` patterns.
+
+    Raises:
+        re.error: If a pattern is not a valid regular expression.
+    """
+
+    def __init__(self, rule):
+        self.column = rule['column']
+        self.values = frozenset(rule.get('values') or ())
+        self.patterns = tuple(rule.get('regex') or ())
+        self.compiled = [re.compile(pattern) for pattern in self.patterns]
+        self.search = self.combine()
+
+    def combine(self):
+        """
+        Returns:
+            callable: Searches a value for any of the patterns, None without
+            patterns.
+        """
+
+        if not self.compiled:
+            return None
+        if len(self.compiled) == 1:
+            return self.compiled[0].search
+
+        # Groups of a pattern would renumber the groups that later patterns
+        # refer to, and global flags are only allowed at the start
+        if not any(pattern.groups for pattern in self.compiled[:-1]):
+            try:
+                return re.compile('|'.join(
+                    f"(?:{pattern})" for pattern in self.patterns)).search
+            except re.error:
+                pass
+
+        return lambda value: any(pattern.search(value)
+                                 for pattern in self.compiled)
+
+    def count(self, value, counts):
+        """
+        Count a value that hit the rule: whether it is listed, and every
+        pattern it matches.
+        """
+
+        counts[0] += value in self.values
+        if isinstance(value, str):
+            for index, pattern in enumerate(self.compiled, 1):
+                counts[index] += pattern.search(value) is not None
+
+    def describe(self, counts):
+        """
+        Describe the violations of the rule.
+
+        Args:
+            counts (list): Rows with listed values, followed by the rows
+                matching each pattern.
+
+        Returns:
+            list: A description of each part of the rule that was hit.
+        """
+
+        parts = [f"{self.column} in values", *(
+            f"{self.column} ~ {pattern!r}" for pattern in self.patterns)]
+        return [f"{part} ({count} rows)"
+                for part, count in zip(parts, counts) if count]
+
+
+class Missing(Check):
+    """
+    Assert that specific values do not exist in the returned result, and
+    that no value matches the rules' `regex` patterns.
+
+    Args:
+        rules (list): List of values that should not be present in columns.
+        capture (Capture): Capture of the rows reported on failure.
+    """
+
+    per_row = True
+
+    def __init__(self, rules, capture=None):
+        self.rules = [rule if isinstance(rule, Forbidden) else Forbidden(rule)
+                      for rule in rules]
+        self.counts = [[0] * (len(rule.patterns) + 1) for rule in self.rules]
+        super().__init__((rule.column for rule in self.rules), capture)
+
+    @staticmethod
+    def compile(rules):
+        return [Forbidden(rule) for rule in rules]
+
+    @property
+    def decided(self):
+        return self.capture.count > 0
+
+    def visit(self, row):
+        for getter, rule, counts in zip(self.getters, self.rules,
+                                        self.counts):
+            value = getter(row)
+            if value in rule.values or (rule.search is not None and
+                                        isinstance(value, str) and
+                                        rule.search(value)):
+                rule.count(value, counts)
+                self.capture.add(row)
+
+    def feed_columns(self, columns):
+        masks = []
+        for rule, counts in zip(self.rules, self.counts):
+            values, _ = columns.column(rule.column)
+            hits = columnar.contains(values, rule.values)
+            counts[0] += int(hits.sum())
+
+            if rule.compiled:
+                strings = columnar.strings(values)
+                texts = values[strings]
+                for index, pattern in enumerate(rule.compiled, 1):
+                    matches = columnar.searches(texts, pattern.search)
+                    counts[index] += int(matches.sum())
+                    hits[strings] |= matches
+
+            masks.append(hits)
 
-    remaining_rules = [rule for rule in rules if rule['values']]
+        self.capture_masks(columns, masks)
+
+    def finish(self):
+        if self.capture.count:
+            details = [detail for rule, counts in zip(self.rules, self.counts)
+                       for detail in rule.describe(counts)]
+            return self.failure(f"Unexpected values found: "
+                                f"{', '.join(details)}")
+
+        return TestResult(success=True, message="No unexpected values found")
+
+
+class NoNulls(Check):
+    """
+    Assert that no null values exist in the specified columns.
+
+    Args:
+        columns (list): List of columns that should not contain null values.
+        capture (Capture): Capture of the rows reported on failure.
+    """
+
+    per_row = True
+
+    @property
+    def decided(self):
+        return self.capture.count > 0
+
+    def visit(self, row):
+        for getter in self.getters:
+            if getter(row) is None:
+                self.capture.add(row)
+                break
+
+    def feed_columns(self, columns):
+        if self.columns:
+            nulls = [columns.column(column)[1] for column in self.columns]
+            self.capture_masks(columns, [columnar.any_of(nulls)])
+
+    def finish(self):
+        if self.capture.count:
+            return self.failure("Unexpected 'null' values found")
+
+        return TestResult(success=True,
+                          message="No null values found in specified columns")
+
+
+class OnlyNulls(Check):
+    """
+    Assert that only null values exist in the specified columns.
+
+    Args:
+        columns (list): List of columns that should only contain null values.
+        capture (Capture): Capture of the rows reported on failure.
+    """
+
+    per_row = True
+
+    @property
+    def decided(self):
+        return self.capture.count > 0
+
+    def visit(self, row):
+        for getter in self.getters:
+            if getter(row) is not None:
+                self.capture.add(row)
+                break
+
+    def feed_columns(self, columns):
+        if self.columns:
+            values = [~columns.column(column)[1] for column in self.columns]
+            self.capture_masks(columns, [columnar.any_of(values)])
+
+    def finish(self):
+        if self.capture.count:
+            return self.failure("Unexpected non-null values found")
 
-    if remaining_rules:
         return TestResult(
-            success=False,
-            message=f"Expected values not found: {remaining_rules}",
-            erroneous_rows=erroneous_rows
-        )
+            success=True,
+            message="Only null values found in specified columns")
 
-    return TestResult(success=True, message="All expected values found")
 
+def _like(pattern):
+    """Translate a SQL LIKE pattern into a regular expression."""
 
-def missing(result, rules):
+    parts = []
+    characters = iter(pattern)
+    for character in characters:
+        if character == '%':
+            parts.append('.*')
+        elif character == '_':
+            parts.append('.')
+        elif character == '\\':
+            parts.append(re.escape(next(characters, '\\')))
+        else:
+            parts.append(re.escape(character))
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        # Compare integer columns with fractional values exactly
+        return decimal.Decimal(value)
+
+
+def _to_datetime(value, sample):
+    if not isinstance(value, datetime.datetime):
+        if isinstance(value, datetime.date):
+            value = datetime.datetime(value.year, value.month, value.day)
+        else:
+            value = datetime.datetime.fromisoformat(str(value))
+    if value.tzinfo is None and sample.tzinfo is not None:
+        value = value.replace(tzinfo=sample.tzinfo)
+    return value
+
+
+def _to_date(value, sample):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+
+# Conversions of condition values to the type of the column's values, looked
+# up by exact type first like the JSON encoders
+COERCIONS = {
+    bool: lambda value, sample: (
+        value if isinstance(value, bool)
+        else str(value).lower() in ('true', 't', 'yes', 'y', '1')),
+    int: lambda value, sample: (
+        value if isinstance(value, (int, float, decimal.Decimal))
+        else _to_int(str(value))),
+    float: lambda value, sample: (
+        value if isinstance(value, (int, float))
+        else float(str(value))),
+    decimal.Decimal: lambda value, sample: (
+        value if isinstance(value, (int, decimal.Decimal))
+        else decimal.Decimal(str(value))),
+    datetime.datetime: _to_datetime,
+    datetime.date: _to_date,
+    datetime.time: lambda value, sample: (
+        value if isinstance(value, datetime.time)
+        else datetime.time.fromisoformat(str(value))),
+    str: lambda value, sample: value if isinstance(value, str) else str(value)
+}
+
+
+def coerce(value, sample):
     """
-    Assert that specific values do not exist in the returned result.
+    Convert a value of a condition to the type of a column's values.
+
+    Args:
+        value: The value from the test definition.
+        sample: A non-null value of the column.
+
+    Returns:
+        The converted value, or the value itself for other column types.
+
+    Raises:
+        ValueError: If the value can't be converted.
+    """
+
+    coercion = COERCIONS.get(type(sample))
+    if coercion is None:
+        for sample_type, type_coercion in COERCIONS.items():
+            if isinstance(sample, sample_type):
+                coercion = type_coercion
+                break
+        else:
+            return value
+    return coercion(value, sample)
+
+
+class Predicate:
+    """
+    A condition on a column, parsed once per test. `bind` turns it into a
+    test of single values, with the condition's value converted to the
+    column's type up front.
+
+    Null values satisfy every condition, like in a SQL CHECK constraint;
+    `no_nulls` asserts that there are none.
+
+    Args:
+        rule (dict): The condition, with its `column`, `operator` and
+            `value`. `between` takes a list of the lower and upper bound,
+            `in` a list of values.
+
+    Raises:
+        ValueError: If the operator is unknown or the value doesn't suit it.
+    """
+
+    OPERATORS = {
+        '=': lambda value: partial(operator.eq, value),
+        '!=': lambda value: partial(operator.ne, value),
+        '<>': lambda value: partial(operator.ne, value),
+        # The partial passes the condition's value as the first operand
+        '<': lambda value: partial(operator.gt, value),
+        '<=': lambda value: partial(operator.ge, value),
+        '>': lambda value: partial(operator.lt, value),
+        '>=': lambda value: partial(operator.le, value),
+        'between': lambda value: lambda x: value[0] <= x <= value[1],
+        'not between': lambda value: lambda x: not value[0] <= x <= value[1],
+        'in': lambda value: frozenset(value).__contains__,
+        'not in': lambda value: lambda x, values=frozenset(value): (
+            x not in values),
+        'like': lambda value: lambda x, match=_like(value).fullmatch: (
+            match(x if isinstance(x, str) else str(x)) is not None),
+        'not like': lambda value: lambda x, match=_like(value).fullmatch: (
+            match(x if isinstance(x, str) else str(x)) is None)
+    }
+
+    LIST_OPERATORS = {'between', 'not between', 'in', 'not in'}
+
+    def __init__(self, rule):
+        self.column = rule['column']
+        self.operator = rule['operator'].strip().lower()
+        self.value = rule['value']
+        self.converted = {}
+        self.tests = {}
+
+        if self.operator not in self.OPERATORS:
+            raise ValueError(f"Unknown operator '{rule['operator']}' in "
+                             f"condition on '{self.column}'")
+
+        is_list = isinstance(self.value, (list, tuple))
+        if self.operator in self.LIST_OPERATORS:
+            if not is_list:
+                raise ValueError(f"Operator '{self.operator}' expects a "
+                                 f"list of values")
+            if 'between' in self.operator and len(self.value) != 2:
+                raise ValueError(f"Operator '{self.operator}' expects a "
+                                 f"lower and an upper bound")
+            self.value = tuple(self.value)
+        elif is_list:
+            raise ValueError(f"Operator '{self.operator}' expects a single "
+                             f"value")
+
+    def convert(self, sample):
+        """
+        Returns:
+            The condition's value converted to the type of the column's
+            values. Converted once per column type.
+        """
+
+        key = type(sample)
+        if key in self.converted:
+            return self.converted[key]
+
+        if self.operator in ('like', 'not like'):
+            value = str(self.value)
+        else:
+            try:
+                value = (tuple(coerce(value, sample) for value in self.value)
+                         if isinstance(self.value, tuple)
+                         else coerce(self.value, sample))
+            except (ValueError, decimal.InvalidOperation) as e:
+                raise ValueError(f"Cannot compare column '{self.column}' "
+                                 f"with {self.value!r}: {e}") from None
+        return self.converted.setdefault(key, value)
+
+    def bind(self, sample):
+        """
+        Returns:
+            callable: Tests whether a non-null value of the column's type
+            satisfies the condition. Built once per column type.
+        """
+
+        key = type(sample)
+        test = self.tests.get(key)
+        if test is None:
+            test = self.tests.setdefault(key, self.OPERATORS[self.operator](
+                self.convert(sample)))
+        return test
+
+    def __str__(self):
+        value = (f"{self.value[0]!r} and {self.value[1]!r}"
+                 if 'between' in self.operator else repr(self.value))
+        return f"{self.column} {self.operator} {value}"
+
+
+class Conditions(Check):
+    """
+    Assert that every row satisfies all conditions. Conditions are evaluated
+    column by column over whole batches.
+
+    Args:
+        predicates (list): The compiled conditions.
+        capture (Capture): Capture of the rows reported on failure.
+    """
+
+    per_row = False
+
+    def __init__(self, predicates, capture=None):
+        self.predicates = predicates
+        self.samples = [None] * len(predicates)
+        self.tests = [None] * len(predicates)
+        self.violations = [0] * len(predicates)
+        super().__init__((predicate.column for predicate in predicates),
+                         capture)
+
+    @staticmethod
+    def compile(rules):
+        return [Predicate(rule) for rule in rules]
+
+    @property
+    def decided(self):
+        return self.capture.count > 0
+
+    def feed(self, rows):
+        failing = set()
+
+        for index, getter in enumerate(self.getters):
+            values = list(map(getter, rows))
+
+            test = self.tests[index]
+            if test is None:
+                sample = next((value for value in values
+                               if value is not None), None)
+                if sample is None:
+                    continue
+                self.samples[index] = sample
+                test = self.tests[index] = self.predicates[index].bind(sample)
+
+            failed = [position for position, value in enumerate(values)
+                      if value is not None and not test(value)]
+            if failed:
+                self.violations[index] += len(failed)
+                failing.update(failed)
+
+        if failing:
+            self.capture.extend([rows[position]
+                                 for position in sorted(failing)])
+
+    def feed_columns(self, columns):
+        failing = []
+
+        for index, predicate in enumerate(self.predicates):
+            values, nulls = columns.column(predicate.column)
+            present = ~nulls
+            if not present.any():
+                continue
+
+            values = values[present]
+            if self.samples[index] is None:
+                self.samples[index] = values[0]
+            failed = present.copy()
+            failed[present] = ~columnar.satisfies(predicate, values,
+                                                  self.samples[index])
+            self.violations[index] += int(failed.sum())
+            failing.append(failed)
+
+        if failing:
+            self.capture_masks(columns, [columnar.any_of(failing)])
+
+    def finish(self):
+        if self.capture.count:
+            failed = [f"{predicate} ({violations} rows)"
+                      for predicate, violations
+                      in zip(self.predicates, self.violations) if violations]
+            return self.failure(f"Rows not matching conditions: "
+                                f"{', '.join(failed)}")
+
+        return TestResult(success=True, message="All rows match conditions")
+
+
+def _key_name(key):
+    return key[0] if len(key) == 1 else f"({', '.join(key)})"
+
+
+class Unique(Check):
+    """
+    Assert that the values of columns, or of groups of columns, are unique.
+    Rows with a null value in a key are skipped, like in a SQL UNIQUE
+    constraint.
+
+    Values are held exactly up to `exact_limit` distinct values per key,
+    then in a Bloom filter, after which repeats are only probable and the
+    verdict is approximate.
+
+    Args:
+        keys (list): The columns, or lists of columns, that must be unique.
+        capture (Capture): Capture of the rows reported on failure.
+        exact_limit (int): Distinct values per key held exactly.
+        bloom_capacity (int): Values the Bloom filter of a key is sized for.
+    """
+
+    per_row = False
+    sketched = True
+
+    def __init__(self, keys, capture=None, exact_limit=sketches.EXACT_LIMIT,
+                 bloom_capacity=sketches.BLOOM_CAPACITY):
+        self.keys = [tuple(key) if isinstance(key, (list, tuple)) else (key,)
+                     for key in keys]
+        self.seen = [sketches.UniqueValues(exact_limit, bloom_capacity)
+                     for _ in self.keys]
+        super().__init__((column for key in self.keys for column in key),
+                         capture)
+
+    @staticmethod
+    def compile(keys):
+        return [tuple(key) if isinstance(key, list) else key for key in keys]
+
+    @property
+    def decided(self):
+        return any(seen.repeated for seen in self.seen)
+
+    @property
+    def approximate(self):
+        return not all(seen.exact for seen in self.seen)
+
+    def feed(self, rows):
+        repeated = set()
+        getters = iter(self.getters)
+
+        for key, seen in zip(self.keys, self.seen):
+            if len(key) == 1:
+                values = list(map(next(getters), rows))
+            else:
+                values = [None if None in value else value for value in
+                          zip(*(map(next(getters), rows) for _ in key))]
+
+            if None in values:
+                positions = [position for position, value
+                             in enumerate(values) if value is not None]
+                repeated.update(positions[position] for position in
+                                seen.repeats([values[position]
+                                              for position in positions]))
+            else:
+                repeated.update(seen.repeats(values))
+
+        if repeated:
+            self.capture.extend([rows[position]
+                                 for position in sorted(repeated)])
+
+    def finish(self):
+        details = []
+        for key, seen in zip(self.keys, self.seen):
+            if seen.repeated or seen.unexplained():
+                details.append(
+                    f"{_key_name(key)} ({seen.repeated} rows)" if seen.exact
+                    else f"{_key_name(key)} (about "
+                         f"{seen.repeated + seen.probable} rows, approximate)")
+
+        if details:
+            return self.failure(f"Duplicate values found: "
+                                f"{', '.join(details)}")
+
+        return TestResult(success=True,
+                          message="All values are unique" + (
+                              " (approximate)" if self.approximate else ""),
+                          approximate=self.approximate)
+
+
+def _bounds(rule):
+    if rule.get('min') is not None and rule.get('max') is not None:
+        return f"between {rule['min']} and {rule['max']}"
+    if rule.get('min') is not None:
+        return f"at least {rule['min']}"
+    return f"at most {rule['max']}"
+
+
+class Cardinality(Check):
+    """
+    Base class for assertions on the number of distinct non-null values of
+    columns, within a rule's `min` and `max`. Values are counted exactly up
+    to `exact_limit` distinct values per column, then estimated with a
+    HyperLogLog sketch, which makes the verdict approximate.
+
+    Args:
+        rules (list): The columns with their bounds.
+        capture (Capture): Capture of the rows reported on failure.
+        exact_limit (int): Distinct values per column counted exactly.
+        bloom_capacity (int): Unused, as no repeats are looked for.
+    """
+
+    per_row = False
+    sketched = True
+    label = None
+
+    def __init__(self, rules, capture=None, exact_limit=sketches.EXACT_LIMIT,
+                 bloom_capacity=sketches.BLOOM_CAPACITY):
+        self.rules = rules
+        self.distinct = [sketches.DistinctValues(exact_limit) for _ in rules]
+        self.present = [0] * len(rules)
+        super().__init__((rule['column'] for rule in rules), capture)
+
+    @property
+    def approximate(self):
+        return not all(distinct.exact for distinct in self.distinct)
+
+    def feed(self, rows):
+        for index, (getter, distinct) in enumerate(zip(self.getters,
+                                                       self.distinct)):
+            values = list(map(getter, rows))
+            self.present[index] += len(values) - values.count(None)
+            distinct.update(values)
+
+    def measure(self, index):
+        """The measured value of a rule, None if there is none."""
+        raise NotImplementedError
+
+    def describe(self, value):
+        raise NotImplementedError
+
+    def finish(self):
+        details = []
+        for index, rule in enumerate(self.rules):
+            value = self.measure(index)
+            if value is None:
+                continue
+            if ((rule.get('min') is not None and value < rule['min']) or
+                    (rule.get('max') is not None and value > rule['max'])):
+                distinct = self.distinct[index]
+                measured = (self.describe(value) if distinct.exact else
+                            f"about {self.describe(value)} "
+                            f"(±{distinct.error:.1%}, approximate)")
+                details.append(f"{rule['column']}: {measured}, expected "
+                               f"{_bounds(rule)}")
+
+        if details:
+            return self.failure(f"{self.label} out of range: "
+                                f"{', '.join(details)}")
+
+        return TestResult(success=True,
+                          message=f"{self.label} within range" + (
+                              " (approximate)" if self.approximate else ""),
+                          approximate=self.approximate)
+
+
+class DistinctCount(Cardinality):
+    """
+    Assert the number of distinct non-null values of columns.
+
+    Args:
+        rules (list): The columns with the `min` and `max` number of
+            distinct values.
+        capture (Capture): Capture of the rows reported on failure.
+        exact_limit (int): Distinct values per column counted exactly.
+        bloom_capacity (int): Unused, as no repeats are looked for.
+    """
+
+    label = "Distinct values"
+
+    @property
+    def decided(self):
+        # Exact counts only grow, so a count above the maximum is final
+        return any(distinct.exact and rule.get('max') is not None and
+                   len(distinct.values) > rule['max']
+                   for rule, distinct in zip(self.rules, self.distinct))
+
+    def measure(self, index):
+        # An estimate can't exceed the number of values it was made from
+        return min(self.distinct[index].count(), self.present[index])
+
+    def describe(self, value):
+        return str(value)
+
+
+class DistinctRatio(Cardinality):
+    """
+    Assert the ratio of distinct values to non-null values of columns, 1.0
+    for a column without repeated values. Columns without non-null values
+    have no ratio and satisfy any bounds.
+
+    Args:
+        rules (list): The columns with the `min` and `max` ratio.
+        capture (Capture): Capture of the rows reported on failure.
+        exact_limit (int): Distinct values per column counted exactly.
+        bloom_capacity (int): Unused, as no repeats are looked for.
+    """
+
+    label = "Distinct ratio"
+
+    def measure(self, index):
+        if not self.present[index]:
+            return None
+        return min(self.distinct[index].count() / self.present[index], 1.0)
+
+    def describe(self, value):
+        return f"{value:.4g}"
+
+
+ASSERTIONS = {
+    'count': RowCount,
+    'has': Has,
+    'missing': Missing,
+    'no_nulls': NoNulls,
+    'only_nulls': OnlyNulls,
+    'conditions': Conditions,
+    'unique': Unique,
+    'distinct_count': DistinctCount,
+    'distinct_ratio': DistinctRatio
+}
+
+
+class AssertionPlan:
+    """
+    A test's assertions compiled into a plan that evaluates all of them in
+    a single pass over the rows. The plan holds no per-run state and never
+    modifies the assertions it was compiled from, so it can be reused for
+    every run of the test.
+
+    Args:
+        assertions (dict): Dictionary of assertions to apply to the result set.
+    """
+
+    def __init__(self, assertions):
+        self.specs = []
+        self.unknown = []
+
+        for key, assertion in assertions.items():
+            if key not in ASSERTIONS:
+                self.unknown.append(key)
+            else:
+                self.specs.append((key, ASSERTIONS[key].compile(assertion)))
+
+    def start(self, keys=None, samples=None, reservoir=0,
+              columnar_threshold=0, sketch=None):
+        """
+        Start evaluating the plan against a result.
+
+        Args:
+            keys (list): Column names of the result. Rows are then indexed by
+                position; without keys, columns are read as attributes.
+            samples (int): Offending rows kept per assertion, None for all.
+            reservoir (int): Size of the reservoir sample per assertion.
+            columnar_threshold (int): Batches of at least this many rows are
+                evaluated column by column with NumPy, if it is installed and
+                the result has keys. 0 disables it.
+            sketch (dict): Limits of the exact evaluation of sketched
+                assertions, with the `exact_limit` and `bloom_capacity`.
+
+        Returns:
+            Evaluation: The per-run state of the plan.
+        """
+
+        checks = []
+        for key, assertion in self.specs:
+            check_class = ASSERTIONS[key]
+            options = (sketch or {}) if check_class.sketched else {}
+            check = check_class(assertion, Capture(samples, reservoir),
+                                **options)
+            if keys is not None:
+                check.bind(list(keys))
+            checks.append((key, check))
+
+        return Evaluation(checks, self.unknown, keys, columnar_threshold)
+
+
+# Rows of the first batch used to estimate the size of the fetched rows
+SIZE_SAMPLE = 100
+
+
+def estimate_row_size(rows):
+    """
+    Estimate the average size of the rows in bytes from their values:
+    strings and binary values by their length, other values as 8 bytes.
+
+    Returns:
+        float: The estimated size, 0 for rows that are not sequences.
+    """
+
+    sample = rows[:SIZE_SAMPLE]
+    if not sample or not isinstance(sample[0], Sequence):
+        return 0.0
+
+    size = 0
+    for row in sample:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray, memoryview)):
+                size += len(value)
+            elif value is not None:
+                size += 8
+    return size / len(sample)
+
+
+class Evaluation:
+    """
+    Per-run state of an AssertionPlan. Also counts the rows fed to it, their
+    estimated size and the time spent evaluating them.
+    """
+
+    def __init__(self, checks, unknown=(), keys=None, columnar_threshold=0):
+        self.checks = checks
+        self.unknown = unknown
+        self.keys = keys
+        self.columnar_threshold = (columnar_threshold
+                                   if keys is not None and
+                                   columnar.available() else 0)
+        self.short_circuited = False
+        self.batch_checks = [check for _, check in checks
+                             if not check.per_row]
+        self.visitors = [check.visit for _, check in checks if check.per_row]
+        self.rows = 0
+        self.row_size = 0.0
+        self.elapsed = 0.0
+
+    def columnar(self, rows):
+        """Whether the batch is evaluated column by column."""
+        return bool(self.columnar_threshold and
+                    len(rows) >= self.columnar_threshold)
+
+    def feed(self, rows, columns=None):
+        """
+        Process the next batch of rows in a single pass, or column by column
+        if the batch is large enough.
+
+        Args:
+            rows (list): The batch of rows.
+            columns (Columns): The batch's columns, to share them with the
+                evaluations of other tests.
+        """
+
+        start_time = time.perf_counter()
+
+        if columns is None and self.columnar(rows):
+            columns = columnar.Columns(rows, self.keys)
+
+        if columns is not None:
+            for _, check in self.checks:
+                check.feed_columns(columns)
+        else:
+            for check in self.batch_checks:
+                check.feed(rows)
+
+            visitors = self.visitors
+            for row in rows:
+                for visit in visitors:
+                    visit(row)
+
+        if not self.rows:
+            self.row_size = estimate_row_size(rows)
+        self.rows += len(rows)
+        self.elapsed += time.perf_counter() - start_time
+
+    @property
+    def bytes(self):
+        """Estimated size of the rows fed to the evaluation in bytes."""
+        return int(self.row_size * self.rows)
+
+    @property
+    def decided(self):
+        """Whether every assertion has reached its final verdict."""
+        return all(check.decided for _, check in self.checks)
+
+    def stop(self):
+        """Mark the evaluation as ended before the result was exhausted."""
+
+        self.short_circuited = True
+        for _, check in self.checks:
+            check.exhausted = False
+
+    @property
+    def approximate(self):
+        """Assertions whose verdict was estimated with sketches."""
+        return [key for key, check in self.checks if check.approximate]
+
+    def failures(self):
+        """
+        Returns:
+            list: List of (key, TestResult) tuples for failed assertions.
+        """
+
+        failed_assertions = []
+
+        for key, check in self.checks:
+            result = check.finish()
+            if not result.success:
+                failed_assertions.append((key, result))
+
+        for key in self.unknown:
+            failed_assertions.append(
+                (key, TestResult(False, f"Unknown assertion '{key}'")))
+
+        return failed_assertions
+
+
+def feed_shared(evaluations, rows):
+    """
+    Feed a batch of rows to the evaluations of the tests sharing a query.
+    If the batch is evaluated column by column, its columns are built once
+    for all of them.
+    """
+
+    columns = (columnar.Columns(rows, evaluations[0].keys)
+               if evaluations and evaluations[0].columnar(rows) else None)
+    for evaluation in evaluations:
+        evaluation.feed(rows, columns)
+
+
+def _freeze(rule):
+    if isinstance(rule, dict):
+        return {key: tuple(value) if isinstance(value, list) else value
+                for key, value in rule.items()}
+    return rule
+
+
+# Plans compiled recently, by the repr of their assertions. The daemon
+# compiles the assertions of every edited test again, so the least recently
+# used plans are evicted
+MAX_PLANS = 1024
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def compile_assertions(assertions):
+    """
+    Compile assertions into an AssertionPlan, reusing the plan compiled for
+    identical assertions before.
+
+    Args:
+        assertions (dict): Dictionary of assertions to apply to the result set.
+
+    Returns:
+        AssertionPlan: The compiled plan.
+    """
+
+    key = repr(assertions)
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+
+    plan = AssertionPlan(assertions)
+    with _plans_lock:
+        plan = _plans.setdefault(key, plan)
+        _plans.move_to_end(key)
+        if len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def _evaluate(check, result):
+    check.feed(result)
+    return check.finish()
+
+
+def row_count(result, expected_value):
+    """
+    Assert the number of returned rows.
 
     Args:
         result (list): Rows returned from the SQL query.
-        rules (list): List of values that should not be present in columns.
+        expected_value (int): The expected number of rows.
+
+    Returns:
+        TestResult: Object containing test result.
+    """
+
+    return _evaluate(RowCount(expected_value), result)
+
+
+def has(result, rules):
+    """
+    Assert existence of specific values in the returned rows.
+
+    Args:
+        result (list): Rows returned from the SQL query.
+        rules (list): List of expected values in columns.
 
     Returns:
         TestResult: Object containing test result.
     """
 
-    erroneous_rows = []
+    return _evaluate(Has(rules), result)
 
-    for rule in rules:
-        rule['values'] = set(rule['values'])
 
-    for row in result:
-        for rule in rules:
-            col_val = getattr(row, rule['column'], None)
-            if col_val in rule['values']:
-                erroneous_rows.append(row)
+def missing(result, rules):
+    """
+    Assert that specific values do not exist in the returned result.
 
-    if erroneous_rows:
-        return TestResult(
-            success=False,
-            message="Unexpected values found",
-            erroneous_rows=erroneous_rows
-        )
+    Args:
+        result (list): Rows returned from the SQL query.
+        rules (list): List of values that should not be present in columns.
 
-    return TestResult(success=True, message="No unexpected values found")
+    Returns:
+        TestResult: Object containing test result.
+    """
+
+    return _evaluate(Missing(rules), result)
 
 
 def no_nulls(result, columns):
@@ -115,23 +1285,7 @@ def no_nulls(result, columns):
         TestResult: Object containing test result.
     """
 
-    erroneous_rows = []
-
-    for row in result:
-        for column in columns:
-            col_val = getattr(row, column, None)
-            if col_val is None:
-                erroneous_rows.append(row)
-                break
-
-    if erroneous_rows:
-        return TestResult(
-            success=False,
-            message="Unexpected 'null' values found",
-            erroneous_rows=erroneous_rows
-        )
-
-    return TestResult(success=True, message="No null values found in specified columns")
+    return _evaluate(NoNulls(columns), result)
 
 
 def only_nulls(result, columns):
@@ -146,20 +1300,19 @@ def only_nulls(result, columns):
         TestResult: Object containing test result.
     """
 
-    erroneous_rows = []
+    return _evaluate(OnlyNulls(columns), result)
 
-    for row in result:
-        for column in columns:
-            col_val = getattr(row, column, None)
-            if col_val is not None:
-                erroneous_rows.append(row)
-                break
 
-    if erroneous_rows:
-        return TestResult(
-            success=False,
-            message="Unexpected non-null values found",
-            erroneous_rows=erroneous_rows
-        )
+def conditions(result, rules):
+    """
+    Assert that every row satisfies all conditions.
+
+    Args:
+        result (list): Rows returned from the SQL query.
+        rules (list): List of conditions with a column, operator and value.
+
+    Returns:
+        TestResult: Object containing test result.
+    """
 
-    return TestResult(success=True, message="Only null values found in specified columns")
+    return _evaluate(Conditions(Conditions.compile(rules)), result)
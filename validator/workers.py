@@ -0,0 +1,395 @@
+import queue
+import pickle
+import operator
+import threading
+import multiprocessing
+from array import array
+from itertools import accumulate, repeat
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import validators
+
+# Rows from which a result fetched as a whole is handed to a worker process,
+# as smaller results cost more to transfer than to evaluate in the thread
+MIN_ROWS = 10_000
+
+# Rows per transferred batch of a result fetched as a whole
+TRANSFER_ROWS = 10_000
+
+# Shared memory blocks per test, so that the next batch is fetched and
+# encoded while the worker evaluates the previous one
+SLOTS = 2
+
+# Seconds between checks whether a worker failed while waiting for it
+REPLY_POLL = 0.5
+
+# The process pool and the manager serving the queues of the running tests,
+# started on first use
+_pool = None
+_manager = None
+_lock = threading.Lock()
+
+
+def executor(processes):
+    """
+    Returns:
+        tuple: The process pool, started on first use, and the manager
+        serving the queues between the threads and the workers.
+    """
+
+    global _pool, _manager
+
+    with _lock:
+        if _pool is None:
+            # Forking a process that runs threads can copy held locks
+            context = multiprocessing.get_context('spawn')
+            _manager = context.Manager()
+            _pool = ProcessPoolExecutor(max_workers=processes,
+                                        mp_context=context)
+        return _pool, _manager
+
+
+def shutdown():
+    """Stop the worker processes, if they were started."""
+
+    global _pool, _manager
+
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _manager.shutdown()
+            _pool = _manager = None
+
+
+def encode_column(values):
+    """
+    Encode a column compactly: integers and floats as 64-bit arrays, text as
+    UTF-8 with the offset of every value, other types pickled. Null values
+    are marked in a mask of one byte per row.
+
+    Returns:
+        tuple: The column's kind, whether it has a null mask, and its parts,
+        written to shared memory one after another.
+    """
+
+    types = set(map(type, values))
+    nulls = type(None) in types
+    types.discard(type(None))
+    parts = [bytes(map(operator.is_, values, repeat(None)))] if nulls else []
+
+    if not types:
+        return 'null', nulls, parts
+
+    if len(types) == 1:
+        kind = types.pop()
+        try:
+            if kind is int or kind is float:
+                if nulls:
+                    values = [0 if value is None else value
+                              for value in values]
+                return (kind.__name__, nulls,
+                        parts + [array('q' if kind is int else 'd', values)])
+
+            if kind is str:
+                encoded = [('' if value is None else value).encode()
+                           for value in values]
+                offsets = array('q', accumulate(map(len, encoded), initial=0))
+                return 'str', nulls, parts + [offsets, b''.join(encoded)]
+        except (OverflowError, UnicodeEncodeError):
+            pass
+
+    return 'object', False, [pickle.dumps(values, pickle.HIGHEST_PROTOCOL)]
+
+
+def decode_column(buffer, kind, nulls, sizes, count):
+    """
+    Decode a column encoded by `encode_column` from its parts in the buffer.
+
+    Returns:
+        list: The column's values.
+    """
+
+    parts = []
+    offset = 0
+    for size in sizes:
+        parts.append(buffer[offset:offset + size])
+        offset += size
+
+    mask = parts.pop(0) if nulls else None
+
+    if kind == 'null':
+        return [None] * count
+    if kind == 'int':
+        values = parts[0].cast('q').tolist()
+    elif kind == 'float':
+        values = parts[0].cast('d').tolist()
+    elif kind == 'str':
+        offsets = parts[0].cast('q').tolist()
+        blob = bytes(parts[1])
+        if blob.isascii():
+            # Byte offsets are character offsets, so the text is decoded
+            # once and sliced
+            text = blob.decode('ascii')
+            values = [text[start:end]
+                      for start, end in zip(offsets, offsets[1:])]
+        else:
+            values = [blob[start:end].decode()
+                      for start, end in zip(offsets, offsets[1:])]
+    else:
+        return pickle.loads(parts[0])
+
+    if mask is not None:
+        values = [None if null else value
+                  for value, null in zip(values, bytes(mask))]
+    return values
+
+
+def encode_batch(rows, width):
+    """
+    Encode a batch of rows column by column.
+
+    Returns:
+        tuple: The header describing the batch, and the parts of all columns
+        as byte views.
+    """
+
+    columns = list(zip(*rows)) if rows else [()] * width
+    header = []
+    parts = []
+
+    for values in columns:
+        kind, nulls, column_parts = encode_column(values)
+        views = [memoryview(part).cast('B') for part in column_parts]
+        header.append((kind, nulls, [view.nbytes for view in views]))
+        parts.extend(views)
+
+    return (len(rows), header), parts
+
+
+def decode_batch(buffer, header):
+    """
+    Returns:
+        list: The rows of a batch encoded by `encode_batch`, as tuples.
+    """
+
+    count, columns = header
+    values = []
+    offset = 0
+
+    for kind, nulls, sizes in columns:
+        size = sum(sizes)
+        values.append(decode_column(buffer[offset:offset + size], kind,
+                                    nulls, sizes, count))
+        offset += size
+
+    return list(zip(*values)) if values else [()] * count
+
+
+class Slot:
+    """
+    A shared memory block batches are written to, grown when a batch does
+    not fit. It is owned, and unlinked, by the thread fetching the rows.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.block = None
+
+    def write(self, parts):
+        """
+        Returns:
+            str: The name of the block holding the parts.
+        """
+
+        size = sum(part.nbytes for part in parts)
+        if self.block is None or self.block.size < size:
+            previous = self.block.size if self.block is not None else 0
+            self.release()
+            self.block = shared_memory.SharedMemory(
+                create=True, size=max(size, 2 * previous, 1))
+
+        offset = 0
+        for part in parts:
+            self.block.buf[offset:offset + part.nbytes] = part
+            offset += part.nbytes
+        return self.block.name
+
+    def release(self):
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+
+class Outcome:
+    """
+    The verdict of an Evaluation run in a worker process, read like the
+    Evaluation itself by `runner.build_result`.
+    """
+
+    def __init__(self, evaluation):
+        self.failed = evaluation.failures()
+        self.decided = evaluation.decided
+        self.short_circuited = evaluation.short_circuited
+        self.rows = evaluation.rows
+        self.bytes = evaluation.bytes
+        self.elapsed = evaluation.elapsed
+        self.approximate = evaluation.approximate
+
+    def failures(self):
+        return self.failed
+
+    def stop(self):
+        self.short_circuited = True
+
+
+def evaluate_batches(requests, replies, checks, keys, columnar_threshold,
+                     sketch, limit):
+    """
+    Evaluate the assertions of the tests sharing a query in a worker
+    process, on the batches the fetching thread announces on `requests`.
+    Every batch is acknowledged on `replies` once its block can be reused,
+    with whether every assertion has reached its verdict. Decided tests
+    are stopped like `runner.stop_at_limit` when the result reached the
+    statement's row `limit`.
+
+    Returns:
+        list: The Outcome of each test, in order.
+    """
+
+    evaluations = [validators.compile_assertions(assertions).start(
+        keys, columnar_threshold=columnar_threshold, sketch=sketch,
+        **(capture or {}))
+        for assertions, capture in checks]
+    blocks = {}
+
+    try:
+        while True:
+            request = requests.get()
+            if request[0] == 'end':
+                short_circuited = request[1]
+                break
+
+            _, slot, name, header = request
+            block = blocks.get(name)
+            if block is None:
+                # Workers share the resource tracker of the process that
+                # started them, which forgets the block once it is unlinked
+                block = blocks[name] = shared_memory.SharedMemory(name=name)
+
+            rows = decode_batch(block.buf, header)
+            validators.feed_shared(evaluations, rows)
+            replies.put((slot, all(evaluation.decided
+                                   for evaluation in evaluations)))
+    finally:
+        for block in blocks.values():
+            block.close()
+
+    limited = bool(limit) and evaluations[0].rows >= limit
+    for evaluation in evaluations:
+        if short_circuited or (limited and evaluation.decided):
+            evaluation.stop()
+
+    return [Outcome(evaluation) for evaluation in evaluations]
+
+
+class Record(tuple):
+    """A row evaluated in a worker process, read like a SQLAlchemy Row."""
+
+    def __new__(cls, values, keys):
+        record = super().__new__(cls, values)
+        record.keys = keys
+        return record
+
+    @property
+    def _mapping(self):
+        return dict(zip(self.keys, self))
+
+
+def _records(rows, keys):
+    return [Record(row, keys) for row in rows] if rows else rows
+
+
+def _reply(replies, future):
+    """Wait for the next acknowledged batch, unless the worker failed."""
+
+    while True:
+        try:
+            return replies.get(timeout=REPLY_POLL)
+        except queue.Empty:
+            if future.done():
+                # Raises the worker's error
+                future.result()
+                raise RuntimeError("Assertion worker stopped early")
+
+
+def run_shared_assertions(batches, checks, keys, plan, short_circuit=False,
+                          limit=None):
+    """
+    Run the assertions of several tests on one result in a worker process,
+    like `runner.run_shared_assertions`, while the calling thread goes on
+    fetching. Batches are handed over through shared memory, encoded column
+    by column.
+
+    Args:
+        batches (iterable): The result's batches of rows.
+        checks (list): List of (assertions, capture) tuples, one per test.
+        keys (list): Column names of the result.
+        plan (dict): Execution plan of the first test.
+        short_circuit (bool): Stop consuming batches once every assertion
+            has reached its final verdict.
+        limit (int): Row limit of the statement, if any.
+
+    Returns:
+        list: The Outcome of each test, in order.
+    """
+
+    pool, manager = executor(plan['processes'])
+    keys = list(keys)
+    requests, replies = manager.Queue(), manager.Queue()
+    slots = [Slot(index) for index in range(SLOTS)]
+    free = list(slots)
+    short_circuited = False
+
+    future = pool.submit(evaluate_batches, requests, replies, checks, keys,
+                         plan['columnar_threshold'], plan['sketch'], limit)
+    try:
+        for batch in batches:
+            # Replies already in are taken without waiting, so that a
+            # decided verdict stops the fetching as early as possible
+            while True:
+                try:
+                    index, decided = (replies.get_nowait() if free else
+                                      _reply(replies, future))
+                except queue.Empty:
+                    break
+                free.append(slots[index])
+                if short_circuit and decided:
+                    short_circuited = True
+                    break
+            if short_circuited:
+                break
+
+            header, parts = encode_batch(batch, len(keys))
+            slot = free.pop()
+            requests.put(('batch', slot.index, slot.write(parts), header))
+    finally:
+        requests.put(('end', short_circuited))
+        try:
+            outcomes = future.result()
+        finally:
+            for slot in slots:
+                slot.release()
+
+    for outcome in outcomes:
+        for _, result in outcome.failed:
+            result.erroneous_rows = _records(result.erroneous_rows, keys)
+            result.sampled_rows = _records(result.sampled_rows, keys)
+    return outcomes
+
+
+def batched(rows, size=TRANSFER_ROWS):
+    """Split a result fetched as a whole into batches."""
+
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]